@@ -0,0 +1,133 @@
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Awaitable, Callable, List, Optional, Tuple
+import os, time, logging
+
+# Contesto della conversazione ricostruito lato server: il client manda solo il nuovo messaggio,
+# il server tiene in cache per sessione la finestra degli ultimi messaggi e la tronca a un budget
+# di token. Opzionalmente i turni che escono dalla finestra confluiscono in un riassunto rolling
+# salvato sulla sessione (contextSummary / contextSummaryUntil).
+
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "6000"))
+CONTEXT_MAX_MESSAGES = int(os.environ.get("CONTEXT_MAX_MESSAGES", "200"))
+CONTEXT_CACHE_SIZE = int(os.environ.get("CONTEXT_CACHE_SIZE", "2000"))
+CONTEXT_CACHE_TTL = float(os.environ.get("CONTEXT_CACHE_TTL", "600"))
+CONTEXT_SUMMARY = os.environ.get("CONTEXT_SUMMARY", "0") == "1"
+CONTEXT_SUMMARY_MIN_TOKENS = int(os.environ.get("CONTEXT_SUMMARY_MIN_TOKENS", "1000"))
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 caratteri per token più l'overhead per messaggio del formato chat
+    return len(text) // 4 + 4
+
+
+class ContextWindow:
+    def __init__(self, version: Optional[datetime], messages: List[dict], summary: Optional[str] = None, summary_until: Optional[datetime] = None):
+        self.version = version
+        self.summary = summary
+        self.summary_until = summary_until
+        self.summarizing = False
+        self.messages = deque(maxlen=CONTEXT_MAX_MESSAGES)
+        for m in messages:
+            self.append(m["role"], m.get("content", ""), m.get("createdAt"))
+
+    def append(self, role: str, content: str, createdAt: Optional[datetime] = None):
+        self.messages.append({"role": role, "content": content, "createdAt": createdAt or datetime.utcnow(), "tokens": estimate_tokens(content)})
+
+    def build(self, budget: int = CONTEXT_TOKEN_BUDGET, system: Optional[str] = None) -> Tuple[List[dict], List[dict]]:
+        # Ritorna (messaggi per il provider, messaggi non coperti dal riassunto rimasti fuori dal budget)
+        head = []
+        if system:
+            head.append({"role": "system", "content": system})
+        if self.summary:
+            head.append({"role": "system", "content": f"Riassunto della conversazione precedente:\n{self.summary}"})
+        used = sum(estimate_tokens(m["content"]) for m in head)
+        kept: List[dict] = []
+        dropped: List[dict] = []
+        for m in reversed(self.messages):
+            if self.summary_until and m["createdAt"] <= self.summary_until:
+                break
+            # la finestra resta contigua; l'ultimo messaggio (la domanda corrente) entra sempre
+            if dropped or (kept and used + m["tokens"] > budget):
+                dropped.append(m)
+            else:
+                kept.append(m)
+                used += m["tokens"]
+        kept.reverse()
+        dropped.reverse()
+        return head + [{"role": m["role"], "content": m["content"]} for m in kept], dropped
+
+
+class ContextCache:
+    def __init__(self, maxsize: int = CONTEXT_CACHE_SIZE, ttl: float = CONTEXT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sid: str, version: Optional[datetime]) -> Optional[ContextWindow]:
+        # version = updatedAt della sessione: se un altro worker ha scritto la sessione la finestra è scaduta
+        entry = self._entries.get(sid)
+        if entry is None or entry[1] <= time.monotonic() or entry[0].version != version:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(sid)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, sid: str, window: ContextWindow):
+        if self.maxsize <= 0:
+            return
+        self._entries[sid] = (window, time.monotonic() + self.ttl)
+        self._entries.move_to_end(sid)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, sid: str):
+        self._entries.pop(sid, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses, "hitRatio": round(self.hits / lookups, 4) if lookups else 0.0}
+
+
+context_cache = ContextCache()
+
+
+async def load_window(db, sess: dict) -> ContextWindow:
+    q = {"sessionId": sess["_id"], "ownerId": sess["ownerId"]}
+    if sess.get("contextSummaryUntil"):
+        q["createdAt"] = {"$gt": sess["contextSummaryUntil"]}
+    docs = await db.messages.find(q, {"role": 1, "content": 1, "createdAt": 1}).sort([("createdAt", -1), ("_id", -1)]).limit(CONTEXT_MAX_MESSAGES).to_list(CONTEXT_MAX_MESSAGES)
+    docs.reverse()
+    return ContextWindow(sess.get("updatedAt"), docs, sess.get("contextSummary"), sess.get("contextSummaryUntil"))
+
+
+async def get_window(db, sess: dict) -> ContextWindow:
+    window = context_cache.get(sess["_id"], sess.get("updatedAt"))
+    if window is None:
+        window = await load_window(db, sess)
+        context_cache.put(sess["_id"], window)
+    return window
+
+
+async def refresh_summary(db, sid: str, window: ContextWindow, dropped: List[dict], summarize: Callable[[Optional[str], List[dict]], Awaitable[str]]):
+    # Da lanciare in background dopo la risposta: non rallenta il turno corrente.
+    if not CONTEXT_SUMMARY or window.summarizing or sum(m["tokens"] for m in dropped) < CONTEXT_SUMMARY_MIN_TOKENS:
+        return
+    window.summarizing = True
+    try:
+        summary = await summarize(window.summary, dropped)
+        if not summary:
+            return
+        until = dropped[-1]["createdAt"]
+        await db.sessions.update_one({"_id": sid}, {"$set": {"contextSummary": summary, "contextSummaryUntil": until}})
+        window.summary, window.summary_until = summary, until
+    except Exception as e:
+        logging.warning(f"Context summary failed for {sid}: {e}")
+    finally:
+        window.summarizing = False
@@ -0,0 +1,85 @@
+from concurrent.futures import ThreadPoolExecutor
+from passlib.hash import bcrypt
+import os, asyncio, time
+
+# bcrypt costa 100-300 ms di CPU per chiamata: eseguirlo sull'event loop blocca tutti gli stream SSE
+# del worker. Le operazioni passano da un pool di thread dimensionato (la libreria bcrypt rilascia il GIL)
+# con una coda limitata: oltre il limite si rifiuta subito invece di accumulare latenza.
+
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get("PASSWORD_HASH_MAX_PENDING", "32"))
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+
+
+class HashPoolSaturated(RuntimeError):
+    pass
+
+
+class HashPool:
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING, rounds: int = BCRYPT_ROUNDS):
+        # workers=0 esegue inline sull'event loop (solo per confronto nei benchmark)
+        self.workers = workers
+        self.max_pending = max_pending
+        self.hasher = bcrypt.using(rounds=rounds)
+        self.executor = None
+        self.pending = 0
+        self.max_pending_seen = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.run_total = 0.0
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HashPoolSaturated(f"Password hash pool saturated ({self.pending} pending)")
+        self.pending += 1
+        self.max_pending_seen = max(self.max_pending_seen, self.pending)
+        queued = time.perf_counter()
+
+        def timed():
+            started = time.perf_counter()
+            result = fn(*args)
+            return result, started - queued, time.perf_counter() - started
+
+        try:
+            if self.workers <= 0:
+                result, waited, ran = timed()
+            else:
+                if self.executor is None:
+                    self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pwhash")
+                result, waited, ran = await asyncio.get_running_loop().run_in_executor(self.executor, timed)
+        finally:
+            self.pending -= 1
+        self.completed += 1
+        self.wait_total += waited
+        self.run_total += ran
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.hasher.hash, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        if not hashed:
+            return False
+        return await self._run(bcrypt.verify, password, hashed)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "maxPending": self.max_pending,
+            "maxPendingSeen": self.max_pending_seen,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avgWaitMs": round(self.wait_total / self.completed * 1000, 2) if self.completed else 0.0,
+            "avgRunMs": round(self.run_total / self.completed * 1000, 2) if self.completed else 0.0,
+        }
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+hash_pool = HashPool()
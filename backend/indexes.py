@@ -0,0 +1,127 @@
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from typing import Dict, List
+import logging
+
+# Indici richiesti dalle query del router. create_indexes è idempotente: se l'indice esiste
+# con la stessa definizione Mongo non fa nulla, quindi può girare ad ogni avvio.
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        # unique: chiude anche la race di due register concorrenti con la stessa email
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    "sessions": [
+        # sessions_list: {ownerId} sort updatedAt, _id desc (keyset); serve anche delete_many({ownerId})
+        IndexModel([("ownerId", ASCENDING), ("updatedAt", DESCENDING), ("_id", DESCENDING)], name="owner_updated_id"),
+    ],
+    "messages": [
+        # messages_get: {sessionId, ownerId} sort createdAt, _id (keyset); il prefisso ownerId serve delete_many({ownerId})
+        IndexModel([("ownerId", ASCENDING), ("sessionId", ASCENDING), ("createdAt", ASCENDING), ("_id", ASCENDING)], name="owner_session_created_id"),
+    ],
+    "completion_cache": [
+        # tier Mongo della cache risposte (RESPONSE_CACHE_MONGO): Mongo elimina i documenti scaduti
+        IndexModel([("expiresAt", ASCENDING)], name="expires_ttl", expireAfterSeconds=0),
+    ],
+}
+
+# Query calde del router nella forma (collection, filter, sort) usata da verify_query_plans.
+HOT_QUERIES = [
+    ("users", {"email": "probe@example.com"}, None),
+    ("sessions", {"ownerId": "probe"}, [("updatedAt", DESCENDING), ("_id", DESCENDING)]),
+    ("sessions", {"_id": "probe", "ownerId": "probe"}, None),
+    ("messages", {"sessionId": "probe", "ownerId": "probe"}, [("createdAt", DESCENDING), ("_id", DESCENDING)]),
+]
+
+
+class QueryPlanError(RuntimeError):
+    pass
+
+
+class DuplicateEmailsError(RuntimeError):
+    pass
+
+
+async def duplicate_emails(db, limit: int = 0) -> List[dict]:
+    # email registrate più volte (race di register prima di email_unique); ids dal più vecchio
+    pipeline = [
+        {"$sort": {"createdAt": 1, "_id": 1}},
+        {"$group": {"_id": "$email", "n": {"$sum": 1}, "ids": {"$push": "$_id"}}},
+        {"$match": {"n": {"$gt": 1}}},
+    ]
+    if limit:
+        pipeline.append({"$limit": limit})
+    return await db.users.aggregate(pipeline, allowDiskUse=True).to_list(None)
+
+
+async def dedupe_emails(db) -> int:
+    # tiene l'account più vecchio per ogni email e gli sposta sessioni e messaggi dei doppioni
+    merged = 0
+    for dup in await duplicate_emails(db):
+        keep, others = dup["ids"][0], dup["ids"][1:]
+        await db.sessions.update_many({"ownerId": {"$in": others}}, {"$set": {"ownerId": keep}})
+        await db.messages.update_many({"ownerId": {"$in": others}}, {"$set": {"ownerId": keep}})
+        await db.users.delete_many({"_id": {"$in": others}})
+        merged += len(others)
+        logging.warning(f"Merged {len(others)} duplicate account(s) for {dup['_id']} into {keep}")
+    return merged
+
+
+async def ensure_indexes(db):
+    # email_unique su un database esistente: i doppioni lasciati dalla vecchia race farebbero fallire
+    # create_indexes con un DuplicateKeyError poco chiaro, meglio dire cosa fare
+    if "email_unique" not in await db.users.index_information():
+        dups = await duplicate_emails(db, limit=5)
+        if dups:
+            raise DuplicateEmailsError(
+                "Cannot create unique index users.email_unique: some emails are registered more than once "
+                f"(e.g. {', '.join(repr(d['_id']) for d in dups)}). Merge them with "
+                "`python backend/indexes.py --dedupe-emails` (keeps the oldest account and moves sessions and "
+                "messages to it), or start with MONGO_ENSURE_INDEXES=0 until then."
+            )
+    for coll, models in INDEXES.items():
+        names = await db[coll].create_indexes(models)
+        logging.info(f"Indexes ready on {coll}: {', '.join(names)}")
+
+
+def plan_stages(plan: dict) -> List[str]:
+    stages = [plan.get("stage")] if plan.get("stage") else []
+    if "inputStage" in plan:
+        stages += plan_stages(plan["inputStage"])
+    for child in plan.get("inputStages", []):
+        stages += plan_stages(child)
+    if "queryPlan" in plan:  # explain con slot-based engine (Mongo >= 7)
+        stages += plan_stages(plan["queryPlan"])
+    return stages
+
+
+async def explain_stages(db, coll: str, filter: dict, sort=None) -> List[str]:
+    cmd = {"find": coll, "filter": filter}
+    if sort:
+        cmd["sort"] = dict(sort)
+    res = await db.command("explain", cmd, verbosity="queryPlanner")
+    return plan_stages(res["queryPlanner"]["winningPlan"])
+
+
+async def verify_query_plans(db):
+    failures = []
+    for coll, filter, sort in HOT_QUERIES:
+        stages = await explain_stages(db, coll, filter, sort)
+        if "COLLSCAN" in stages:
+            failures.append(f"{coll} {filter} sort={sort}: {' <- '.join(stages)}")
+    if failures:
+        raise QueryPlanError("Hot queries fall back to COLLSCAN:\n" + "\n".join(failures))
+
+
+if __name__ == "__main__":
+    # Self-check manuale: python indexes.py [--dedupe-emails] (usa MONGO_URL / DB_NAME)
+    import asyncio, os, sys
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    async def main():
+        db = AsyncIOMotorClient(os.environ["MONGO_URL"])[os.environ.get("DB_NAME", "chatdb")]
+        if "--dedupe-emails" in sys.argv:
+            print(f"Merged {await dedupe_emails(db)} duplicate account(s)")
+        await ensure_indexes(db)
+        await verify_query_plans(db)
+        print("OK: indexes present, no COLLSCAN on hot queries")
+
+    asyncio.run(main())
@@ -0,0 +1,220 @@
+from bisect import bisect_left
+from contextvars import ContextVar
+from itertools import product
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import os, time, asyncio
+from pymongo import monitoring
+
+# Metriche in formato testo Prometheus per /api/metrics, senza dipendenze esterne.
+# Le serie per ogni combinazione di label sono create all'avvio: il percorso caldo fa solo un
+# lookup e qualche incremento di interi, senza allocazioni per chunk. Valori di label non
+# previsti finiscono nella serie "other".
+# I tempi Mongo arrivano dal CommandListener di pymongo (tutte le chiamate, senza wrapper);
+# con METRICS_SERVER_TIMING=1 le risposte JSON hanno un header Server-Timing (auth, db, app).
+
+METRICS_LOOP_LAG_INTERVAL = float(os.environ.get("METRICS_LOOP_LAG_INTERVAL", "0.25"))
+METRICS_SERVER_TIMING = os.environ.get("METRICS_SERVER_TIMING", "0") == "1"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TTFT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 30.0)
+CHUNK_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def _fmt(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+class _Series:
+    __slots__ = ("labels", "bounds", "counts", "sum", "count")
+
+    def __init__(self, labels: str, bounds: Tuple[float, ...] = ()):
+        self.labels = labels
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v: float):
+        # chiamato anche dai thread di motor (listener): sotto GIL al massimo si perde un incremento
+        self.counts[bisect_left(self.bounds, v)] += 1
+        self.sum += v
+        self.count += 1
+
+    def inc(self, n: float = 1):
+        self.sum += n
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Optional[Dict[str, Sequence[str]]] = None, buckets: Tuple[float, ...] = ()):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.labelnames = list(labels or {})
+        self._series: Dict[tuple, _Series] = {}
+        values = [list(v) + ["other"] for v in (labels or {}).values()]
+        for combo in product(*values):
+            text = ",".join(f'{k}="{v}"' for k, v in zip(self.labelnames, combo))
+            self._series[combo] = _Series(text, buckets)
+        self._other = self._series[tuple("other" for _ in self.labelnames)] if self.labelnames else None
+        self._default = self._series[()] if not self.labelnames else None
+
+    def labels(self, *values: str) -> _Series:
+        return self._series.get(values) or self._other
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def observe(self, v: float):
+        self._default.observe(v)
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for s in self._series.values():
+            sep = "," if s.labels else ""
+            acc = 0
+            for bound, n in zip(self.buckets, s.counts):
+                acc += n
+                out.append(f'{self.name}_bucket{{{s.labels}{sep}le="{_fmt(bound)}"}} {acc}')
+            out.append(f'{self.name}_bucket{{{s.labels}{sep}le="+Inf"}} {s.count}')
+            lbl = f"{{{s.labels}}}" if s.labels else ""
+            out.append(f"{self.name}_sum{lbl} {_fmt(s.sum)}")
+            out.append(f"{self.name}_count{lbl} {s.count}")
+        return out
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, n: float = 1):
+        self._default.sum += n
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for s in self._series.values():
+            lbl = f"{{{s.labels}}}" if s.labels else ""
+            out.append(f"{self.name}{lbl} {_fmt(s.sum)}")
+        return out
+
+
+MONGO_COLLECTIONS = ("users", "sessions", "messages", "completion_cache")
+MONGO_OPS = ("find", "insert", "update", "delete", "aggregate", "getMore", "count", "findAndModify", "createIndexes", "explain")
+
+CURRENT_USER = Histogram("chat_current_user_seconds", "Durata della dipendenza current_user (JWT + utente).", buckets=LATENCY_BUCKETS)
+MONGO_OP = Histogram("chat_mongo_op_seconds", "Durata dei comandi Mongo per collection e operazione.", {"collection": MONGO_COLLECTIONS, "op": MONGO_OPS}, LATENCY_BUCKETS)
+MONGO_ERRORS = Counter("chat_mongo_errors_total", "Comandi Mongo falliti per collection.", {"collection": MONGO_COLLECTIONS})
+UPSTREAM_CONNECT = Histogram("chat_upstream_connect_seconds", "Tempo dall'invio della richiesta al provider agli header della risposta.", buckets=LATENCY_BUCKETS)
+UPSTREAM_TTFT = Histogram("chat_upstream_ttft_seconds", "Tempo al primo token in openai_stream_generator.", buckets=TTFT_BUCKETS)
+STREAM_CHUNKS = Histogram("chat_stream_chunks", "Frame chunk inviati per stream (dopo il coalescing).", buckets=CHUNK_BUCKETS)
+STREAM_BYTES = Histogram("chat_stream_bytes", "Byte di testo (UTF-8) generati per stream.", buckets=BYTES_BUCKETS)
+MOCK_FALLBACK = Counter("chat_mock_fallback_total", "Stream ripiegati su mock_delta per errore del provider.")
+LOOP_LAG = Histogram("chat_event_loop_lag_seconds", "Ritardo dell'event loop misurato con uno sleep periodico.", buckets=LAG_BUCKETS)
+
+REGISTRY: List[_Metric] = [CURRENT_USER, MONGO_OP, MONGO_ERRORS, UPSTREAM_CONNECT, UPSTREAM_TTFT, STREAM_CHUNKS, STREAM_BYTES, MOCK_FALLBACK, LOOP_LAG]
+
+
+def render(extra: Iterable[_Metric] = ()) -> str:
+    lines: List[str] = []
+    for m in (*REGISTRY, *extra):
+        lines += m.render()
+    return "\n".join(lines) + "\n"
+
+
+class RequestTiming:
+    __slots__ = ("start", "auth", "db", "db_ops")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.auth = 0.0
+        self.db = 0.0
+        self.db_ops = 0
+
+    def header(self) -> bytes:
+        app = (time.perf_counter() - self.start) * 1000
+        return f'auth;dur={self.auth * 1000:.2f}, db;dur={self.db * 1000:.2f};desc="{self.db_ops} ops", app;dur={app:.2f}'.encode()
+
+
+request_timing: ContextVar[Optional[RequestTiming]] = ContextVar("request_timing", default=None)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    def __init__(self):
+        self._pending: Dict[int, str] = {}
+
+    def started(self, event):
+        coll = event.command.get("collection") if event.command_name == "getMore" else event.command.get(event.command_name)
+        self._pending[event.request_id] = coll if isinstance(coll, str) else "other"
+
+    def succeeded(self, event):
+        self._done(event)
+
+    def failed(self, event):
+        MONGO_ERRORS.labels(self._pending.get(event.request_id, "other")).inc()
+        self._done(event)
+
+    def _done(self, event):
+        coll = self._pending.pop(event.request_id, "other")
+        secs = event.duration_micros / 1e6
+        MONGO_OP.labels(coll, event.command_name).observe(secs)
+        # motor copia il contesto nel thread del comando: la timing della richiesta è visibile qui
+        timing = request_timing.get()
+        if timing is not None:
+            timing.db += secs
+            timing.db_ops += 1
+
+
+mongo_listener = MongoCommandMetrics()
+
+
+class ServerTimingMiddleware:
+    # ASGI puro (non BaseHTTPMiddleware): non bufferizza gli stream SSE
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        timing = RequestTiming()
+        token = request_timing.set(timing)
+
+        async def send_timed(message):
+            if message["type"] == "http.response.start":
+                headers = message.get("headers") or []
+                if any(k == b"content-type" and v.startswith(b"application/json") for k, v in headers):
+                    message["headers"] = [*headers, (b"server-timing", timing.header())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            request_timing.reset(token)
+
+
+_lag_task: Optional[asyncio.Task] = None
+
+
+async def _loop_lag_monitor(interval: float):
+    while True:
+        t = time.perf_counter()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(0.0, time.perf_counter() - t - interval))
+
+
+def start_loop_monitor(interval: float = METRICS_LOOP_LAG_INTERVAL):
+    global _lag_task
+    if interval > 0 and (_lag_task is None or _lag_task.done()):
+        _lag_task = asyncio.create_task(_loop_lag_monitor(interval))
+
+
+def stop_loop_monitor():
+    global _lag_task
+    if _lag_task is not None:
+        _lag_task.cancel()
+        _lag_task = None
@@ -0,0 +1,30 @@
+from datetime import datetime
+from typing import Tuple
+import base64, json
+
+# Cursori keyset opachi: (timestamp, _id) codificati in base64url. Il tie-break su _id rende
+# l'ordinamento totale anche con più documenti nello stesso millisecondo.
+
+DEFAULT_PAGE = 50
+MAX_PAGE = 200
+
+
+def encode_cursor(ts: datetime, _id: str) -> str:
+    raw = json.dumps([ts.isoformat(), _id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        ts, _id = json.loads(raw)
+        return datetime.fromisoformat(ts), str(_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def keyset_filter(field: str, cursor: str, older: bool) -> dict:
+    # older=True: documenti che vengono prima del cursore nell'ordine (field, _id)
+    ts, _id = decode_cursor(cursor)
+    op = "$lt" if older else "$gt"
+    return {"$or": [{field: {op: ts}}, {field: ts, "_id": {op: _id}}]}
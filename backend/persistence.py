@@ -0,0 +1,94 @@
+from typing import List, Optional
+from datetime import datetime
+import os, time, asyncio, logging
+
+# Persistenza progressiva della risposta dell'assistente durante lo streaming.
+# I delta finiscono in un buffer a lista (niente `full += delta` quadratico) e vengono scritti
+# a blocchi, per dimensione o per tempo. Solo il primo blocco crea il documento (upsert); i
+# successivi accodano la parte nuova con un update a pipeline ($concat), così i byte scritti
+# crescono con la risposta e non col quadrato. contentLen (caratteri già salvati) fa da guardia:
+# se una scrittura precedente ha avuto esito incerto l'append non combacia e si riscrive tutto.
+# Le scritture intermedie girano in background: il percorso dei token non aspetta mai Mongo.
+
+PERSIST_FLUSH_BYTES = int(os.environ.get("PERSIST_FLUSH_BYTES", "2048"))
+PERSIST_FLUSH_INTERVAL = float(os.environ.get("PERSIST_FLUSH_INTERVAL", "0.5"))
+
+
+class StreamWriter:
+    def __init__(self, db, doc: dict, flush_bytes: int = PERSIST_FLUSH_BYTES, flush_interval: float = PERSIST_FLUSH_INTERVAL):
+        self.db = db
+        self.id = doc["_id"]
+        self.session_id = doc["sessionId"]
+        # campi immutabili scritti solo alla creazione del documento
+        self.static = {k: v for k, v in doc.items() if k not in ("_id", "content", "status")}
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.parts: List[str] = []
+        self.pending = 0
+        self.last_flush = time.monotonic()
+        self.flushes = 0
+        self.written = 0
+        self.failed = False
+        self.closed = False
+        self._task: Optional[asyncio.Task] = None
+        self._final: Optional[asyncio.Task] = None
+
+    def add(self, delta: str):
+        self.parts.append(delta)
+        self.pending += len(delta)
+        if self._task is None and (self.pending >= self.flush_bytes or time.monotonic() - self.last_flush >= self.flush_interval):
+            self._task = asyncio.create_task(self._flush("streaming"))
+
+    def text(self) -> str:
+        if len(self.parts) > 1:
+            self.parts[:] = ["".join(self.parts)]
+        return self.parts[0] if self.parts else ""
+
+    async def _write(self, content: str, status: str):
+        offset, end = self.written, len(content)
+        if offset == 0:
+            await self.db.messages.update_one({"_id": self.id}, {"$set": {"content": content, "status": status, "contentLen": end}, "$setOnInsert": self.static}, upsert=True)
+        else:
+            # $literal: un delta che inizia con "$" non va letto come nome di campo
+            append = [{"$set": {"content": {"$concat": ["$content", {"$literal": content[offset:]}]}, "status": status, "contentLen": end}}]
+            res = await self.db.messages.update_one({"_id": self.id, "contentLen": offset}, append)
+            if res.matched_count == 0:
+                await self.db.messages.update_one({"_id": self.id}, {"$set": {"content": content, "status": status, "contentLen": end}})
+        self.written = end
+
+    async def _flush(self, status: str, session_touch: Optional[datetime] = None):
+        content = self.text()
+        self.pending = 0
+        self.last_flush = time.monotonic()
+        writes = [self._write(content, status)]
+        if session_touch is not None:
+            writes.append(self.db.sessions.update_one({"_id": self.session_id}, {"$set": {"updatedAt": session_touch}}))
+        try:
+            await asyncio.gather(*writes)
+            self.flushes += 1
+        except Exception as e:
+            self.failed = True
+            logging.warning(f"Persist of message {self.id} ({status}) failed: {e}")
+        finally:
+            if status == "streaming":
+                self._task = None
+
+    async def close(self, status: str, session_touch: Optional[datetime] = None) -> bool:
+        # Scrittura finale (complete/aborted) dopo quella eventualmente in corso, per non invertirne l'ordine.
+        # Protetta dalla cancellazione (stop o orphan timer durante la chiusura): closed è già True,
+        # nessuno la ripeterebbe e il messaggio resterebbe "streaming".
+        self.closed = True
+        self._final = asyncio.ensure_future(self._finish(status, session_touch))
+        await asyncio.shield(self._final)
+        return not self.failed
+
+    async def wait_closed(self):
+        # per chi è stato cancellato dentro close(): la scrittura finale prosegue, qui la si aspetta
+        if self._final is not None:
+            await asyncio.shield(self._final)
+
+    async def _finish(self, status: str, session_touch: Optional[datetime]):
+        if self._task is not None:
+            await self._task
+        self.failed = False
+        await self._flush(status, session_touch)
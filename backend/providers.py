@@ -0,0 +1,275 @@
+from collections import deque
+from typing import AsyncGenerator, Deque, Dict, List, Optional, Tuple
+import os, json, time, asyncio, logging
+import upstream
+
+# Router dei provider LLM OpenAI-compatibili. Ogni modello (alias usato dal client) è servito da
+# uno o più provider in ordine di priorità, ciascuno con un limite di stream concorrenti e un
+# circuit breaker su tasso di errori / lentezza del primo token. Prima del primo token un errore
+# passa al provider successivo (failover); con ROUTER_HEDGE_DELAY > 0, se il primo token non
+# arriva entro la soglia parte una richiesta in parallelo sul provider successivo e il perdente
+# viene cancellato.
+#
+# LLM_PROVIDERS: JSON (o percorso di un file JSON), es.
+#   [{"name": "openai", "base_url": "https://api.openai.com/v1", "api_key_env": "OPENAI_API_KEY",
+#     "models": {"gpt-4o": "gpt-4o", "gpt-4o-mini": "gpt-4o-mini"}, "max_concurrency": 100}]
+# Senza LLM_PROVIDERS c'è un solo provider da OPENAI_BASE_URL / OPENAI_API_KEY.
+
+LLM_PROVIDERS = os.environ.get("LLM_PROVIDERS", "")
+LLM_DEFAULT_MODEL = os.environ.get("LLM_DEFAULT_MODEL", "gpt-4o-mini")
+ROUTER_FIRST_TOKEN_TIMEOUT = float(os.environ.get("ROUTER_FIRST_TOKEN_TIMEOUT", "30"))
+ROUTER_HEDGE_DELAY = float(os.environ.get("ROUTER_HEDGE_DELAY", "0"))
+ROUTER_MAX_HEDGES = int(os.environ.get("ROUTER_MAX_HEDGES", "1"))
+ROUTER_BREAKER_WINDOW = int(os.environ.get("ROUTER_BREAKER_WINDOW", "20"))
+ROUTER_BREAKER_MIN_REQUESTS = int(os.environ.get("ROUTER_BREAKER_MIN_REQUESTS", "5"))
+ROUTER_BREAKER_ERROR_RATE = float(os.environ.get("ROUTER_BREAKER_ERROR_RATE", "0.5"))
+ROUTER_BREAKER_SLOW_TTFT = float(os.environ.get("ROUTER_BREAKER_SLOW_TTFT", "10"))
+ROUTER_BREAKER_COOLDOWN = float(os.environ.get("ROUTER_BREAKER_COOLDOWN", "30"))
+
+DEFAULT_MODELS = {"gpt-4o": "gpt-4o", "gpt-4o-mini": "gpt-4o-mini"}
+
+
+class ProviderUnavailable(upstream.UpstreamError):
+    pass
+
+
+class CircuitBreaker:
+    # closed → open quando nella finestra gli esiti cattivi (errore o primo token oltre slow_ttft)
+    # superano error_rate; dopo cooldown passa half_open e lascia passare una sola richiesta di prova.
+    def __init__(self, window: int = ROUTER_BREAKER_WINDOW, min_requests: int = ROUTER_BREAKER_MIN_REQUESTS, error_rate: float = ROUTER_BREAKER_ERROR_RATE, slow_ttft: float = ROUTER_BREAKER_SLOW_TTFT, cooldown: float = ROUTER_BREAKER_COOLDOWN):
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.slow_ttft = slow_ttft
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.open_until = 0.0
+        self.probing = False
+        self.opened = 0
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() >= self.open_until:
+            self.state = "half_open"
+        if self.state == "half_open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record(self, ok: bool, ttft: Optional[float] = None):
+        bad = not ok or (ttft is not None and ttft > self.slow_ttft)
+        if self.state == "half_open":
+            self.probing = False
+            if bad:
+                self._open()
+            else:
+                self.state = "closed"
+                self.outcomes.clear()
+            return
+        self.outcomes.append(bad)
+        if self.state == "closed" and len(self.outcomes) >= self.min_requests and sum(self.outcomes) / len(self.outcomes) >= self.error_rate:
+            self._open()
+
+    def release_probe(self):
+        # richiesta di prova finita senza esito (cancellata): la prossima potrà riprovare
+        if self.state == "half_open":
+            self.probing = False
+
+    def _open(self):
+        self.state = "open"
+        self.open_until = time.monotonic() + self.cooldown
+        self.outcomes.clear()
+        self.opened += 1
+
+
+class Provider:
+    def __init__(self, name: str, base_url: str, api_key: Optional[str], models: Dict[str, str], max_concurrency: int = upstream.UPSTREAM_PER_HOST_LIMIT, breaker: Optional[CircuitBreaker] = None):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.models = models
+        self.max_concurrency = max_concurrency
+        self.breaker = breaker or CircuitBreaker()
+        self.active = 0
+        self.requests = 0
+        self.errors = 0
+        self.wins = 0
+
+    def available(self) -> bool:
+        return self.active < self.max_concurrency and self.breaker.allow()
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "state": self.breaker.state,
+            "active": self.active,
+            "limit": self.max_concurrency,
+            "requests": self.requests,
+            "errors": self.errors,
+            "wins": self.wins,
+            "opened": self.breaker.opened,
+        }
+
+
+class _Attempt:
+    def __init__(self, provider: Provider, payload: dict, hedge: bool = False):
+        self.provider = provider
+        self.hedge = hedge
+        self.started = time.monotonic()
+        self.ttft: Optional[float] = None
+        self.done = False
+        provider.active += 1
+        provider.requests += 1
+        self.gen = upstream.stream_chat_completion(payload, provider.api_key, base_url=provider.base_url)
+        self.first = asyncio.ensure_future(self.gen.__anext__())
+
+    def finish(self, ok: Optional[bool]):
+        # ok None = cancellata (hedge perso o client andato): non conta per il breaker
+        if self.done:
+            return
+        self.done = True
+        self.provider.active -= 1
+        if ok is None:
+            self.provider.breaker.release_probe()
+            return
+        if not ok:
+            self.provider.errors += 1
+        self.provider.breaker.record(ok, self.ttft)
+
+    async def cancel(self, ok: Optional[bool] = None):
+        # la cancellazione del task di __anext__ chiude anche il generatore (e la risposta httpx)
+        if not self.first.done():
+            self.first.cancel()
+            await asyncio.gather(self.first, return_exceptions=True)
+        else:
+            await self.gen.aclose()
+        self.finish(ok)
+
+
+class ProviderRouter:
+    def __init__(self, providers: List[Provider], default_model: str = LLM_DEFAULT_MODEL, first_token_timeout: float = ROUTER_FIRST_TOKEN_TIMEOUT, hedge_delay: float = ROUTER_HEDGE_DELAY, max_hedges: int = ROUTER_MAX_HEDGES):
+        self.providers = providers
+        self.default_model = default_model
+        self.first_token_timeout = first_token_timeout
+        self.hedge_delay = hedge_delay
+        self.max_hedges = max_hedges
+        self.failovers = 0
+        self.hedges = 0
+        self.hedges_won = 0
+
+    def resolve(self, model: str) -> str:
+        return model if any(model in p.models for p in self.providers) else self.default_model
+
+    def candidates(self, model: str) -> List[Provider]:
+        return [p for p in self.providers if model in p.models]
+
+    async def stream(self, model: str, payload: dict) -> AsyncGenerator[str, None]:
+        model = self.resolve(model)
+        queue = self.candidates(model)
+        if not queue:
+            raise ProviderUnavailable(f"No LLM provider configured for {model} (OPENAI_API_KEY / LLM_PROVIDERS)")
+        racing: List[_Attempt] = []
+        last_error: Optional[BaseException] = None
+        hedges = 0
+        winner: Optional[Tuple[_Attempt, Optional[str]]] = None
+
+        def launch(hedge: bool = False) -> bool:
+            while queue:
+                p = queue.pop(0)
+                if p.available():
+                    racing.append(_Attempt(p, {**payload, "model": p.models[model]}, hedge))
+                    return True
+            return False
+
+        try:
+            if not launch():
+                raise ProviderUnavailable(f"All providers for {model} are saturated or circuit-open")
+            while winner is None:
+                now = time.monotonic()
+                hedge_at = racing[0].started + self.hedge_delay if self.hedge_delay > 0 and hedges < self.max_hedges and queue else None
+                deadline = min(a.started + self.first_token_timeout for a in racing)
+                wake = min(deadline, hedge_at) if hedge_at is not None else deadline
+                done, _ = await asyncio.wait([a.first for a in racing], timeout=max(0.0, wake - now), return_when=asyncio.FIRST_COMPLETED)
+                for a in [a for a in racing if a.first in done]:
+                    racing.remove(a)
+                    try:
+                        delta = a.first.result()
+                    except StopAsyncIteration:
+                        delta = None  # risposta vuota: comunque un successo
+                    except Exception as e:
+                        a.finish(False)
+                        last_error = e
+                        logging.warning(f"Provider {a.provider.name} failed before first token: {e}")
+                        continue
+                    a.ttft = time.monotonic() - a.started
+                    winner = (a, delta)
+                    break
+                if winner is not None:
+                    break
+                now = time.monotonic()
+                for a in [a for a in racing if now >= a.started + self.first_token_timeout]:
+                    racing.remove(a)
+                    await a.cancel(False)
+                    last_error = upstream.UpstreamError(f"Provider {a.provider.name}: no first token in {self.first_token_timeout}s")
+                if not racing:
+                    # failover: nessun token ancora inviato, si può ripartire dal provider successivo
+                    if not launch():
+                        raise last_error or ProviderUnavailable(f"No provider available for {model}")
+                    self.failovers += 1
+                elif hedge_at is not None and now >= hedge_at and launch(hedge=True):
+                    hedges += 1
+                    self.hedges += 1
+        except BaseException:
+            for a in racing:
+                await a.cancel()
+            raise
+
+        attempt, delta = winner
+        for a in racing:
+            await a.cancel()
+        attempt.provider.wins += 1
+        if attempt.hedge:
+            self.hedges_won += 1
+        try:
+            if delta is not None:
+                yield delta
+                async for delta in attempt.gen:
+                    yield delta
+            attempt.finish(True)
+        except (asyncio.CancelledError, GeneratorExit):
+            await attempt.gen.aclose()
+            attempt.finish(None)
+            raise
+        except Exception:
+            attempt.finish(False)
+            raise
+
+    def stats(self) -> dict:
+        return {
+            "hedgeDelay": self.hedge_delay,
+            "failovers": self.failovers,
+            "hedges": self.hedges,
+            "hedgesWon": self.hedges_won,
+            "providers": [p.stats() for p in self.providers],
+        }
+
+
+def load_providers(spec: str = LLM_PROVIDERS) -> List[Provider]:
+    if not spec:
+        key = os.environ.get("OPENAI_API_KEY")
+        return [Provider("openai", upstream.OPENAI_BASE_URL, key, dict(DEFAULT_MODELS))] if key else []
+    if not spec.lstrip().startswith("["):
+        with open(spec) as f:
+            spec = f.read()
+    out = []
+    for item in json.loads(spec):
+        models = item.get("models") or DEFAULT_MODELS
+        if isinstance(models, list):
+            models = {m: m for m in models}
+        key = item.get("api_key") or os.environ.get(item.get("api_key_env", ""), None)
+        out.append(Provider(item["name"], item["base_url"], key, models, int(item.get("max_concurrency", upstream.UPSTREAM_PER_HOST_LIMIT))))
+    return out
+
+
+router = ProviderRouter(load_providers())
@@ -0,0 +1,120 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import AsyncGenerator, List, Optional
+import os, re, json, asyncio, hashlib, logging
+
+# Cache delle risposte per prompt deterministici (temperature 0), opt-in con RESPONSE_CACHE=1.
+# Chiave = sha256 di (modello effettivo, temperature, messaggi normalizzati). Tier in memoria (LRU
+# limitato in byte) più un tier Mongo opzionale (collection completion_cache, indice TTL su expiresAt).
+# Le risposte in cache vengono rigiocate come chunk SSE con un ritmo configurabile.
+# Solo risposte complete arrivate dal provider: il fallback mock non va mai in cache.
+
+RESPONSE_CACHE = os.environ.get("RESPONSE_CACHE", "0") == "1"
+RESPONSE_CACHE_MONGO = os.environ.get("RESPONSE_CACHE_MONGO", "0") == "1"
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+RESPONSE_CACHE_REPLAY_CHUNK = int(os.environ.get("RESPONSE_CACHE_REPLAY_CHUNK", "32"))
+RESPONSE_CACHE_REPLAY_DELAY = float(os.environ.get("RESPONSE_CACHE_REPLAY_DELAY", "0.01"))
+
+_ws = re.compile(r"\s+")
+
+
+def cache_key(model: str, temperature: float, messages: List[dict]) -> str:
+    norm = [[m.get("role", ""), _ws.sub(" ", str(m.get("content", ""))).strip()] for m in messages]
+    raw = json.dumps([model, round(float(temperature), 4), norm], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, enabled: bool = RESPONSE_CACHE, use_mongo: bool = RESPONSE_CACHE_MONGO, max_bytes: int = RESPONSE_CACHE_MAX_BYTES, ttl: float = RESPONSE_CACHE_TTL):
+        self.enabled = enabled
+        self.use_mongo = use_mongo
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._bytes = 0
+        self.memory_hits = 0
+        self.mongo_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.bytes_saved = 0
+
+    def applies(self, temperature: float) -> bool:
+        return self.enabled and temperature == 0
+
+    async def get(self, db, key: str) -> Optional[str]:
+        content = self._entries.get(key)
+        if content is not None:
+            self._entries.move_to_end(key)
+            self.memory_hits += 1
+            self.bytes_saved += len(content.encode())
+            return content
+        if self.use_mongo and db is not None:
+            try:
+                doc = await db.completion_cache.find_one({"_id": key, "expiresAt": {"$gt": datetime.utcnow()}}, {"content": 1})
+            except Exception as e:
+                logging.warning(f"Response cache lookup failed: {e}")
+                doc = None
+            if doc is not None:
+                self._remember(key, doc["content"])
+                self.mongo_hits += 1
+                self.bytes_saved += len(doc["content"].encode())
+                return doc["content"]
+        self.misses += 1
+        return None
+
+    async def put(self, db, key: str, content: str, model: str):
+        if not content:
+            return
+        self._remember(key, content)
+        self.stores += 1
+        if self.use_mongo and db is not None:
+            now = datetime.utcnow()
+            try:
+                await db.completion_cache.update_one({"_id": key}, {"$set": {"content": content, "model": model, "createdAt": now, "expiresAt": now + timedelta(seconds=self.ttl)}}, upsert=True)
+            except Exception as e:
+                logging.warning(f"Response cache store failed: {e}")
+
+    def _remember(self, key: str, content: str):
+        size = len(content.encode())
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old.encode())
+        self._entries[key] = content
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted.encode())
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.mongo_hits
+        lookups = hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "mongoTier": self.use_mongo,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "memoryHits": self.memory_hits,
+            "mongoHits": self.mongo_hits,
+            "misses": self.misses,
+            "hitRatio": round(hits / lookups, 4) if lookups else 0.0,
+            "stores": self.stores,
+            "bytesSaved": self.bytes_saved,
+        }
+
+
+async def replay(content: str, chunk: int = RESPONSE_CACHE_REPLAY_CHUNK, delay: float = RESPONSE_CACHE_REPLAY_DELAY) -> AsyncGenerator[str, None]:
+    step = max(1, chunk)
+    for i in range(0, len(content), step):
+        if delay > 0 and i:
+            await asyncio.sleep(delay)
+        yield content[i:i + step]
+
+
+response_cache = ResponseCache()
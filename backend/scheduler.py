@@ -0,0 +1,177 @@
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+import os, time, asyncio, logging
+
+# Scheduler in-process delle generazioni. /chat/stream non genera più dentro la richiesta:
+# sottomette un job a una coda limitata servita da un pool fisso di worker asyncio.
+# Le code sono per utente e servite a round-robin (fair scheduling), con un limite di job
+# attivi per utente: chi apre dieci tab non affama gli altri.
+
+GEN_WORKERS = int(os.environ.get("GEN_WORKERS", "64"))
+GEN_MAX_QUEUE = int(os.environ.get("GEN_MAX_QUEUE", "256"))
+GEN_PER_USER = int(os.environ.get("GEN_PER_USER", "2"))
+GEN_PER_USER_QUEUE = int(os.environ.get("GEN_PER_USER_QUEUE", "4"))
+
+
+class SchedulerFull(RuntimeError):
+    pass
+
+
+class Job:
+    def __init__(self, scheduler: "GenerationScheduler", user_id: str, run: Callable[[], Awaitable[None]], on_drop: Optional[Callable[[], Awaitable[None]]]):
+        self.scheduler = scheduler
+        self.user_id = user_id
+        self.run = run
+        # on_drop: finalizzazione per un job cancellato prima di partire (run non verrà mai eseguito)
+        self.on_drop = on_drop
+        self.state = "queued"
+        self.enqueued_at = time.monotonic()
+        self.task: Optional[asyncio.Task] = None
+
+    def cancel(self):
+        self.scheduler.cancel(self)
+
+
+class GenerationScheduler:
+    def __init__(self, workers: int = GEN_WORKERS, max_queue: int = GEN_MAX_QUEUE, per_user: int = GEN_PER_USER, per_user_queue: int = GEN_PER_USER_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.per_user = per_user
+        self.per_user_queue = per_user_queue
+        self._queues: Dict[str, Deque[Job]] = {}
+        self._rotation: Deque[str] = deque()
+        self._active: Dict[str, int] = {}
+        self._queued = 0
+        self._running = 0
+        self._workers: List[asyncio.Task] = []
+        self._drops: set = set()
+        self._changed = asyncio.Event()
+        self.completed = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def check(self, user_id: str):
+        if self._queued >= self.max_queue:
+            self.rejected += 1
+            raise SchedulerFull(f"Generation queue full ({self._queued} queued)")
+        if len(self._queues.get(user_id, ())) >= self.per_user_queue:
+            self.rejected += 1
+            raise SchedulerFull(f"Too many queued generations for user ({self.per_user_queue})")
+
+    def submit(self, user_id: str, run: Callable[[], Awaitable[None]], on_drop: Optional[Callable[[], Awaitable[None]]] = None) -> Job:
+        self.check(user_id)
+        job = Job(self, user_id, run, on_drop)
+        q = self._queues.get(user_id)
+        if q is None:
+            q = self._queues[user_id] = deque()
+            self._rotation.append(user_id)
+        q.append(job)
+        self._queued += 1
+        self._ensure_workers()
+        self._notify()
+        return job
+
+    def cancel(self, job: Job):
+        if job.state == "queued":
+            q = self._queues.get(job.user_id)
+            if q is not None and job in q:
+                q.remove(job)
+                self._queued -= 1
+                if not q:
+                    self._forget(job.user_id)
+            job.state = "cancelled"
+            self.cancelled += 1
+            if job.on_drop is not None:
+                task = asyncio.create_task(job.on_drop())
+                self._drops.add(task)
+                task.add_done_callback(self._drops.discard)
+        elif job.state == "running" and job.task is not None:
+            job.task.cancel()
+
+    def _forget(self, user_id: str):
+        self._queues.pop(user_id, None)
+        try:
+            self._rotation.remove(user_id)
+        except ValueError:
+            pass
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _next_job(self) -> Optional[Job]:
+        # round-robin sugli utenti con job in coda e slot attivi liberi
+        for _ in range(len(self._rotation)):
+            uid = self._rotation[0]
+            self._rotation.rotate(-1)
+            if self._active.get(uid, 0) >= self.per_user:
+                continue
+            q = self._queues[uid]
+            job = q.popleft()
+            self._queued -= 1
+            if not q:
+                self._forget(uid)
+            return job
+        return None
+
+    def _ensure_workers(self):
+        self._workers = [w for w in self._workers if not w.done()]
+        while len(self._workers) < self.workers:
+            self._workers.append(asyncio.create_task(self._worker()))
+
+    async def _worker(self):
+        while True:
+            changed = self._changed
+            job = self._next_job()
+            if job is None:
+                await changed.wait()
+                continue
+            waited = time.monotonic() - job.enqueued_at
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            job.state = "running"
+            self._running += 1
+            self._active[job.user_id] = self._active.get(job.user_id, 0) + 1
+            try:
+                job.task = asyncio.create_task(job.run())
+                # asyncio.wait non propaga la cancellazione del job al worker
+                await asyncio.wait([job.task])
+                if not job.task.cancelled() and job.task.exception() is not None:
+                    logging.warning(f"Generation job failed: {job.task.exception()}")
+            finally:
+                if job.task is not None and not job.task.done():
+                    job.task.cancel()  # worker fermato (shutdown): non lasciare la generazione orfana
+                job.state = "done"
+                self._running -= 1
+                self._active[job.user_id] -= 1
+                if not self._active[job.user_id]:
+                    del self._active[job.user_id]
+                self.completed += 1
+                self._notify()
+
+    async def stop(self):
+        for w in self._workers:
+            w.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._changed = asyncio.Event()
+
+    def stats(self) -> dict:
+        started = self.completed + self._running
+        return {
+            "workers": self.workers,
+            "queued": self._queued,
+            "active": self._running,
+            "activeUsers": len(self._active),
+            "perUserLimit": self.per_user,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "cancelled": self.cancelled,
+            "avgWaitMs": round(self.wait_total / started * 1000, 2) if started else 0.0,
+            "maxWaitMs": round(self.wait_max * 1000, 2),
+        }
+
+
+scheduler = GenerationScheduler()
@@ -0,0 +1,305 @@
+from collections import OrderedDict
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Tuple
+import os, re, math, time, heapq, asyncio, unicodedata
+
+# Ricerca full-text su messaggi e titoli delle sessioni di un utente.
+# Indice invertito in memoria per utente, caricato da Mongo alla prima ricerca e poi aggiornato
+# subito dalle route (chat_stream, sessions_create/update/delete) e, alla ricerca successiva, dal refresh.
+# L'indice non conserva il testo: il contenuto per gli snippet si legge da Mongo solo per la pagina.
+# Memoria limitata da SEARCH_INDEX_MAX_MB (stima, vedi approx_bytes): gli indici meno usati escono
+# dall'LRU e un utente che da solo supera il budget viene indicizzato dalle sessioni più recenti
+# fino al budget (partial).
+# version = updatedAt più recente letto da Mongo (build e refresh, mai dalle route): le sessioni con
+# updatedAt successivo, scritte da altri worker o da questo, si reindicizzano da Mongo; le sessioni cancellate altrove vengono
+# scartate quando compaiono in una pagina di risultati (vedi server.search).
+# Ranking BM25 (titoli con peso SEARCH_TITLE_BOOST), tutti i termini della query devono comparire.
+
+SEARCH_INDEX_USERS = int(os.environ.get("SEARCH_INDEX_USERS", "500"))
+# budget per worker (render.yaml: piano free da 512 MB, un solo processo uvicorn)
+SEARCH_INDEX_MAX_MB = float(os.environ.get("SEARCH_INDEX_MAX_MB", "64"))
+SEARCH_TITLE_BOOST = float(os.environ.get("SEARCH_TITLE_BOOST", "2.0"))
+SEARCH_SNIPPET_CHARS = int(os.environ.get("SEARCH_SNIPPET_CHARS", "160"))
+# millisecondi di tokenizzazione fra una cessione del loop e l'altra durante build/refresh
+SEARCH_BUILD_SLICE_MS = float(os.environ.get("SEARCH_BUILD_SLICE_MS", "5"))
+
+_word = re.compile(r"\w+")
+K1, B = 1.2, 0.75
+# costo in byte su CPython 3.11 (tracemalloc, bench/search_bench.py): per documento, per coppia
+# termine-documento nelle posting list, per termine distinto. Le posting list dominano: ~40-60 termini
+# distinti per un messaggio medio, qualche centinaio per una risposta lunga.
+DOC_BYTES, POSTING_BYTES, TERM_BYTES = 450, 40, 180
+
+
+@lru_cache(maxsize=50_000)
+def normalize(word: str) -> str:
+    # minuscole e senza accenti: "Perché" e "perche" sono lo stesso termine
+    w = unicodedata.normalize("NFKD", word.lower())
+    return "".join(c for c in w if not unicodedata.combining(c))
+
+
+def tokenize(text: str) -> List[str]:
+    return [normalize(w) for w in _word.findall(text) if len(w) > 1]
+
+
+def snippet(text: str, terms: Set[str], width: int = SEARCH_SNIPPET_CHARS) -> Tuple[str, List[List[int]]]:
+    # finestra attorno al primo termine trovato; highlights = [inizio, fine) relativi allo snippet
+    hits = [(m.start(), m.end()) for m in _word.finditer(text) if normalize(m.group()) in terms]
+    start = 0
+    if hits and hits[0][0] > width // 3:
+        start = hits[0][0] - width // 3
+        space = text.rfind(" ", 0, start)
+        start = space + 1 if space != -1 and start - space < 20 else start
+    end = min(len(text), start + width)
+    prefix = "…" if start > 0 else ""
+    out = prefix + text[start:end].replace("\n", " ") + ("…" if end < len(text) else "")
+    shift = len(prefix) - start
+    return out, [[s + shift, e + shift] for s, e in hits if s >= start and e <= end]
+
+
+class UserIndex:
+    def __init__(self, version: Optional[datetime] = None):
+        self.version = version
+        self.next_id = 0
+        # doc: (kind, id messaggio o sessione, sessionId, role, createdAt, termini distinti, lunghezza in termini)
+        self.docs: Dict[int, tuple] = {}
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.by_key: Dict[str, int] = {}
+        self.by_session: Dict[str, Set[int]] = {}
+        self.total_len = 0
+        self.entries = 0
+        # partial: caricato solo in parte perché da solo superava il budget di memoria
+        self.partial = False
+
+    def approx_bytes(self) -> int:
+        return DOC_BYTES * len(self.docs) + POSTING_BYTES * self.entries + TERM_BYTES * len(self.postings)
+
+    def bump(self, version: Optional[datetime]):
+        if version is not None and (self.version is None or version > self.version):
+            self.version = version
+
+    def add(self, kind: str, key: str, session_id: str, role: Optional[str], created: datetime, text: str):
+        self.remove_key(key)
+        terms = tokenize(text)
+        if not terms:
+            return
+        did = self.next_id
+        self.next_id += 1
+        tf: Dict[str, int] = {}
+        for t in terms:
+            tf[t] = tf.get(t, 0) + 1
+        # i termini distinti (stesse stringhe delle chiavi di postings) servono a rimuovere il documento
+        self.docs[did] = (kind, key, session_id, role, created, tuple(tf), len(terms))
+        self.by_key[key] = did
+        self.by_session.setdefault(session_id, set()).add(did)
+        self.total_len += len(terms)
+        self.entries += len(tf)
+        for t, n in tf.items():
+            self.postings.setdefault(t, {})[did] = n
+
+    def remove_key(self, key: str):
+        did = self.by_key.pop(key, None)
+        if did is not None:
+            self._drop(did)
+
+    def remove_session(self, session_id: str):
+        for did in self.by_session.pop(session_id, ()):
+            self.by_key.pop(self.docs[did][1], None)
+            self._drop(did, keep_session=True)
+
+    def _drop(self, did: int, keep_session: bool = False):
+        kind, key, sid, role, created, terms, length = self.docs.pop(did)
+        self.total_len -= length
+        self.entries -= len(terms)
+        if not keep_session:
+            self.by_session.get(sid, set()).discard(did)
+        for t in terms:
+            plist = self.postings.get(t)
+            if plist is not None:
+                plist.pop(did, None)
+                if not plist:
+                    del self.postings[t]
+
+    def add_session(self, doc: dict):
+        self.add("session", doc["_id"], doc["_id"], None, doc.get("updatedAt") or doc.get("createdAt") or datetime.utcnow(), doc.get("title", ""))
+
+    def add_message(self, doc: dict):
+        self.add("message", doc["_id"], doc["sessionId"], doc.get("role"), doc.get("createdAt") or datetime.utcnow(), doc.get("content", ""))
+
+    def search(self, query: str, limit: int, offset: int = 0) -> Tuple[List[tuple], bool]:
+        # ritorna ([(score, doc), ...] della pagina, ci sono altri risultati)
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or not self.docs:
+            return [], False
+        lists = [self.postings.get(t) for t in terms]
+        if any(p is None for p in lists):
+            return [], False
+        order = sorted(range(len(terms)), key=lambda i: len(lists[i]))
+        n = len(self.docs)
+        avg = self.total_len / n
+        idf = [math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5)) for p in lists]
+        first, rest = lists[order[0]], [lists[i] for i in order[1:]]
+        # ciclo caldo per i termini frequenti (una scansione della posting list più corta):
+        # costanti e lookup fuori dal loop
+        docs = self.docs
+        weighted = [(idf[i] * (K1 + 1), lists[i]) for i in range(len(terms))]
+        base, scale = K1 * (1 - B), K1 * B / avg
+
+        def scored():
+            for did in first:
+                if rest and not all(did in p for p in rest):
+                    continue
+                doc = docs[did]
+                norm = base + scale * doc[6]
+                s = 0.0
+                for w, p in weighted:
+                    tf = p[did]
+                    s += w * tf / (tf + norm)
+                if doc[0] == "session":
+                    s *= SEARCH_TITLE_BOOST
+                yield (s, doc[4], did)
+
+        top = heapq.nlargest(offset + limit + 1, scored())
+        page = top[offset:offset + limit]
+        return [(s, self.docs[did]) for s, _, did in page], len(top) > offset + limit
+
+
+class SearchIndexes:
+    def __init__(self, max_users: int = SEARCH_INDEX_USERS, max_bytes: int = int(SEARCH_INDEX_MAX_MB * 1024 * 1024)):
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self._indexes: "OrderedDict[str, UserIndex]" = OrderedDict()
+        self._loading: Dict[str, asyncio.Future] = {}
+        self.builds = 0
+        self.refreshes = 0
+
+    def get(self, owner_id: str) -> Optional[UserIndex]:
+        index = self._indexes.get(owner_id)
+        if index is not None:
+            self._indexes.move_to_end(owner_id)
+        return index
+
+    def put(self, owner_id: str, index: UserIndex):
+        if self.max_users <= 0:
+            return
+        self._indexes[owner_id] = index
+        self._indexes.move_to_end(owner_id)
+        while len(self._indexes) > self.max_users:
+            self._indexes.popitem(last=False)
+        # l'indice appena caricato resta comunque: build_index lo ha già fermato al budget
+        size = sum(i.approx_bytes() for i in self._indexes.values())
+        while len(self._indexes) > 1 and size > self.max_bytes:
+            size -= self._indexes.popitem(last=False)[1].approx_bytes()
+
+    # hook delle route: aggiornano solo indici già caricati. Non toccano version: l'orologio di questo
+    # worker non dice nulla delle scritture degli altri, che il refresh salterebbe se più vecchie
+    def message_added(self, owner_id: str, doc: dict):
+        index = self._indexes.get(owner_id)
+        if index is not None:
+            index.add_message(doc)
+
+    def session_saved(self, owner_id: str, doc: dict):
+        index = self._indexes.get(owner_id)
+        if index is not None:
+            index.add_session(doc)
+
+    def session_deleted(self, owner_id: str, session_id: str):
+        index = self._indexes.get(owner_id)
+        if index is not None:
+            index.remove_session(session_id)
+
+    def drop(self, owner_id: str):
+        self._indexes.pop(owner_id, None)
+
+    def clear(self):
+        self._indexes.clear()
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._indexes),
+            "docs": sum(len(i.docs) for i in self._indexes.values()),
+            "terms": sum(len(i.postings) for i in self._indexes.values()),
+            "approxMB": round(sum(i.approx_bytes() for i in self._indexes.values()) / 1024 / 1024, 1),
+            "partial": sum(1 for i in self._indexes.values() if i.partial),
+            "builds": self.builds,
+            "refreshes": self.refreshes,
+        }
+
+
+search_indexes = SearchIndexes()
+
+SESSION_FIELDS = {"title": 1, "createdAt": 1, "updatedAt": 1}
+MESSAGE_FIELDS = {"sessionId": 1, "role": 1, "content": 1, "createdAt": 1}
+
+
+BUILD_BATCH = 1000
+BUILD_SESSIONS = 50
+
+
+async def add_messages(index: UserIndex, docs: List[dict]):
+    # tokenize è CPU puro e un batch di getMore può arrivare a 16 MB: a fette, cedendo il loop
+    # fra l'una e l'altra, così il caricamento non ferma gli stream SSE del worker
+    budget = SEARCH_BUILD_SLICE_MS / 1000
+    start = time.perf_counter()
+    for m in docs:
+        index.add_message(m)
+        if time.perf_counter() - start >= budget:
+            await asyncio.sleep(0)
+            start = time.perf_counter()
+
+
+async def build_index(db, owner_id: str, max_bytes: Optional[int] = None) -> UserIndex:
+    # version letta per prima: quello che arriva durante il caricamento verrà al più reindicizzato.
+    # Sessioni dalla più recente, a gruppi (indice owner_session_created_id): oltre il budget ci si ferma.
+    budget = search_indexes.max_bytes if max_bytes is None else max_bytes
+    sessions = await db.sessions.find({"ownerId": owner_id}, SESSION_FIELDS).sort([("updatedAt", -1), ("_id", -1)]).to_list(None)
+    index = UserIndex(max((s["updatedAt"] for s in sessions if s.get("updatedAt")), default=None))
+    for i in range(0, len(sessions), BUILD_SESSIONS):
+        if index.approx_bytes() >= budget:
+            index.partial = True
+            break
+        group = sessions[i:i + BUILD_SESSIONS]
+        for s in group:
+            index.add_session(s)
+        cursor = db.messages.find({"ownerId": owner_id, "sessionId": {"$in": [s["_id"] for s in group]}}, MESSAGE_FIELDS).batch_size(BUILD_BATCH)
+        while batch := await cursor.to_list(BUILD_BATCH):
+            await add_messages(index, batch)
+    return index
+
+
+async def refresh_index(db, owner_id: str, index: UserIndex):
+    # sessioni scritte da altri worker dopo l'ultima versione nota: si reindicizzano per intero
+    newer = await db.sessions.find({"ownerId": owner_id, "updatedAt": {"$gt": index.version}}, SESSION_FIELDS).to_list(None)
+    for s in newer:
+        msgs = await db.messages.find({"ownerId": owner_id, "sessionId": s["_id"]}, MESSAGE_FIELDS).to_list(None)
+        index.remove_session(s["_id"])
+        index.add_session(s)
+        await add_messages(index, msgs)
+        index.bump(s["updatedAt"])
+
+
+async def load_index(db, owner_id: str) -> UserIndex:
+    try:
+        index = await build_index(db, owner_id)
+        search_indexes.put(owner_id, index)
+        search_indexes.builds += 1
+        return index
+    finally:
+        search_indexes._loading.pop(owner_id, None)
+
+
+async def get_index(db, owner_id: str) -> UserIndex:
+    index = search_indexes.get(owner_id)
+    if index is None:
+        # richieste concorrenti dello stesso utente condividono un solo caricamento; shield per tutte,
+        # compresa quella che lo avvia: se il suo client si disconnette gli altri lo aspettano ancora
+        pending = search_indexes._loading.get(owner_id)
+        if pending is None:
+            pending = search_indexes._loading[owner_id] = asyncio.ensure_future(load_index(db, owner_id))
+        return await asyncio.shield(pending)
+    latest = await db.sessions.find_one({"ownerId": owner_id}, {"updatedAt": 1}, sort=[("updatedAt", -1), ("_id", -1)])
+    if latest is not None and latest.get("updatedAt") and (index.version is None or latest["updatedAt"] > index.version):
+        await refresh_index(db, owner_id, index)
+        search_indexes.refreshes += 1
+    return index
@@ -1,71 +1,711 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Path, Body, Request, Depends from fastapi.responses import StreamingResponse, JSONResponse from starlette.middleware.cors import CORSMiddleware from motor.motor_asyncio import AsyncIOMotorClient from pydantic import BaseModel, Field, EmailStr from typing import List, Optional, Literal, AsyncGenerator from datetime import datetime, timedelta from jose import jwt, JWTError from passlib.hash import bcrypt import os, uuid, asyncio, json, logging, requests
+from fastapi import FastAPI, APIRouter, HTTPException, Path, Body, Query, Request, Depends
+from fastapi.responses import StreamingResponse, JSONResponse, Response
+from fastapi.encoders import jsonable_encoder
+from starlette.middleware.cors import CORSMiddleware
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
+from pydantic import BaseModel, Field, EmailStr
+from typing import List, Optional, Literal, AsyncGenerator
+from datetime import datetime, timedelta
+from jose import jwt, JWTError
+import os, hmac, uuid, asyncio, json, logging, time
+import upstream
+from providers import router
+from hashing import hash_pool, HashPoolSaturated
+from usercache import user_cache
+from indexes import ensure_indexes, verify_query_plans
+from pagination import DEFAULT_PAGE, MAX_PAGE, encode_cursor, keyset_filter
+from context import context_cache, get_window, refresh_summary
+from persistence import StreamWriter
+from streams import stream_registry, Coalescer, StreamBuffer
+from scheduler import scheduler, SchedulerFull
+from search import search_indexes, get_index, snippet, tokenize
+from respcache import response_cache, cache_key, replay
+import metrics
+from metrics import request_timing, mongo_listener, ServerTimingMiddleware, METRICS_SERVER_TIMING
+
+app = FastAPI()
+api = APIRouter(prefix="/api")
+
+MONGO_URL = os.environ.get("MONGO_URL")
+DB_NAME = os.environ.get("DB_NAME", "chatdb")
+client = AsyncIOMotorClient(MONGO_URL, event_listeners=[mongo_listener]) if MONGO_URL else None
+db = client[DB_NAME] if client else None
+
+MONGO_ENSURE_INDEXES = os.environ.get("MONGO_ENSURE_INDEXES", "1") == "1"
+MONGO_VERIFY_PLANS = os.environ.get("MONGO_VERIFY_PLANS", "0") == "1"
+
+# /stats (e /metrics) espongono provider, code e stato interno: solo con Authorization: Bearer <token>.
+# Senza DIAGNOSTICS_TOKEN le route non sono servite (404).
+DIAGNOSTICS_TOKEN = os.environ.get("DIAGNOSTICS_TOKEN", "")
+
+SECRET_KEY = os.environ.get("SECRET_KEY", "dev-secret-change-me")
+ALGORITHM = "HS256"
+ACCESS_MIN = 60 * 24 * 7
+GENERATION_STOP_WAIT = 10.0
+
+
+def generation_busy() -> HTTPException:
+    return HTTPException(status_code=429, detail="Troppe generazioni in corso, riprova tra poco", headers={"Retry-After": "2"})
+
+
+def auth_busy() -> HTTPException:
+    return HTTPException(status_code=429, detail="Troppe richieste di autenticazione, riprova tra poco", headers={"Retry-After": "1"})
+
+
+def create_token(uid: str, pwd_version: int = 0) -> str:
+    exp = datetime.utcnow() + timedelta(minutes=ACCESS_MIN)
+    return jwt.encode({"sub": uid, "exp": exp, "pv": pwd_version}, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def auth_response(uid: str, email: str, createdAt: datetime, pwd_version: int = 0) -> JSONResponse:
+    resp = JSONResponse(jsonable_encoder(UserPublic(id=uid, email=email, createdAt=createdAt)))
+    resp.set_cookie("access_token", f"Bearer {create_token(uid, pwd_version)}", httponly=True, samesite="lax", secure=False, path="/")
+    return resp
+
+
+def request_token(request: Request) -> Optional[str]:
+    auth = request.headers.get("Authorization")
+    if auth and auth.startswith("Bearer "):
+        return auth.split(" ", 1)[1]
+    cookie = request.cookies.get("access_token")
+    if cookie and cookie.startswith("Bearer "):
+        return cookie.split(" ", 1)[1]
+    return None
+
+
+def require_diagnostics(request: Request):
+    if not DIAGNOSTICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    auth = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(auth.encode(), f"Bearer {DIAGNOSTICS_TOKEN}".encode()):
+        raise HTTPException(status_code=401, detail="Invalid diagnostics token")
+
+
+async def current_user(request: Request):
+    t = time.perf_counter()
+    try:
+        return await resolve_user(request)
+    finally:
+        elapsed = time.perf_counter() - t
+        metrics.CURRENT_USER.observe(elapsed)
+        timing = request_timing.get()
+        if timing is not None:
+            timing.auth += elapsed
+
+
+async def resolve_user(request: Request):
+    token = request_token(request)
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    cached = user_cache.get(token)
+    if cached is not None:
+        return cached
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        uid = payload.get("sub")
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    user = await db.users.find_one({"_id": uid})
+    if not user:
+        raise HTTPException(status_code=401, detail="User not found")
+    # I token emessi prima dell'ultimo cambio password non sono più validi
+    if payload.get("pv", 0) != user.get("pwdVersion", 0):
+        raise HTTPException(status_code=401, detail="Token revoked")
+    u = {"id": user["_id"], "email": user["email"], "createdAt": user["createdAt"], "pwdVersion": user.get("pwdVersion", 0)}
+    user_cache.set(token, u, max_age=payload.get("exp", 0) - time.time())
+    return u
 
-app = FastAPI() api = APIRouter(prefix="/api")
-
-MONGO_URL = os.environ.get("MONGO_URL") DB_NAME = os.environ.get("DB_NAME", "chatdb") client = AsyncIOMotorClient(MONGO_URL) if MONGO_URL else None db = client[DB_NAME] if client else None
-
-SECRET_KEY = os.environ.get("SECRET_KEY", "dev-secret-change-me") ALGORITHM = "HS256" ACCESS_MIN = 60 * 24 * 7
-
-def create_token(uid: str) -> str: exp = datetime.utcnow() + timedelta(minutes=ACCESS_MIN) return jwt.encode({"sub": uid, "exp": exp}, SECRET_KEY, algorithm=ALGORITHM)
-
-async def current_user(request: Request): token = None auth = request.headers.get("Authorization") if auth and auth.startswith("Bearer "): token = auth.split(" ", 1)[1] if not token: cookie = request.cookies.get("access_token") if cookie and cookie.startswith("Bearer "): token = cookie.split(" ", 1)[1] if not token: raise HTTPException(status_code=401, detail="Not authenticated") try: payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]) uid = payload.get("sub") except JWTError: raise HTTPException(status_code=401, detail="Invalid token") user = await db.users.find_one({"_id": uid}) if not user: raise HTTPException(status_code=401, detail="User not found") return {"id": user["_id"], "email": user["email"], "createdAt": user["createdAt"]}
 
 Role = Literal["user", "assistant", "system"]
+MessageStatus = Literal["streaming", "complete", "aborted"]
 
-class RegisterInput(BaseModel): email: EmailStr password: str
 
-class LoginInput(BaseModel): email: EmailStr password: str
+class RegisterInput(BaseModel):
+    email: EmailStr
+    password: str
 
-class UserPublic(BaseModel): id: str email: EmailStr createdAt: datetime
 
-class SessionModel(BaseModel): id: str = Field(default_factory=lambda: str(uuid.uuid4())) ownerId: str title: str = "Nuova chat" model: str = "gpt-4o-mini" createdAt: datetime = Field(default_factory=datetime.utcnow) updatedAt: datetime = Field(default_factory=datetime.utcnow)
+class LoginInput(BaseModel):
+    email: EmailStr
+    password: str
 
-class SessionUpdate(BaseModel): title: Optional[str] = None model: Optional[str] = None
 
-class MessageModel(BaseModel): id: str = Field(default_factory=lambda: str(uuid.uuid4())) ownerId: str sessionId: str role: Role content: str createdAt: datetime = Field(default_factory=datetime.utcnow)
+class ChangePasswordInput(BaseModel):
+    currentPassword: str
+    newPassword: str
 
-class ChatStreamInput(BaseModel): sessionId: str model: str messages: List[dict] temperature: Optional[float] = 0.3
 
-def to_session(doc) -> SessionModel: return SessionModel( id=doc.get("_id") or doc.get("id"), ownerId=doc["ownerId"], title=doc.get("title", "Nuova chat"), model=doc.get("model", "gpt-4o-mini"), createdAt=doc.get("createdAt", datetime.utcnow()), updatedAt=doc.get("updatedAt", datetime.utcnow()), )
+class DeleteAccountInput(BaseModel):
+    currentPassword: str
 
-def session_doc(s: SessionModel): return {"_id": s.id, "ownerId": s.ownerId, "title": s.title, "model": s.model, "createdAt": s.createdAt, "updatedAt": s.updatedAt}
 
-def to_message(doc) -> MessageModel: return MessageModel( id=doc.get("_id") or doc.get("id"), ownerId=doc["ownerId"], sessionId=doc["sessionId"], role=doc["role"], content=doc.get("content", ""), createdAt=doc.get("createdAt", datetime.utcnow()), )
+class UserPublic(BaseModel):
+    id: str
+    email: EmailStr
+    createdAt: datetime
 
-def message_doc(m: MessageModel): return {"_id": m.id, "ownerId": m.ownerId, "sessionId": m.sessionId, "role": m.role, "content": m.content, "createdAt": m.createdAt}
 
-@api.get("/") async def hello(): return {"message": "Hello World"}
+class SessionModel(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    ownerId: str
+    title: str = "Nuova chat"
+    model: str = "gpt-4o-mini"
+    createdAt: datetime = Field(default_factory=datetime.utcnow)
+    updatedAt: datetime = Field(default_factory=datetime.utcnow)
 
-@api.post("/auth/register", response_model=UserPublic) async def register(inp: RegisterInput): existing = await db.users.find_one({"email": inp.email}) if existing: if bcrypt.verify(inp.password, existing.get("passwordHash", "")): token = create_token(existing["_id"]) resp = JSONResponse(UserPublic(id=existing["_id"], email=existing["email"], createdAt=existing["createdAt"]).dict()) resp.set_cookie("access_token", f"Bearer {token}", httponly=True, samesite="lax", secure=False, path="/") return resp raise HTTPException(status_code=409, detail="Email già registrata, password non corretta") uid = str(uuid.uuid4()) doc = {"_id": uid, "email": inp.email, "passwordHash": bcrypt.hash(inp.password), "createdAt": datetime.utcnow()} await db.users.insert_one(doc) token = create_token(uid) resp = JSONResponse(UserPublic(id=uid, email=inp.email, createdAt=doc["createdAt"]).dict()) resp.set_cookie("access_token", f"Bearer {token}", httponly=True, samesite="lax", secure=False, path="/") return resp
 
-@api.post("/auth/login", response_model=UserPublic) async def login(inp: LoginInput): user = await db.users.find_one({"email": inp.email}) if not user or not bcrypt.verify(inp.password, user.get("passwordHash", "")): raise HTTPException(status_code=401, detail="Credenziali non valide") token = create_token(user["_id"]) resp = JSONResponse(UserPublic(id=user["_id"], email=user["email"], createdAt=user["createdAt"]).dict()) resp.set_cookie("access_token", f"Bearer {token}", httponly=True, samesite="lax", secure=False, path="/") return resp
+class SessionUpdate(BaseModel):
+    title: Optional[str] = None
+    model: Optional[str] = None
 
-@api.get("/auth/me", response_model=UserPublic) async def me(u=Depends(current_user)): return UserPublic(id=u["id"], email=u["email"], createdAt=u["createdAt"])
 
-@api.post("/auth/logout") async def logout(): resp = JSONResponse({"ok": True}) resp.delete_cookie("access_token", path="/") return resp
+class MessageModel(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    ownerId: str
+    sessionId: str
+    role: Role
+    content: str
+    status: MessageStatus = "complete"
+    createdAt: datetime = Field(default_factory=datetime.utcnow)
 
-@api.get("/sessions", response_model=List[SessionModel]) async def sessions_list(u=Depends(current_user)): docs = await db.sessions.find({"ownerId": u["id"]}).sort("updatedAt", -1).to_list(200) return [to_session(d) for d in docs]
 
-@api.post("/sessions", response_model=SessionModel, status_code=201) async def sessions_create(u=Depends(current_user)): s = SessionModel(ownerId=u["id"]) await db.sessions.insert_one(session_doc(s)) return s
+class SessionsPage(BaseModel):
+    items: List[SessionModel]
+    nextCursor: Optional[str] = None
 
-@api.put("/sessions/{sid}", response_model=SessionModel) async def sessions_update(sid: str, body: SessionUpdate, u=Depends(current_user)): doc = await db.sessions.find_one({"_id": sid, "ownerId": u["id"]}) if not doc: raise HTTPException(status_code=404, detail="Session not found") s = to_session(doc) if body.title is not None: s.title = body.title if body.model is not None: s.model = body.model s.updatedAt = datetime.utcnow() await db.sessions.update_one({"_id": sid, "ownerId": u["id"]}, {"$set": session_doc(s)}) return s
 
-@api.delete("/sessions/{sid}", status_code=204) async def sessions_delete(sid: str, u=Depends(current_user)): await db.messages.delete_many({"sessionId": sid, "ownerId": u["id"]}) await db.sessions.delete_one({"_id": sid, "ownerId": u["id"]}) return
+class MessagesPage(BaseModel):
+    items: List[MessageModel]
+    nextCursor: Optional[str] = None
 
-@api.get("/sessions/{sid}/messages", response_model=List[MessageModel]) async def messages_get(sid: str, u=Depends(current_user)): sess = await db.sessions.find_one({"_id": sid, "ownerId": u["id"]}) if not sess: raise HTTPException(status_code=404, detail="Session not found") docs = await db.messages.find({"sessionId": sid, "ownerId": u["id"]}).sort("createdAt", 1).to_list(1000) return [to_message(d) for d in docs]
 
-async def mock_delta(prompt: str) -> AsyncGenerator[str, None]: text = f"Certo! Risposta mock per: '{prompt[:60]}'. Questa è una demo streaming." for w in text.split(" "): await asyncio.sleep(0.03) yield w + " "
+class SearchHit(BaseModel):
+    kind: Literal["message", "session"]
+    sessionId: str
+    sessionTitle: str
+    messageId: Optional[str] = None
+    role: Optional[Role] = None
+    snippet: str
+    highlights: List[List[int]]
+    score: float
+    createdAt: datetime
 
-def openai_stream_generator(messages: List[dict], model: str, temperature: float): api_key = os.environ.get("OPENAI_API_KEY") if not api_key: raise RuntimeError("OPENAI_API_KEY not configured") model_map = {"gpt-4o": "gpt-4o", "gpt-4o-mini": "gpt-4o-mini"} mdl = model_map.get(model, "gpt-4o-mini") resp = requests.post( "https://api.openai.com/v1/chat/completions", headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}, json={"model": mdl, "messages": messages, "temperature": temperature, "stream": True}, stream=True, timeout=600, ) if resp.status_code != 200: raise RuntimeError(f"OpenAI error {resp.status_code}: {resp.text[:200]}") for raw in resp.iter_lines(decode_unicode=True): if not raw: continue if raw.startswith("data:"): data = raw[5:].strip() if data == "[DONE]": break try: j = json.loads(data) delta = j["choices"][0]["delta"].get("content") if delta: yield delta except Exception: continue
 
-@api.post("/chat/stream") async def chat_stream(body: ChatStreamInput, request: Request, u=Depends(current_user)): sess = await db.sessions.find_one({"_id": body.sessionId, "ownerId": u["id"]}) if not sess: raise HTTPException(status_code=404, detail="Session not found") last_user = "" for m in reversed(body.messages or []): if m.get("role") == "user": last_user = m.get("content", "") break user_msg = MessageModel(ownerId=u["id"], sessionId=body.sessionId, role="user", content=last_user) await db.messages.insert_one(message_doc(user_msg)) async def gen(): full = "" try: try: for delta in openai_stream_generator(body.messages, body.model, body.temperature or 0.3): full += delta if await request.is_disconnected(): break yield f"data: {{"type":"chunk","delta": {json.dumps(delta)} }}\n\n" except Exception as e: logging.warning(f"OpenAI fallback: {e}") async for delta in mock_delta(last_user): full += delta if await request.is_disconnected(): break yield f"data: {{"type":"chunk","delta": {json.dumps(delta)} }}\n\n" assistant = MessageModel(ownerId=u["id"], sessionId=body.sessionId, role="assistant", content=full) await db.messages.insert_one(message_doc(assistant)) yield "data: {"type":"end"}\n\n" except Exception as e: yield f"data: {{"type":"error","error": {json.dumps(str(e))} }}\n\n" return StreamingResponse(gen(), media_type="text/event-stream")
+class SearchPage(BaseModel):
+    items: List[SearchHit]
+    nextCursor: Optional[str] = None
+    # true se l'utente supera il budget dell'indice: cercate solo le sessioni più recenti
+    partial: bool = False
 
-app.include_router(api)
 
-cors_env = os.environ.get("CORS_ORIGINS", "") origins = [o.strip() for o in cors_env.split(",") if o.strip()] if origins: app.add_middleware(CORSMiddleware, allow_origins=origins, allow_credentials=True, allow_methods=[""], allow_headers=[""]) else: app.add_middleware(CORSMiddleware, allow_origins=[""], allow_credentials=False, allow_methods=[""], allow_headers=["*"])
+class ChatStreamInput(BaseModel):
+    sessionId: str
+    model: str
+    # content: solo il nuovo messaggio utente, il contesto lo ricostruisce il server.
+    # messages: storia completa inviata dal client (modalità precedente, ancora supportata).
+    content: Optional[str] = None
+    messages: Optional[List[dict]] = None
+    temperature: Optional[float] = 0.3
 
-@app.on_event("shutdown") async def shutdown_event(): if client: client.close()
 
+def utcnow_ms() -> datetime:
+    # Mongo conserva i datetime al millisecondo: troncando qui i valori letti e quelli in memoria coincidono
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def to_session(doc) -> SessionModel:
+    return SessionModel(
+        id=doc.get("_id") or doc.get("id"),
+        ownerId=doc["ownerId"],
+        title=doc.get("title", "Nuova chat"),
+        model=doc.get("model", "gpt-4o-mini"),
+        createdAt=doc.get("createdAt", datetime.utcnow()),
+        updatedAt=doc.get("updatedAt", datetime.utcnow()),
+    )
+
+
+def session_doc(s: SessionModel):
+    return {"_id": s.id, "ownerId": s.ownerId, "title": s.title, "model": s.model, "createdAt": s.createdAt, "updatedAt": s.updatedAt}
+
+
+def to_message(doc) -> MessageModel:
+    return MessageModel(
+        id=doc.get("_id") or doc.get("id"),
+        ownerId=doc["ownerId"],
+        sessionId=doc["sessionId"],
+        role=doc["role"],
+        content=doc.get("content", ""),
+        status=doc.get("status", "complete"),
+        createdAt=doc.get("createdAt", datetime.utcnow()),
+    )
+
+
+def message_doc(m: MessageModel):
+    return {"_id": m.id, "ownerId": m.ownerId, "sessionId": m.sessionId, "role": m.role, "content": m.content, "status": m.status, "createdAt": m.createdAt}
+
+
+@api.get("/")
+async def hello():
+    return {"message": "Hello World"}
+
+
+@api.post("/auth/register", response_model=UserPublic)
+async def register(inp: RegisterInput):
+    existing = await db.users.find_one({"email": inp.email})
+    try:
+        if existing:
+            ok = await hash_pool.verify(inp.password, existing.get("passwordHash", ""))
+        else:
+            password_hash = await hash_pool.hash(inp.password)
+    except HashPoolSaturated:
+        raise auth_busy()
+    if existing:
+        if ok:
+            return auth_response(existing["_id"], existing["email"], existing["createdAt"], existing.get("pwdVersion", 0))
+        raise HTTPException(status_code=409, detail="Email già registrata, password non corretta")
+    uid = str(uuid.uuid4())
+    doc = {"_id": uid, "email": inp.email, "passwordHash": password_hash, "createdAt": datetime.utcnow()}
+    try:
+        await db.users.insert_one(doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Email già registrata")
+    return auth_response(uid, inp.email, doc["createdAt"])
+
+
+@api.post("/auth/login", response_model=UserPublic)
+async def login(inp: LoginInput):
+    user = await db.users.find_one({"email": inp.email})
+    try:
+        ok = bool(user) and await hash_pool.verify(inp.password, user.get("passwordHash", ""))
+    except HashPoolSaturated:
+        raise auth_busy()
+    if not ok:
+        raise HTTPException(status_code=401, detail="Credenziali non valide")
+    return auth_response(user["_id"], user["email"], user["createdAt"], user.get("pwdVersion", 0))
+
+
+@api.get("/auth/me", response_model=UserPublic)
+async def me(u=Depends(current_user)):
+    return UserPublic(id=u["id"], email=u["email"], createdAt=u["createdAt"])
+
+
+@api.post("/auth/logout")
+async def logout(request: Request):
+    token = request_token(request)
+    if token:
+        user_cache.invalidate(token)
+    resp = JSONResponse({"ok": True})
+    resp.delete_cookie("access_token", path="/")
+    return resp
+
+
+@api.post("/auth/change-password", response_model=UserPublic)
+async def change_password(inp: ChangePasswordInput, u=Depends(current_user)):
+    user = await db.users.find_one({"_id": u["id"]})
+    try:
+        ok = bool(user) and await hash_pool.verify(inp.currentPassword, user.get("passwordHash", ""))
+        if ok:
+            password_hash = await hash_pool.hash(inp.newPassword)
+    except HashPoolSaturated:
+        raise auth_busy()
+    if not ok:
+        raise HTTPException(status_code=401, detail="Password attuale non corretta")
+    pwd_version = user.get("pwdVersion", 0) + 1
+    await db.users.update_one({"_id": u["id"]}, {"$set": {"passwordHash": password_hash, "pwdVersion": pwd_version}})
+    user_cache.invalidate_user(u["id"])
+    return auth_response(u["id"], u["email"], u["createdAt"], pwd_version)
+
+
+async def stop_generations(live: List[StreamBuffer]):
+    # cancella le generazioni e ne aspetta la scrittura finale (aborted), entro GENERATION_STOP_WAIT
+    for buf in live:
+        buf.cancel()
+    if live:
+        await asyncio.wait([asyncio.ensure_future(buf.wait_finished()) for buf in live], timeout=GENERATION_STOP_WAIT)
+
+
+@api.post("/auth/delete-account", status_code=204)
+async def delete_account(inp: DeleteAccountInput, u=Depends(current_user)):
+    # irreversibile: password richiesta come per change-password, il solo token non basta
+    user = await db.users.find_one({"_id": u["id"]})
+    try:
+        ok = bool(user) and await hash_pool.verify(inp.currentPassword, user.get("passwordHash", ""))
+    except HashPoolSaturated:
+        raise auth_busy()
+    if not ok:
+        raise HTTPException(status_code=401, detail="Password attuale non corretta")
+    # prima l'utente (nessuna nuova generazione passa più current_user), poi si fermano quelle in corso
+    # e se ne aspetta la scrittura finale: dopo delete_many nessuno ricrea i messaggi
+    await db.users.delete_one({"_id": u["id"]})
+    user_cache.invalidate_user(u["id"])
+    await stop_generations(stream_registry.live_for_owner(u["id"]))
+    await db.messages.delete_many({"ownerId": u["id"]})
+    await db.sessions.delete_many({"ownerId": u["id"]})
+    search_indexes.drop(u["id"])
+    resp = Response(status_code=204)
+    resp.delete_cookie("access_token", path="/")
+    return resp
+
+
+@api.get("/metrics", dependencies=[Depends(require_diagnostics)])
+async def metrics_text():
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@api.get("/stats", dependencies=[Depends(require_diagnostics)])
+async def stats():
+    return {"passwordHash": hash_pool.stats(), "userCache": user_cache.stats(), "contextCache": context_cache.stats(), "streams": stream_registry.stats(), "scheduler": scheduler.stats(), "responseCache": response_cache.stats(), "providers": router.stats(), "search": search_indexes.stats()}
+
+
+def page_filter(q: dict, field: str, cursor: Optional[str], older: bool) -> dict:
+    if not cursor:
+        return q
+    try:
+        return {**q, **keyset_filter(field, cursor, older)}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@api.get("/sessions", response_model=SessionsPage)
+async def sessions_list(limit: int = Query(DEFAULT_PAGE, ge=1, le=MAX_PAGE), before: Optional[str] = None, u=Depends(current_user)):
+    q = page_filter({"ownerId": u["id"]}, "updatedAt", before, older=True)
+    docs = await db.sessions.find(q).sort([("updatedAt", -1), ("_id", -1)]).limit(limit + 1).to_list(limit + 1)
+    more = len(docs) > limit
+    docs = docs[:limit]
+    return SessionsPage(items=[to_session(d) for d in docs], nextCursor=encode_cursor(docs[-1]["updatedAt"], docs[-1]["_id"]) if more else None)
+
+
+@api.post("/sessions", response_model=SessionModel, status_code=201)
+async def sessions_create(u=Depends(current_user)):
+    s = SessionModel(ownerId=u["id"])
+    await db.sessions.insert_one(session_doc(s))
+    search_indexes.session_saved(u["id"], session_doc(s))
+    return s
+
+
+@api.put("/sessions/{sid}", response_model=SessionModel)
+async def sessions_update(sid: str, body: SessionUpdate, u=Depends(current_user)):
+    doc = await db.sessions.find_one({"_id": sid, "ownerId": u["id"]})
+    if not doc:
+        raise HTTPException(status_code=404, detail="Session not found")
+    s = to_session(doc)
+    if body.title is not None:
+        s.title = body.title
+    if body.model is not None:
+        s.model = body.model
+    s.updatedAt = datetime.utcnow()
+    await db.sessions.update_one({"_id": sid, "ownerId": u["id"]}, {"$set": session_doc(s)})
+    search_indexes.session_saved(u["id"], session_doc(s))
+    return s
+
+
+@api.delete("/sessions/{sid}", status_code=204)
+async def sessions_delete(sid: str, u=Depends(current_user)):
+    # come delete-account: prima la sessione (nessun nuovo stream la trova), poi si fermano le
+    # generazioni in corso, altrimenti l'upsert dello StreamWriter ricrea messaggi orfani
+    await db.sessions.delete_one({"_id": sid, "ownerId": u["id"]})
+    await stop_generations([b for b in stream_registry.live_for_owner(u["id"]) if b.session_id == sid])
+    await db.messages.delete_many({"sessionId": sid, "ownerId": u["id"]})
+    context_cache.invalidate(sid)
+    search_indexes.session_deleted(u["id"], sid)
+    return
+
+
+@api.get("/sessions/{sid}/messages", response_model=MessagesPage)
+async def messages_get(sid: str, limit: int = Query(DEFAULT_PAGE, ge=1, le=MAX_PAGE), before: Optional[str] = None, after: Optional[str] = None, u=Depends(current_user)):
+    # Senza cursori: gli ultimi `limit` messaggi. before: pagina precedente (più vecchia), after: successiva.
+    # items è sempre in ordine cronologico; nextCursor continua nella stessa direzione.
+    sess = await db.sessions.find_one({"_id": sid, "ownerId": u["id"]}, {"_id": 1})
+    if not sess:
+        raise HTTPException(status_code=404, detail="Session not found")
+    if before is not None and after is not None:
+        raise HTTPException(status_code=400, detail="Use either before or after")
+    older = after is None
+    q = page_filter({"sessionId": sid, "ownerId": u["id"]}, "createdAt", before if older else after, older)
+    order = -1 if older else 1
+    docs = await db.messages.find(q).sort([("createdAt", order), ("_id", order)]).limit(limit + 1).to_list(limit + 1)
+    more = len(docs) > limit
+    docs = docs[:limit]
+    next_cursor = encode_cursor(docs[-1]["createdAt"], docs[-1]["_id"]) if more else None
+    if older:
+        docs.reverse()
+    return MessagesPage(items=[to_message(d) for d in docs], nextCursor=next_cursor)
+
+
+async def mock_delta(prompt: str) -> AsyncGenerator[str, None]:
+    text = f"Certo! Risposta mock per: '{prompt[:60]}'. Questa è una demo streaming."
+    for w in text.split(" "):
+        await asyncio.sleep(0.03)
+        yield w + " "
+
+
+def resolve_model(model: str) -> str:
+    return router.resolve(model)
+
+
+async def openai_stream_generator(messages: List[dict], model: str, temperature: float) -> AsyncGenerator[str, None]:
+    # provider, failover, circuit breaker e hedging: backend/providers.py
+    start, first = time.perf_counter(), True
+    async for delta in router.stream(model, {"messages": messages, "temperature": temperature}):
+        if first:
+            metrics.UPSTREAM_TTFT.observe(time.perf_counter() - start)
+            first = False
+        yield delta
+
+
+async def summarize_turns(previous: Optional[str], turns: List[dict]) -> str:
+    text = "\n".join(f"{m['role']}: {m['content']}" for m in turns)
+    prompt = [
+        {"role": "system", "content": "Riassumi in modo conciso la conversazione mantenendo fatti, decisioni e preferenze dell'utente."},
+        {"role": "user", "content": (f"Riassunto precedente:\n{previous}\n\n" if previous else "") + f"Nuovi turni:\n{text}"},
+    ]
+    return "".join([d async for d in openai_stream_generator(prompt, "gpt-4o-mini", 0.2)])
+
+
+background_tasks = set()
+
+
+def spawn(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+@api.post("/chat/stream")
+async def chat_stream(body: ChatStreamInput, u=Depends(current_user)):
+    sess = await db.sessions.find_one({"_id": body.sessionId, "ownerId": u["id"]})
+    if not sess:
+        raise HTTPException(status_code=404, detail="Session not found")
+    if body.content is not None:
+        last_user = body.content
+    elif body.messages is not None:
+        last_user = ""
+        for m in reversed(body.messages):
+            if m.get("role") == "user":
+                last_user = m.get("content", "")
+                break
+    else:
+        raise HTTPException(status_code=422, detail="content or messages required")
+
+    # Lo slot in coda si prenota prima di ogni scrittura: con un 429 non restano in Mongo (né nella
+    # finestra di contesto in cache) la domanda e un assistant vuoto. Il job parte solo quando la
+    # generazione è pronta (ready); se il setup fallisce lo slot viene rilasciato.
+    ready: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    async def run():
+        await (await ready)()
+
+    async def on_drop():
+        if ready.done() and not ready.cancelled():
+            await dropped_before_start()
+
+    try:
+        job = scheduler.submit(u["id"], run, on_drop)
+    except SchedulerFull:
+        raise generation_busy()
+    now = utcnow_ms()
+    user_msg = MessageModel(ownerId=u["id"], sessionId=body.sessionId, role="user", content=last_user, createdAt=now)
+    try:
+        window = await get_window(db, sess) if body.content is not None else None
+        await db.messages.insert_one(message_doc(user_msg))
+        await db.sessions.update_one({"_id": body.sessionId}, {"$set": {"updatedAt": now}})
+    except BaseException:
+        ready.cancel()
+        job.cancel()
+        raise
+    search_indexes.message_added(u["id"], message_doc(user_msg))
+    dropped = []
+    if window is not None:
+        window.append("user", last_user, now)
+        window.version = now
+        prompt, dropped = window.build()
+    else:
+        prompt = body.messages
+
+    # createdAt fissato all'inizio dello stream (e dopo la domanda) così l'ordine resta stabile
+    assistant = MessageModel(ownerId=u["id"], sessionId=body.sessionId, role="assistant", content="", status="streaming", createdAt=now + timedelta(milliseconds=1))
+    writer = StreamWriter(db, message_doc(assistant))
+    buf = stream_registry.create(u["id"], assistant.id, writer.text, session_id=body.sessionId)
+    buf.publish(f"{{\"type\":\"start\",\"streamId\": {json.dumps(buf.id)},\"messageId\": {json.dumps(assistant.id)} }}")
+
+    # La generazione non dipende dalla connessione: pubblica nel buffer dello stream,
+    # la risposta HTTP (e ogni ripresa) ne è solo un sottoscrittore.
+    temperature = body.temperature if body.temperature is not None else 0.3
+    key = cache_key(resolve_model(body.model), temperature, prompt) if response_cache.applies(temperature) else None
+
+    async def generate():
+        status = "aborted"
+        done = None
+        sent = False
+        out = Coalescer(buf)
+        try:
+            try:
+                cached = await response_cache.get(db, key) if key else None
+                source = replay(cached) if cached is not None else openai_stream_generator(prompt, body.model, temperature)
+                async for delta in source:
+                    sent = True
+                    writer.add(delta)
+                    out.add(delta)
+                out.flush()
+                status = "complete"
+                if key and cached is None:
+                    # solo risposte complete del provider: il fallback mock sotto non arriva mai qui
+                    await response_cache.put(db, key, writer.text(), resolve_model(body.model))
+            except Exception as e:
+                if sent:
+                    # errore a metà risposta: il mock non va accodato al testo vero, si chiude come aborted
+                    raise
+                logging.warning(f"OpenAI fallback: {e}")
+                metrics.MOCK_FALLBACK.inc()
+                out.flush()
+                async for delta in mock_delta(last_user):
+                    writer.add(delta)
+                    out.add(delta)
+                out.flush()
+                status = "complete"
+            done = utcnow_ms()
+            await writer.close(status, done)
+            if window is not None:
+                window.append("assistant", writer.text(), assistant.createdAt)
+                window.version = done
+                if dropped:
+                    spawn(refresh_summary(db, body.sessionId, window, dropped, summarize_turns))
+            buf.publish(f"{{\"type\":\"end\",\"messageId\": {json.dumps(assistant.id)} }}")
+        except Exception as e:
+            logging.warning(f"Generation failed after first token: {e}")
+            out.flush()
+            buf.publish(f"{{\"type\":\"error\",\"error\": {json.dumps(str(e))} }}")
+        finally:
+            out.flush()
+            try:
+                # cancellata (stop esplicito o nessun client rientrato entro il grace period): salva come aborted
+                if not writer.closed:
+                    done = utcnow_ms()
+                    await writer.close("aborted", done)
+                else:
+                    await writer.wait_closed()
+            finally:
+                # un secondo cancel durante le await sopra non deve lasciare il buffer aperto (heartbeat
+                # infiniti, mai evict): la scrittura finale è protetta e prosegue comunque
+                search_indexes.message_added(u["id"], {**message_doc(assistant), "content": writer.text()})
+                buf.finish()
+                metrics.STREAM_CHUNKS.observe(out.frames)
+                metrics.STREAM_BYTES.observe(len(writer.text().encode()))
+
+    async def dropped_before_start():
+        await writer.close("aborted", utcnow_ms())
+        buf.finish()
+
+    ready.set_result(generate)
+    buf.canceller = job.cancel
+    return StreamingResponse(buf.subscribe(0), media_type="text/event-stream")
+
+
+@api.get("/search", response_model=SearchPage)
+async def search_messages(q: str = Query(..., min_length=1, max_length=200), limit: int = Query(20, ge=1, le=MAX_PAGE), cursor: Optional[str] = None, u=Depends(current_user)):
+    # cursor = offset nella classifica (il ranking non ha una chiave stabile per il keyset)
+    try:
+        offset = int(cursor) if cursor else 0
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if offset < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    index = await get_index(db, u["id"])
+    while True:
+        page, more = index.search(q, limit, offset)
+        sids = list({doc[2] for _, doc in page})
+        mids = [doc[1] for _, doc in page if doc[0] == "message"]
+        # l'indice non tiene il testo: titoli e contenuti solo per i risultati della pagina
+        sessions, messages = await asyncio.gather(
+            db.sessions.find({"_id": {"$in": sids}, "ownerId": u["id"]}, {"title": 1}).to_list(None),
+            db.messages.find({"_id": {"$in": mids}, "ownerId": u["id"]}, {"content": 1}).to_list(None),
+        )
+        titles = {d["_id"]: d.get("title", "") for d in sessions}
+        texts = {d["_id"]: d.get("content", "") for d in messages}
+        gone = [sid for sid in sids if sid not in titles]
+        lost = [mid for mid in mids if mid not in texts]
+        if not gone and not lost:
+            break
+        # sessioni o messaggi cancellati da un altro worker: fuori dall'indice e si ricalcola la pagina
+        for sid in gone:
+            index.remove_session(sid)
+        for mid in lost:
+            index.remove_key(mid)
+    terms = set(tokenize(q))
+    items = []
+    for score, (kind, key, sid, role, created, _, _) in page:
+        snip, marks = snippet(texts[key] if kind == "message" else titles[sid], terms)
+        items.append(SearchHit(kind=kind, sessionId=sid, sessionTitle=titles[sid], messageId=key if kind == "message" else None, role=role, snippet=snip, highlights=marks, score=round(score, 4), createdAt=created))
+    return SearchPage(items=items, nextCursor=str(offset + limit) if more else None, partial=index.partial)
+
+
+def stream_for(stream_id: str, u: dict):
+    buf = stream_registry.get(stream_id, u["id"])
+    if buf is None:
+        raise HTTPException(status_code=404, detail="Stream not found")
+    return buf
+
+
+@api.get("/chat/stream/{stream_id}")
+async def chat_stream_resume(stream_id: str, request: Request, u=Depends(current_user)):
+    # Riprende uno stream da Last-Event-ID (header o query lastEventId): replay dal buffer, poi live
+    buf = stream_for(stream_id, u)
+    raw = request.headers.get("Last-Event-ID") or request.query_params.get("lastEventId") or "0"
+    try:
+        last_id = int(raw)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+    stream_registry.resumes += 1
+    return StreamingResponse(buf.subscribe(last_id), media_type="text/event-stream")
+
+
+@api.get("/sessions/{sid}/stream")
+async def session_stream(sid: str, u=Depends(current_user)):
+    # Altre tab sulla stessa sessione si agganciano alla generazione in corso (fan-out dal buffer)
+    buf = stream_registry.live_for_session(sid, u["id"])
+    if buf is None:
+        raise HTTPException(status_code=404, detail="No active stream")
+    return StreamingResponse(buf.subscribe(0), media_type="text/event-stream")
+
+
+@api.post("/chat/stream/{stream_id}/cancel", status_code=204)
+async def chat_stream_cancel(stream_id: str, u=Depends(current_user)):
+    stream_for(stream_id, u).cancel()
+    return Response(status_code=204)
 
 
+app.include_router(api)
 
+if METRICS_SERVER_TIMING:
+    app.add_middleware(ServerTimingMiddleware)
+
+cors_env = os.environ.get("CORS_ORIGINS", "")
+origins = [o.strip() for o in cors_env.split(",") if o.strip()]
+if origins:
+    app.add_middleware(CORSMiddleware, allow_origins=origins, allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+else:
+    app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=False, allow_methods=["*"], allow_headers=["*"])
+
+
+@app.on_event("startup")
+async def startup_event():
+    metrics.start_loop_monitor()
+    if db is None:
+        return
+    if MONGO_ENSURE_INDEXES:
+        await ensure_indexes(db)
+    if MONGO_VERIFY_PLANS:
+        await verify_query_plans(db)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    metrics.stop_loop_monitor()
+    await scheduler.stop()
+    await upstream.close_client()
+    hash_pool.shutdown()
+    if client:
+        client.close()
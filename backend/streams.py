@@ -0,0 +1,221 @@
+from collections import OrderedDict, deque
+from json.encoder import encode_basestring
+from typing import AsyncGenerator, Callable, List, Optional
+import os, json, time, asyncio, uuid
+
+# Stream SSE riprendibili. La generazione scrive eventi numerati in un ring buffer per stream;
+# le connessioni HTTP sono solo sottoscrittori che rileggono dal buffer a partire da un Last-Event-ID
+# e poi seguono la generazione live. Se il client cade, la generazione continua per
+# STREAM_ORPHAN_GRACE secondi in attesa di una ripresa, poi viene cancellata.
+# I frame sono bytes già codificati; i delta del provider passano da un Coalescer che li unisce
+# in un frame per dimensione o per tempo invece di scrivere un frame (e un segmento TCP) per token.
+
+STREAM_REPLAY_EVENTS = int(os.environ.get("STREAM_REPLAY_EVENTS", "4096"))
+STREAM_REPLAY_TTL = float(os.environ.get("STREAM_REPLAY_TTL", "120"))
+STREAM_ORPHAN_GRACE = float(os.environ.get("STREAM_ORPHAN_GRACE", "30"))
+STREAM_MAX_BUFFERS = int(os.environ.get("STREAM_MAX_BUFFERS", "10000"))
+STREAM_COALESCE_BYTES = int(os.environ.get("STREAM_COALESCE_BYTES", "1024"))
+STREAM_COALESCE_DELAY = float(os.environ.get("STREAM_COALESCE_DELAY", "0.016"))
+STREAM_HEARTBEAT = float(os.environ.get("STREAM_HEARTBEAT", "15"))
+
+FRAME = b"id: %d\ndata: %b\n\n"
+CHUNK_FRAME = b'id: %d\ndata: {"type":"chunk","delta":%b}\n\n'
+HEARTBEAT = b": hb\n\n"
+
+
+def sse_frame(seq: int, payload: str) -> bytes:
+    return FRAME % (seq, payload.encode())
+
+
+def chunk_frame(seq: int, text: str) -> bytes:
+    # encode_basestring è l'escape C di json.dumps, senza il resto della serializzazione
+    return CHUNK_FRAME % (seq, encode_basestring(text).encode())
+
+
+class StreamBuffer:
+    def __init__(self, owner_id: str, message_id: str, snapshot: Optional[Callable[[], str]] = None, maxlen: int = STREAM_REPLAY_EVENTS, session_id: Optional[str] = None):
+        self.id = str(uuid.uuid4())
+        self.owner_id = owner_id
+        self.message_id = message_id
+        self.session_id = session_id
+        # snapshot(): testo completo generato finora, usato quando il Last-Event-ID è già uscito dal ring buffer.
+        # Ne vale solo il prefisso già pubblicato (published caratteri): il resto è ancora nel Coalescer
+        # e arriverà col prossimo chunk, altrimenti il client lo riceverebbe due volte.
+        self.snapshot = snapshot
+        self.published = 0
+        # seq dell'ultimo chunk: lo snapshot ne prende il posto, gli eventi successivi (end/error) vanno ancora rigiocati
+        self.chunk_seq = 0
+        self.events = deque(maxlen=maxlen)
+        self.seq = 0
+        self.done = False
+        self.finished_at: Optional[float] = None
+        self.subscribers = 0
+        # canceller: ferma la generazione che alimenta il buffer (job dello scheduler)
+        self.canceller: Optional[Callable[[], None]] = None
+        self.cancelled = False
+        self._changed = asyncio.Event()
+        self._orphan_timer: Optional[asyncio.TimerHandle] = None
+
+    def publish(self, payload: str) -> int:
+        self.seq += 1
+        self.events.append((self.seq, sse_frame(self.seq, payload)))
+        self._wake()
+        return self.seq
+
+    def publish_chunk(self, text: str) -> int:
+        self.published += len(text)
+        self.seq += 1
+        self.chunk_seq = self.seq
+        self.events.append((self.seq, chunk_frame(self.seq, text)))
+        self._wake()
+        return self.seq
+
+    def finish(self):
+        if not self.done:
+            self.done = True
+            self.finished_at = time.monotonic()
+            self._wake()
+
+    def cancel(self):
+        # una volta sola: stop ripetuti, orphan timer e delete-account non devono cancellare anche la chiusura
+        if self.canceller is not None and not self.done and not self.cancelled:
+            self.cancelled = True
+            self.canceller()
+
+    async def wait_finished(self):
+        while not self.done:
+            await self._changed.wait()
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _attach(self):
+        self.subscribers += 1
+        if self._orphan_timer is not None:
+            self._orphan_timer.cancel()
+            self._orphan_timer = None
+
+    def _detach(self):
+        self.subscribers -= 1
+        if self.subscribers == 0 and not self.done:
+            self._orphan_timer = asyncio.get_running_loop().call_later(STREAM_ORPHAN_GRACE, self._orphaned)
+
+    def _orphaned(self):
+        self._orphan_timer = None
+        if self.subscribers == 0:
+            self.cancel()
+
+    async def subscribe(self, last_id: int = 0) -> AsyncGenerator[bytes, None]:
+        self._attach()
+        try:
+            cursor = last_id
+            while True:
+                changed = self._changed
+                if self.events and cursor + 1 < self.events[0][0]:
+                    # buco nel replay: manda lo stato completo al posto degli eventi persi
+                    cursor = self.chunk_seq
+                    text = self.snapshot()[:self.published] if self.snapshot else ""
+                    yield sse_frame(cursor, json.dumps({"type": "snapshot", "content": text}))
+                for seq, frame in list(self.events):
+                    if seq > cursor:
+                        cursor = seq
+                        yield frame
+                if self.done and cursor >= self.seq:
+                    return
+                if cursor >= self.seq:
+                    if STREAM_HEARTBEAT <= 0:
+                        await changed.wait()
+                        continue
+                    # heartbeat solo sugli stream fermi (es. attesa del primo token), non per token
+                    try:
+                        await asyncio.wait_for(changed.wait(), STREAM_HEARTBEAT)
+                    except asyncio.TimeoutError:
+                        yield HEARTBEAT
+        finally:
+            self._detach()
+
+
+class Coalescer:
+    # Unisce i delta in frame chunk: flush a max_bytes caratteri accumulati o dopo max_delay secondi.
+    # Il primo delta parte subito per non ritardare il time-to-first-token; max_delay 0 = un frame per delta.
+    def __init__(self, buf: StreamBuffer, max_bytes: int = STREAM_COALESCE_BYTES, max_delay: float = STREAM_COALESCE_DELAY):
+        self.buf = buf
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.parts: List[str] = []
+        self.pending = 0
+        self.frames = 0
+        self._first = True
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def add(self, delta: str):
+        self.parts.append(delta)
+        self.pending += len(delta)
+        if self._first or self.pending >= self.max_bytes or self.max_delay <= 0:
+            self._first = False
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay, self.flush)
+
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self.parts:
+            return
+        text = self.parts[0] if len(self.parts) == 1 else "".join(self.parts)
+        self.parts.clear()
+        self.pending = 0
+        self.frames += 1
+        self.buf.publish_chunk(text)
+
+
+class StreamRegistry:
+    def __init__(self, ttl: float = STREAM_REPLAY_TTL, max_buffers: int = STREAM_MAX_BUFFERS):
+        self.ttl = ttl
+        self.max_buffers = max_buffers
+        self._buffers: "OrderedDict[str, StreamBuffer]" = OrderedDict()
+        self.resumes = 0
+
+    def create(self, owner_id: str, message_id: str, snapshot: Optional[Callable[[], str]] = None, session_id: Optional[str] = None) -> StreamBuffer:
+        self.evict()
+        buf = StreamBuffer(owner_id, message_id, snapshot, session_id=session_id)
+        self._buffers[buf.id] = buf
+        return buf
+
+    def get(self, stream_id: str, owner_id: str) -> Optional[StreamBuffer]:
+        buf = self._buffers.get(stream_id)
+        if buf is None or buf.owner_id != owner_id:
+            return None
+        return buf
+
+    def live_for_session(self, session_id: str, owner_id: str) -> Optional[StreamBuffer]:
+        for buf in reversed(self._buffers.values()):
+            if not buf.done and buf.session_id == session_id and buf.owner_id == owner_id:
+                return buf
+        return None
+
+    def live_for_owner(self, owner_id: str) -> List[StreamBuffer]:
+        return [b for b in self._buffers.values() if not b.done and b.owner_id == owner_id]
+
+    def evict(self):
+        # eviction pigra: buffer conclusi da più di ttl secondi, poi i più vecchi conclusi oltre il limite
+        now = time.monotonic()
+        for sid in [sid for sid, b in self._buffers.items() if b.done and now - b.finished_at > self.ttl]:
+            del self._buffers[sid]
+        if len(self._buffers) >= self.max_buffers:
+            for sid in [sid for sid, b in self._buffers.items() if b.done][: len(self._buffers) - self.max_buffers + 1]:
+                del self._buffers[sid]
+
+    def stats(self) -> dict:
+        live = sum(1 for b in self._buffers.values() if not b.done)
+        return {
+            "buffers": len(self._buffers),
+            "live": live,
+            "subscribers": sum(b.subscribers for b in self._buffers.values()),
+            "resumes": self.resumes,
+        }
+
+
+stream_registry = StreamRegistry()
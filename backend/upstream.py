@@ -0,0 +1,95 @@
+from typing import AsyncGenerator, Dict, Optional
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+import os, time, asyncio, json, httpx
+import metrics
+
+# Client HTTP asincrono condiviso verso i provider OpenAI-compatibili.
+# Un solo pool keep-alive per worker, limiti di concorrenza per host e timeout separati
+# per connect/read: uno stream lento non blocca più l'event loop di uvicorn.
+
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+UPSTREAM_MAX_CONNECTIONS = int(os.environ.get("UPSTREAM_MAX_CONNECTIONS", "200"))
+UPSTREAM_MAX_KEEPALIVE = int(os.environ.get("UPSTREAM_MAX_KEEPALIVE", "50"))
+UPSTREAM_PER_HOST_LIMIT = int(os.environ.get("UPSTREAM_PER_HOST_LIMIT", "100"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", "5"))
+UPSTREAM_READ_TIMEOUT = float(os.environ.get("UPSTREAM_READ_TIMEOUT", "60"))
+UPSTREAM_ACQUIRE_TIMEOUT = float(os.environ.get("UPSTREAM_ACQUIRE_TIMEOUT", "10"))
+
+
+class UpstreamError(RuntimeError):
+    pass
+
+
+_client: Optional[httpx.AsyncClient] = None
+_host_slots: Dict[str, asyncio.Semaphore] = {}
+
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=UPSTREAM_MAX_CONNECTIONS, max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE),
+            timeout=httpx.Timeout(connect=UPSTREAM_CONNECT_TIMEOUT, read=UPSTREAM_READ_TIMEOUT, write=UPSTREAM_CONNECT_TIMEOUT, pool=UPSTREAM_ACQUIRE_TIMEOUT),
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+    _host_slots.clear()
+
+
+@asynccontextmanager
+async def host_slot(url: str):
+    host = urlsplit(url).netloc
+    sem = _host_slots.get(host)
+    if sem is None:
+        sem = _host_slots[host] = asyncio.Semaphore(UPSTREAM_PER_HOST_LIMIT)
+    try:
+        await asyncio.wait_for(sem.acquire(), UPSTREAM_ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise UpstreamError(f"Upstream {host} saturated ({UPSTREAM_PER_HOST_LIMIT} concurrent streams)")
+    try:
+        yield
+    finally:
+        sem.release()
+
+
+def parse_sse_line(raw: str) -> Optional[str]:
+    # Ritorna il delta testuale di una riga SSE chat.completions, "" se la riga va ignorata, None su [DONE].
+    if not raw.startswith("data:"):
+        return ""
+    data = raw[5:].strip()
+    if data == "[DONE]":
+        return None
+    try:
+        j = json.loads(data)
+        return j["choices"][0]["delta"].get("content") or ""
+    except Exception:
+        return ""
+
+
+async def stream_chat_completion(payload: dict, api_key: str, base_url: str = OPENAI_BASE_URL) -> AsyncGenerator[str, None]:
+    url = f"{base_url}/chat/completions"
+    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+    async with host_slot(url):
+        # Se il client si disconnette, la cancellazione del task chiude il context manager
+        # e httpx rilascia (o scarta) la connessione del pool.
+        start = time.perf_counter()
+        async with get_client().stream("POST", url, headers=headers, json={**payload, "stream": True}) as resp:
+            metrics.UPSTREAM_CONNECT.observe(time.perf_counter() - start)
+            if resp.status_code != 200:
+                text = (await resp.aread()).decode("utf-8", "replace")
+                raise UpstreamError(f"OpenAI error {resp.status_code}: {text[:200]}")
+            async for raw in resp.aiter_lines():
+                if not raw:
+                    continue
+                delta = parse_sse_line(raw)
+                if delta is None:
+                    break
+                if delta:
+                    yield delta
@@ -0,0 +1,89 @@
+from collections import OrderedDict
+from typing import Dict, Optional, Set
+import os, time
+
+# Cache in-process dell'utente autenticato, chiave = token JWT.
+# Evita un find_one su users per ogni richiesta autenticata (compreso ogni /chat/stream).
+# È per-worker: le invalidazioni valgono solo nel processo che le esegue, il TTL limita
+# la finestra in cui gli altri worker possono servire un utente non aggiornato.
+
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "60"))
+
+
+class UserCache:
+    def __init__(self, maxsize: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._by_user: Dict[str, Set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, token: str) -> Optional[dict]:
+        entry = self._entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+        user, expires = entry
+        if expires <= time.monotonic():
+            self._drop(token)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return user
+
+    def set(self, token: str, user: dict, max_age: Optional[float] = None):
+        if self.maxsize <= 0:
+            return
+        ttl = self.ttl if max_age is None else min(self.ttl, max_age)
+        if ttl <= 0:
+            return
+        if token in self._entries:
+            self._drop(token)
+        self._entries[token] = (user, time.monotonic() + ttl)
+        self._by_user.setdefault(user["id"], set()).add(token)
+        while len(self._entries) > self.maxsize:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def invalidate(self, token: str):
+        if token in self._entries:
+            self._drop(token)
+            self.invalidations += 1
+
+    def invalidate_user(self, uid: str):
+        for token in list(self._by_user.get(uid, ())):
+            self.invalidate(token)
+
+    def clear(self):
+        self._entries.clear()
+        self._by_user.clear()
+
+    def _drop(self, token: str):
+        user, _ = self._entries.pop(token)
+        tokens = self._by_user.get(user["id"])
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._by_user[user["id"]]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxSize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRatio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+user_cache = UserCache()
@@ -90,8 +90,8 @@ def test_list_sessions():
         print(f"Status Code: {response.status_code}")
         
         if response.status_code == 200:
-            sessions = response.json()
-            print(f"Found {len(sessions)} sessions")
+            sessions = response.json()["items"]
+            print(f"Found {len(sessions)} sessions (nextCursor: {response.json().get('nextCursor')})")
             if len(sessions) > 0:
                 print(f"Sample session: {sessions[0]}")
             print("✅ List sessions working correctly")
@@ -138,7 +138,7 @@ def test_get_messages(session_id):
         print(f"Status Code: {response.status_code}")
         
         if response.status_code == 200:
-            messages = response.json()
+            messages = response.json()["items"]
             print(f"Found {len(messages)} messages")
             for msg in messages:
                 print(f"  - {msg.get('role')}: {msg.get('content')[:50]}...")
@@ -0,0 +1,65 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+# token di /api/stats e /api/metrics per il backend avviato da local_stack
+DIAGNOSTICS_TOKEN = "bench-diagnostics"
+DIAGNOSTICS_HEADERS = {"Authorization": f"Bearer {DIAGNOSTICS_TOKEN}"}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_http(url, timeout=20.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up in {timeout}s")
+
+
+def pct(values, p):
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(len(s) * p))]
+
+
+async def loop_lag_probe(samples, interval=0.01):
+    while True:
+        t = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - t - interval)
+
+
+@contextmanager
+def local_stack(fake_args=(), env=None, app_args=()):
+    """Avvia fake_llm + backend (mongomock) in sottoprocessi e restituisce l'URL del backend.
+    app_args va a serve_app.py (es. ["--loop-lag"] per esporre /bench/loop-lag)."""
+    fake_port, app_port = free_port(), free_port()
+    procs = []
+    try:
+        procs.append(subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, "fake_llm.py"), "--port", str(fake_port), *fake_args]))
+        wait_http(f"http://127.0.0.1:{fake_port}/docs")
+        app_env = {**os.environ, "OPENAI_BASE_URL": f"http://127.0.0.1:{fake_port}/v1", "OPENAI_API_KEY": "fake", "DIAGNOSTICS_TOKEN": DIAGNOSTICS_TOKEN, **(env or {})}
+        procs.append(subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, "serve_app.py"), "--port", str(app_port), "--mock-db", *app_args], env=app_env))
+        wait_http(f"http://127.0.0.1:{app_port}/api/")
+        yield f"http://127.0.0.1:{app_port}"
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.wait(timeout=10)
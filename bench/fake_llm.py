@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Fake OpenAI-compatible provider
+Serve POST /v1/chat/completions in streaming SSE con rate di token e jitter configurabili,
+così il backend può essere misurato senza chiamare (e pagare) OpenAI.
+
+Uso: python bench/fake_llm.py --port 9009 --tps 50 --jitter 0.2 --tokens 200
+poi avvia il backend con OPENAI_BASE_URL=http://127.0.0.1:9009/v1 OPENAI_API_KEY=fake
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse, JSONResponse
+
+
+def create_app(tps: float = 50.0, jitter: float = 0.0, tokens: int = 100, fail_rate: float = 0.0, first_token_delay: float = 0.0) -> FastAPI:
+    app = FastAPI()
+    app.state.requests = 0
+
+    @app.post("/v1/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        if fail_rate and random.random() < fail_rate:
+            return JSONResponse({"error": {"message": "fake provider failure"}}, status_code=500)
+        model = body.get("model", "fake")
+        n = int(body.get("max_tokens") or tokens)
+        interval = 1.0 / tps if tps > 0 else 0.0
+
+        async def gen():
+            if first_token_delay:
+                await asyncio.sleep(first_token_delay)
+            created = int(time.time())
+            for i in range(n):
+                if interval:
+                    await asyncio.sleep(max(0.0, interval * (1 + random.uniform(-jitter, jitter))))
+                chunk = {"id": "fake", "object": "chat.completion.chunk", "created": created, "model": model,
+                         "choices": [{"index": 0, "delta": {"content": f"tok{i} "}, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(gen(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible streaming provider")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9009)
+    parser.add_argument("--tps", type=float, default=50.0, help="token al secondo per stream")
+    parser.add_argument("--jitter", type=float, default=0.0, help="jitter relativo sull'intervallo fra token (0..1)")
+    parser.add_argument("--tokens", type=int, default=100, help="token per risposta")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="frazione di richieste che rispondono 500")
+    parser.add_argument("--first-token-delay", type=float, default=0.0, help="secondi prima del primo token")
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run(create_app(args.tps, args.jitter, args.tokens, args.fail_rate, args.first_token_delay), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Load test
+Avvia backend (mongomock) + fake_llm in locale e simula N utenti concorrenti che fanno
+register → nuova sessione → conversazione multi-turno su /api/chat/stream.
+Riporta time-to-first-token, latenza fra frame chunk (percentili, "inter_token"), req/s, frame e CPU
+del backend ed event loop lag;
+salva i risultati in JSON e, con --compare, li confronta con una run precedente.
+
+Uso: python bench/load_test.py --users 50 --turns 3 --tps 50 --jitter 0.2 [--out bench/results/run.json] [--compare old.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import time
+import uuid
+from datetime import datetime
+
+import httpx
+
+from common import BENCH_DIR, DIAGNOSTICS_HEADERS, local_stack, loop_lag_probe, pct
+
+QUESTIONS = ["Ciao, come stai?", "Riassumi la risposta precedente.", "Fammi un esempio concreto.", "Grazie, ultima domanda."]
+
+
+class Stats:
+    def __init__(self):
+        self.ttft = []
+        self.gaps = []
+        self.stream_time = []
+        self.latency = {}
+        self.statuses = {}
+        self.errors = []
+        self.requests = 0
+        self.frames = 0
+        self.chars = 0
+
+    def record(self, name, status, elapsed):
+        self.requests += 1
+        self.latency.setdefault(name, []).append(elapsed)
+        key = f"{name} {status}"
+        self.statuses[key] = self.statuses.get(key, 0) + 1
+
+
+async def timed(stats, name, call):
+    t = time.perf_counter()
+    resp = await call
+    stats.record(name, resp.status_code, time.perf_counter() - t)
+    return resp
+
+
+async def chat_turn(client, stats, sid, content):
+    body = {"sessionId": sid, "model": "gpt-4o-mini", "content": content}
+    t0 = time.perf_counter()
+    last = None
+    status = 0
+    async with client.stream("POST", "/api/chat/stream", json=body) as resp:
+        status = resp.status_code
+        if status == 200:
+            async for line in resp.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                event = json.loads(line[5:])
+                now = time.perf_counter()
+                if event.get("type") == "chunk":
+                    stats.frames += 1
+                    stats.chars += len(event["delta"])
+                    if last is None:
+                        stats.ttft.append(now - t0)
+                    else:
+                        stats.gaps.append(now - last)
+                    last = now
+                elif event.get("type") == "error":
+                    stats.errors.append(event.get("error"))
+        else:
+            await resp.aread()
+    elapsed = time.perf_counter() - t0
+    stats.record("chat_stream", status, elapsed)
+    if status == 200:
+        stats.stream_time.append(elapsed)
+
+
+async def simulated_user(base_url, stats, turns, think):
+    async with httpx.AsyncClient(base_url=base_url, timeout=300) as client:
+        email = f"load-{uuid.uuid4().hex[:10]}@example.com"
+        resp = await timed(stats, "register", client.post("/api/auth/register", json={"email": email, "password": "password123"}))
+        if resp.status_code != 200:
+            stats.errors.append(f"register {resp.status_code}")
+            return
+        client.headers["Authorization"] = client.cookies.get("access_token").strip('"')
+        client.cookies.clear()
+        resp = await timed(stats, "create_session", client.post("/api/sessions"))
+        sid = resp.json()["id"]
+        for i in range(turns):
+            await chat_turn(client, stats, sid, QUESTIONS[i % len(QUESTIONS)])
+            if think:
+                await asyncio.sleep(think)
+        await timed(stats, "list_messages", client.get(f"/api/sessions/{sid}/messages"))
+
+
+def ms(values, p):
+    return round(pct(values, p) * 1000, 2)
+
+
+def summary(values):
+    return {"p50_ms": ms(values, 0.5), "p90_ms": ms(values, 0.9), "p99_ms": ms(values, 0.99), "max_ms": round(max(values, default=0.0) * 1000, 2), "count": len(values)}
+
+
+async def run(base_url, args):
+    stats = Stats()
+    client_lag = []
+    async with httpx.AsyncClient(base_url=base_url) as probe_client:
+        cpu_before = (await probe_client.get("/bench/loop-lag", params={"reset": True})).json()["cpu_s"]
+        probe = asyncio.create_task(loop_lag_probe(client_lag))
+        t0 = time.perf_counter()
+        users = []
+        for _ in range(args.users):
+            users.append(asyncio.create_task(simulated_user(base_url, stats, args.turns, args.think)))
+            if args.ramp:
+                await asyncio.sleep(args.ramp / args.users)
+        await asyncio.gather(*users)
+        elapsed = time.perf_counter() - t0
+        probe.cancel()
+        server_lag = (await probe_client.get("/bench/loop-lag")).json()
+        server_stats = (await probe_client.get("/api/stats", headers=DIAGNOSTICS_HEADERS)).json()
+    return {
+        "ttft": summary(stats.ttft),
+        "inter_token": summary(stats.gaps),
+        "stream_duration": summary(stats.stream_time),
+        "endpoints": {name: summary(v) for name, v in sorted(stats.latency.items())},
+        "requests": stats.requests,
+        "requests_per_s": round(stats.requests / elapsed, 2),
+        "streams_per_s": round(len(stats.stream_time) / elapsed, 2),
+        "chunk_frames": stats.frames,
+        "chars_per_frame": round(stats.chars / stats.frames, 1) if stats.frames else 0.0,
+        "chars_per_s": round(stats.chars / elapsed, 2),
+        "server_cpu_s": round(server_lag["cpu_s"] - cpu_before, 3),
+        "elapsed_s": round(elapsed, 2),
+        "statuses": stats.statuses,
+        "errors": stats.errors[:20],
+        "error_count": len(stats.errors),
+        "server_loop_lag": server_lag,
+        # lag del processo di carico: se è alto le misure client sono gonfiate
+        "client_loop_lag": {"p99_ms": ms(client_lag, 0.99), "max_ms": round(max(client_lag, default=0.0) * 1000, 2)},
+        "server_stats": server_stats,
+    }
+
+
+def git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+# (percorso nel JSON, più alto è meglio)
+COMPARED = [
+    (("ttft", "p50_ms"), False), (("ttft", "p99_ms"), False),
+    (("inter_token", "p50_ms"), False), (("inter_token", "p99_ms"), False),
+    (("requests_per_s",), True), (("chars_per_s",), True),
+    (("chunk_frames",), False), (("server_cpu_s",), False),
+    (("server_loop_lag", "p99_ms"), False),
+]
+
+
+def compare(old, new):
+    rows = []
+    for path, higher_better in COMPARED:
+        a, b = old["results"], new["results"]
+        for k in path:
+            a, b = a.get(k, {}) if isinstance(a, dict) else None, b.get(k, {}) if isinstance(b, dict) else None
+        if not isinstance(a, (int, float)) or not isinstance(b, (int, float)):
+            continue
+        delta = (b - a) / a * 100 if a else 0.0
+        worse = delta < 0 if higher_better else delta > 0
+        rows.append(f"{'.'.join(path):<24} {a:>10} → {b:<10} {delta:+7.1f}%{'  !' if worse and abs(delta) >= 10 else ''}")
+    return "\n".join(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent users load test against a local stack")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=3, help="turni di chat per utente")
+    parser.add_argument("--think", type=float, default=0.0, help="pausa fra turni (s)")
+    parser.add_argument("--ramp", type=float, default=1.0, help="secondi per avviare tutti gli utenti")
+    parser.add_argument("--tps", type=float, default=50.0)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--first-token-delay", type=float, default=0.2)
+    parser.add_argument("--rounds", type=int, default=10, help="BCRYPT_ROUNDS del backend")
+    parser.add_argument("--env", action="append", default=[], help="variabile extra per il backend, KEY=VALUE")
+    parser.add_argument("--out", help="file JSON dei risultati (default bench/results/load-<timestamp>.json)")
+    parser.add_argument("--compare", help="JSON di una run precedente da confrontare")
+    args = parser.parse_args()
+
+    env = {"BCRYPT_ROUNDS": str(args.rounds), "GEN_PER_USER_QUEUE": str(max(4, args.turns)), **dict(kv.split("=", 1) for kv in args.env)}
+    fake_args = ["--tps", str(args.tps), "--jitter", str(args.jitter), "--tokens", str(args.tokens), "--first-token-delay", str(args.first_token_delay)]
+    with local_stack(fake_args, env=env, app_args=["--loop-lag"]) as base_url:
+        results = asyncio.run(run(base_url, args))
+
+    config = {k: v for k, v in vars(args).items() if k not in ("out", "compare")}
+    report = {"timestamp": datetime.utcnow().isoformat() + "Z", "git": git_rev(), "config": config, "results": results}
+    out = args.out or os.path.join(BENCH_DIR, "results", f"load-{datetime.utcnow():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps({k: results[k] for k in ("ttft", "inter_token", "requests_per_s", "chunk_frames", "chars_per_s", "server_cpu_s", "server_loop_lag", "error_count")}, indent=2))
+    print(f"saved {out}")
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare(json.load(f), report))
+
+
+if __name__ == "__main__":
+    main()
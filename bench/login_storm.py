@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Login storm benchmark
+Misura la latenza fra chunk SSE di /api/chat/stream mentre N login concorrenti colpiscono
+lo stesso worker. Con --inline l'hashing bcrypt gira sull'event loop (comportamento precedente).
+
+Uso: python bench/login_storm.py --logins 200 --streams 5 [--inline]
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+import httpx
+
+from common import DIAGNOSTICS_HEADERS, local_stack, pct
+
+
+async def stream_gaps(client, headers, sid, gaps):
+    body = {"sessionId": sid, "model": "gpt-4o-mini", "messages": [{"role": "user", "content": "ciao"}]}
+    last = None
+    async with client.stream("POST", "/api/chat/stream", json=body, headers=headers) as resp:
+        async for line in resp.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            now = time.perf_counter()
+            if last is not None:
+                gaps.append(now - last)
+            last = now
+
+
+async def run(base_url, args):
+    gaps, statuses = [], {}
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        email, password = f"bench-{uuid.uuid4().hex[:8]}@example.com", "password123"
+        await client.post("/api/auth/register", json={"email": email, "password": password})
+        token = client.cookies.get("access_token").strip('"').split(" ", 1)[1]
+        headers = {"Authorization": f"Bearer {token}"}
+        sids = [(await client.post("/api/sessions", headers=headers)).json()["id"] for _ in range(args.streams)]
+
+        async def login():
+            r = await client.post("/api/auth/login", json={"email": email, "password": password})
+            statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+
+        t0 = time.perf_counter()
+        streams = [asyncio.create_task(stream_gaps(client, headers, sid, gaps)) for sid in sids]
+        await asyncio.sleep(0.2)
+        await asyncio.gather(*(login() for _ in range(args.logins)))
+        await asyncio.gather(*streams)
+        elapsed = time.perf_counter() - t0
+        pool = (await client.get("/api/stats", headers=DIAGNOSTICS_HEADERS)).json().get("passwordHash", {})
+    return {
+        "mode": "inline" if args.inline else "pool",
+        "logins": args.logins,
+        "login_status": statuses,
+        "streams": args.streams,
+        "chunk_gap_p50_ms": round(pct(gaps, 0.5) * 1000, 2),
+        "chunk_gap_p99_ms": round(pct(gaps, 0.99) * 1000, 2),
+        "chunk_gap_max_ms": round(max(gaps, default=0.0) * 1000, 2),
+        "elapsed_s": round(elapsed, 2),
+        "hash_pool": pool,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="p99 SSE chunk latency during a login storm")
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--streams", type=int, default=5)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--tps", type=float, default=50)
+    parser.add_argument("--rounds", type=int, default=12, help="BCRYPT_ROUNDS del backend")
+    parser.add_argument("--inline", action="store_true", help="PASSWORD_HASH_WORKERS=0: bcrypt sull'event loop")
+    args = parser.parse_args()
+    env = {"BCRYPT_ROUNDS": str(args.rounds), "PASSWORD_HASH_MAX_PENDING": str(max(args.logins, 32)) if args.inline else "32"}
+    if args.inline:
+        env["PASSWORD_HASH_WORKERS"] = "0"
+    with local_stack(["--tps", str(args.tps), "--tokens", str(args.tokens)], env=env) as base_url:
+        print(json.dumps(asyncio.run(run(base_url, args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Search benchmark
+Genera un dataset sintetico (vocabolario con distribuzione di Zipf) di --messages messaggi
+ripartiti su --users utenti più un utente "pesante" con --heavy messaggi, e misura l'indice
+di backend/search.py: tempo di costruzione per utente, memoria, latenza delle query
+(termini presi dai messaggi dell'utente e, a parte, le parole più frequenti = caso peggiore).
+Con --mongomock misura anche build_index da Mongo (mongomock-motor) per un utente tipico.
+
+Uso: python bench/search_bench.py --messages 1000000 --users 1000 --heavy 100000
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import resource
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from search import UserIndex, add_messages, build_index  # noqa: E402
+
+from common import pct  # noqa: E402
+
+SYLLABLES = ["ca", "me", "ri", "to", "la", "ne", "si", "po", "gu", "an", "ze", "bo", "di", "mu", "re", "sta", "pre", "con", "tri", "vo"]
+
+
+def vocabulary(size, rng):
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+class Corpus:
+    def __init__(self, vocab_size, seed):
+        rng = random.Random(seed)
+        self.words = vocabulary(vocab_size, rng)
+        self.cum = list(itertools.accumulate(1.0 / (r + 1) for r in range(vocab_size)))
+        self.start = datetime(2024, 1, 1)
+
+    def messages(self, owner, n, seed, per_session=40):
+        rng = random.Random(seed)
+        for i in range(n):
+            sid = f"{owner}-s{i // per_session}"
+            text = " ".join(rng.choices(self.words, cum_weights=self.cum, k=rng.randint(5, 60)))
+            yield {"_id": f"{owner}-m{i}", "ownerId": owner, "sessionId": sid, "role": "user" if i % 2 == 0 else "assistant", "content": text, "createdAt": self.start + timedelta(seconds=i)}
+
+
+def build(corpus, owner, n, seed):
+    index = UserIndex()
+    t = time.perf_counter()
+    for m in corpus.messages(owner, n, seed):
+        index.add_message(m)
+    return index, time.perf_counter() - t
+
+
+def queries(index, rng, count):
+    # termini presi da documenti dell'utente: 1-3 parole, quindi sempre almeno un risultato
+    docs = list(index.docs.values())
+    out = []
+    for _ in range(count):
+        words = list(rng.choice(docs)[5])
+        out.append(" ".join(rng.sample(words, min(len(words), rng.randint(1, 3)))))
+    return out
+
+
+def timed_queries(index, qs, limit=20):
+    lat = []
+    for q in qs:
+        t = time.perf_counter()
+        index.search(q, limit)
+        lat.append(time.perf_counter() - t)
+    return {"p50_ms": round(pct(lat, 0.5) * 1000, 3), "p99_ms": round(pct(lat, 0.99) * 1000, 3), "max_ms": round(max(lat) * 1000, 3), "count": len(lat)}
+
+
+async def max_loop_stall(coro):
+    # blocco più lungo dell'event loop mentre gira coro (quanto fermerebbe gli stream SSE del worker)
+    last, stall = time.perf_counter(), 0.0
+
+    async def ticker():
+        nonlocal last, stall
+        while True:
+            await asyncio.sleep(0)
+            now = time.perf_counter()
+            stall, last = max(stall, now - last), now
+
+    tick = asyncio.create_task(ticker())
+    await asyncio.sleep(0)
+    t = time.perf_counter()
+    result = await coro
+    end = time.perf_counter()
+    tick.cancel()
+    return result, end - t, max(stall, end - last)
+
+
+async def mongomock_build(corpus, n):
+    from mongomock_motor import AsyncMongoMockClient
+    db = AsyncMongoMockClient()["bench"]
+    docs = list(corpus.messages("mm", n, 7))
+    await db.messages.insert_many(docs)
+    await db.sessions.insert_many([{"_id": sid, "ownerId": "mm", "title": f"Sessione {sid}", "updatedAt": corpus.start} for sid in {d["sessionId"] for d in docs}])
+    index, took, stall = await max_loop_stall(build_index(db, "mm"))
+    # solo la tokenizzazione: con Mongo vero la decodifica dei batch BSON gira nel thread di motor,
+    # mongomock invece copia i documenti sul loop e domina lo stallo della riga sopra
+    _, tokenize_s, tokenize_stall = await max_loop_stall(add_messages(UserIndex(), docs))
+    return {
+        "messages": n,
+        "docs": len(index.docs),
+        "build_s": round(took, 3),
+        "max_loop_stall_ms": round(stall * 1000, 2),
+        "tokenize_s": round(tokenize_s, 3),
+        "tokenize_max_loop_stall_ms": round(tokenize_stall * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process search index benchmark")
+    parser.add_argument("--messages", type=int, default=1_000_000, help="messaggi totali del dataset")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--heavy", type=int, default=100_000, help="messaggi dell'utente più grande (incluso nel totale)")
+    parser.add_argument("--sample-users", type=int, default=50, help="utenti tipici su cui misurare build e query")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--vocab", type=int, default=50_000)
+    parser.add_argument("--mongomock", type=int, nargs="?", const=0, default=None, metavar="N", help="build_index da mongomock per N messaggi (default: quelli di un utente tipico)")
+    args = parser.parse_args()
+
+    corpus = Corpus(args.vocab, 1)
+    rng = random.Random(2)
+    per_user = (args.messages - args.heavy) // max(1, args.users - 1)
+
+    # utenti tipici: l'indice è per utente, la latenza dipende dai suoi messaggi e non dal totale
+    builds, typical = [], []
+    for u in range(args.sample_users):
+        index, secs = build(corpus, f"u{u}", per_user, u)
+        builds.append(secs)
+        typical += [(index, q) for q in queries(index, rng, max(1, args.queries // args.sample_users))]
+    lat = []
+    for index, q in typical:
+        t = time.perf_counter()
+        index.search(q, 20)
+        lat.append(time.perf_counter() - t)
+    del typical
+    # memoria misurata a parte: tracemalloc rallenta molto la costruzione
+    tracemalloc.start()
+    kept = build(corpus, "mem", per_user, 0)
+    typical_mem = tracemalloc.get_traced_memory()[0]
+    typical_approx = kept[0].approx_bytes()
+    del kept
+    tracemalloc.stop()
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    heavy, heavy_build = build(corpus, "heavy", args.heavy, 99)
+    heavy_mem = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) * 1024
+    common_words = " ".join(corpus.words[:2])
+
+    report = {
+        "dataset": {"messages": args.messages, "users": args.users, "messages_per_user": per_user, "heavy_user_messages": args.heavy, "vocab": args.vocab},
+        "typical_user": {
+            "build_ms_p50": round(pct(builds, 0.5) * 1000, 2),
+            "index_mb": round(typical_mem / 1e6, 2),
+            "approx_mb": round(typical_approx / 1e6, 2),
+            "query": {"p50_ms": round(pct(lat, 0.5) * 1000, 3), "p99_ms": round(pct(lat, 0.99) * 1000, 3), "count": len(lat)},
+        },
+        "heavy_user": {
+            "build_s": round(heavy_build, 2),
+            "rss_growth_mb": round(heavy_mem / 1e6, 1),
+            "approx_mb": round(heavy.approx_bytes() / 1e6, 1),
+            "terms": len(heavy.postings),
+            "query": timed_queries(heavy, queries(heavy, rng, args.queries)),
+            "rare_term_query": timed_queries(heavy, [corpus.words[-1 - i] for i in range(50)]),
+            "most_frequent_terms_query": timed_queries(heavy, [common_words] * 20),
+        },
+    }
+    if args.mongomock is not None:
+        report["mongomock_build"] = asyncio.run(mongomock_build(corpus, args.mongomock or per_user))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
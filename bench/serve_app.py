@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Backend launcher for benchmarks
+Avvia backend/server.py con uvicorn; con --mock-db sostituisce Mongo con mongomock-motor
+così i benchmark girano senza un database reale. Con --loop-lag campiona il lag dell'event loop
+del backend e lo espone su GET /bench/loop-lag (?reset=1 azzera i campioni).
+
+Uso: OPENAI_BASE_URL=http://127.0.0.1:9009/v1 OPENAI_API_KEY=fake python bench/serve_app.py --port 8001 --mock-db
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from common import loop_lag_probe, pct
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+
+def install_loop_lag(app):
+    samples = []
+
+    @app.on_event("startup")
+    async def start_probe():
+        app.state.lag_probe = asyncio.create_task(loop_lag_probe(samples))
+
+    @app.get("/bench/loop-lag")
+    async def loop_lag(reset: bool = False):
+        out = {
+            "samples": len(samples),
+            "cpu_s": round(time.process_time(), 3),
+            "p50_ms": round(pct(samples, 0.5) * 1000, 2),
+            "p99_ms": round(pct(samples, 0.99) * 1000, 2),
+            "max_ms": round(max(samples, default=0.0) * 1000, 2),
+        }
+        if reset:
+            samples.clear()
+        return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the backend for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--mock-db", action="store_true", help="usa mongomock-motor al posto di MONGO_URL")
+    parser.add_argument("--loop-lag", action="store_true", help="espone GET /bench/loop-lag")
+    args = parser.parse_args()
+
+    import server
+    if args.mock_db:
+        from mongomock_motor import AsyncMongoMockClient
+        server.db = AsyncMongoMockClient()[server.DB_NAME]
+    if args.loop_lag:
+        install_loop_lag(server.app)
+
+    import uvicorn
+    uvicorn.run(server.app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
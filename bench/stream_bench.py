@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Concurrent upstream streams benchmark
+Apre N stream in parallelo verso un provider OpenAI-compatibile (di solito bench/fake_llm.py)
+e misura throughput e lag dell'event loop, con il client asincrono (backend/upstream.py)
+oppure con il vecchio percorso bloccante `requests.post(..., stream=True)` per confronto.
+
+Uso: python bench/stream_bench.py --base-url http://127.0.0.1:9009/v1 --streams 50 [--blocking]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+import upstream  # noqa: E402
+
+
+def blocking_stream(base_url, payload):
+    import requests
+    resp = requests.post(f"{base_url}/chat/completions", json={**payload, "stream": True}, stream=True, timeout=600)
+    for raw in resp.iter_lines(decode_unicode=True):
+        if not raw:
+            continue
+        delta = upstream.parse_sse_line(raw)
+        if delta is None:
+            break
+        if delta:
+            yield delta
+
+
+async def one_stream(base_url, blocking):
+    payload = {"model": "fake", "messages": [{"role": "user", "content": "ciao"}]}
+    n = 0
+    if blocking:
+        # Riproduce il comportamento originale: iterazione sincrona dentro una coroutine.
+        for _ in blocking_stream(base_url, payload):
+            n += 1
+            await asyncio.sleep(0)
+    else:
+        async for _ in upstream.stream_chat_completion(payload, "fake", base_url=base_url):
+            n += 1
+    return n
+
+
+async def loop_lag_probe(samples, interval=0.01):
+    while True:
+        t = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - t - interval)
+
+
+def pct(values, p):
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(len(s) * p))]
+
+
+async def run(args):
+    lag = []
+    probe = asyncio.create_task(loop_lag_probe(lag))
+    t0 = time.perf_counter()
+    counts = await asyncio.gather(*(one_stream(args.base_url, args.blocking) for _ in range(args.streams)))
+    elapsed = time.perf_counter() - t0
+    probe.cancel()
+    await upstream.close_client()
+    return {
+        "mode": "blocking" if args.blocking else "async",
+        "streams": args.streams,
+        "tokens": sum(counts),
+        "elapsed_s": round(elapsed, 3),
+        "tokens_per_s": round(sum(counts) / elapsed, 1) if elapsed else 0.0,
+        "loop_lag_p50_ms": round(pct(lag, 0.5) * 1000, 2),
+        "loop_lag_p99_ms": round(pct(lag, 0.99) * 1000, 2),
+        "loop_lag_max_ms": round(max(lag, default=0.0) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent upstream streams benchmark")
+    parser.add_argument("--base-url", default="http://127.0.0.1:9009/v1")
+    parser.add_argument("--streams", type=int, default=50)
+    parser.add_argument("--blocking", action="store_true", help="usa il vecchio client requests sincrono")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -19,6 +19,8 @@ export default function Sidebar({
   onNewChat,
   onSelectSession,
   onDeleteSession,
+  hasMore = false,
+  onLoadMore,
 }) {
   return (
     <aside className="hidden md:flex w-72 flex-col border-r bg-card/50">
@@ -61,6 +63,11 @@ export default function Sidebar({
               </button>
             </div>
           ))}
+          {hasMore && (
+            <Button variant="ghost" size="sm" className="w-full text-xs text-muted-foreground" onClick={onLoadMore}>
+              Carica altre conversazioni
+            </Button>
+          )}
         </div>
       </ScrollArea>
       <Separator />
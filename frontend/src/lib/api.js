@@ -49,11 +49,11 @@ export async function apiDelete(path) {
   return true;
 }
 
-export async function* apiSSE(path, body, { signal } = {}) {
+export async function* apiSSE(path, body, { signal, method = 'POST', headers = {} } = {}) {
   const res = await fetch(`${API_BASE}${path}`, {
-    method: 'POST',
-    headers: { 'Content-Type': 'application/json', ...authHeaders() },
-    body: JSON.stringify(body || {}),
+    method,
+    headers: { ...(body !== undefined ? { 'Content-Type': 'application/json' } : {}), ...authHeaders(), ...headers },
+    body: body !== undefined ? JSON.stringify(body || {}) : undefined,
     signal,
     ...withCreds,
   });
@@ -68,30 +68,78 @@ export async function* apiSSE(path, body, { signal } = {}) {
     const { value, done } = await reader.read();
     if (done) break;
     buffer += decoder.decode(value, { stream: true });
-    let idx;
-    while ((idx = buffer.indexOf("\n\n")) !== -1) {
-      const raw = buffer.slice(0, idx).trim();
-      buffer = buffer.slice(idx + 2);
-      if (raw.startsWith('data:')) {
-        const jsonStr = raw.slice(5).trim();
-        let evt;
-        try { evt = JSON.parse(jsonStr); } catch (e) { continue; }
+    // un solo split per lettura; l'ultimo pezzo è un frame incompleto e resta nel buffer
+    const frames = buffer.split('\n\n');
+    buffer = frames.pop();
+    for (const raw of frames) {
+      const evt = parseFrame(raw);
+      if (evt) yield evt;
+    }
+  }
+}
+
+// Frame del server: "id: N\ndata: {...}"; le righe ": hb" sono heartbeat degli stream fermi
+function parseFrame(raw) {
+  let id;
+  let jsonStr = null;
+  for (const line of raw.split('\n')) {
+    if (line.startsWith('data:')) jsonStr = line.slice(5);
+    else if (line.startsWith('id:')) id = Number(line.slice(3));
+  }
+  if (jsonStr === null) return null;
+  let evt;
+  try { evt = JSON.parse(jsonStr); } catch (e) { return null; }
+  if (id !== undefined) evt.id = id;
+  return evt;
+}
+
+const sleep = (ms) => new Promise((r) => setTimeout(r, ms));
+
+// Stream di chat riprendibile: se la connessione cade prima di `end` si ricollega a
+// GET /chat/stream/:streamId con Last-Event-ID invece di rigenerare la risposta.
+async function* resumableChatStream(payload, { signal, retries = 5 } = {}) {
+  let streamId = null;
+  let lastId = 0;
+  let attempt = 0;
+  let source = apiSSE('/chat/stream', payload, { signal });
+  while (true) {
+    try {
+      for await (const evt of source) {
+        if (evt.id !== undefined) lastId = evt.id;
+        if (evt.type === 'start') streamId = evt.streamId;
+        attempt = 0;
         yield evt;
+        if (evt.type === 'end' || evt.type === 'error') return;
       }
+    } catch (e) {
+      if (signal?.aborted || !streamId || attempt >= retries) throw e;
     }
+    if (!streamId || attempt >= retries) throw new Error('Stream interrotto');
+    attempt += 1;
+    await sleep(Math.min(500 * 2 ** (attempt - 1), 4000));
+    source = apiSSE(`/chat/stream/${streamId}`, undefined, { signal, method: 'GET', headers: { 'Last-Event-ID': String(lastId) } });
   }
 }
 
+function query(params) {
+  const qs = new URLSearchParams(Object.entries(params || {}).filter(([, v]) => v !== undefined && v !== null)).toString();
+  return qs ? `?${qs}` : '';
+}
+
+// Le liste sono paginate a cursore: { items, nextCursor } (nextCursor null = fine)
 export const SessionsAPI = {
-  list: () => apiGet('/sessions'),
+  list: ({ before, limit } = {}) => apiGet(`/sessions${query({ before, limit })}`),
   create: (payload) => apiJson('/sessions', 'POST', payload),
   update: (id, payload) => apiJson(`/sessions/${id}`, 'PUT', payload),
   remove: (id) => apiDelete(`/sessions/${id}`),
-  messages: (id) => apiGet(`/sessions/${id}/messages`),
+  messages: (id, { before, after, limit } = {}) => apiGet(`/sessions/${id}/messages${query({ before, after, limit })}`),
 };
 
 export const ChatAPI = {
-  stream: (payload, opts) => apiSSE('/chat/stream', payload, opts),
+  stream: (payload, opts) => resumableChatStream(payload, opts),
+  cancel: (streamId) => apiJson(`/chat/stream/${streamId}/cancel`, 'POST', {}).catch(() => null),
+  // segue da un'altra tab la generazione in corso di una sessione (404 se non ce n'è una)
+  follow: (sessionId, opts = {}) => apiSSE(`/sessions/${sessionId}/stream`, undefined, { ...opts, method: 'GET' }),
 };
 
 export const AuthAPI = {
@@ -51,6 +51,9 @@ export default function Chat() {
   const [activeId, setActiveId] = useState(null);
   const active = useMemo(() => sessions.find((s) => s.id === activeId) || null, [sessions, activeId]);
   const [messages, setMessages] = useState([]);
+  const [olderCursor, setOlderCursor] = useState(null);
+  const [loadingOlder, setLoadingOlder] = useState(false);
+  const [sessionsCursor, setSessionsCursor] = useState(null);
   const [input, setInput] = useState("");
   const [isStreaming, setIsStreaming] = useState(false);
   const [aborter, setAborter] = useState(null);
@@ -58,12 +61,16 @@ export default function Chat() {
   const [openProfile, setOpenProfile] = useState(false);
   const [pwdForm, setPwdForm] = useState({ current: "", next: "", confirm: "" });
   const listRef = useRef(null);
+  const topRef = useRef(null);
+  const streamIdRef = useRef(null);
+  const followRef = useRef(null);
   const textareaRef = useRef(null);
 
   useEffect(() => {
     (async () => {
       try {
-        const list = await SessionsAPI.list();
+        const { items: list, nextCursor } = await SessionsAPI.list();
+        setSessionsCursor(nextCursor);
         if (!list.length) {
           const created = await SessionsAPI.create({});
           setSessions([created]);
@@ -72,8 +79,7 @@ export default function Chat() {
         } else {
           setSessions(list);
           setActiveId(list[0].id);
-          const msgs = await SessionsAPI.messages(list[0].id);
-          setMessages(msgs);
+          await reloadMessages(list[0].id);
         }
       } catch (e) {
         console.error(e);
@@ -82,33 +88,129 @@ export default function Chat() {
     })();
   }, []);
 
+  // Scroll in fondo solo quando cambia l'ultimo messaggio, non quando si caricano i precedenti
+  const lastMessageId = messages[messages.length - 1]?.id;
   useEffect(() => {
     if (listRef.current) {
       listRef.current.scrollTop = listRef.current.scrollHeight;
     }
-  }, [messages.length, isStreaming]);
+  }, [lastMessageId, isStreaming]);
+
+  // Caricamento lazy dei messaggi più vecchi quando la sentinella in cima diventa visibile
+  useEffect(() => {
+    const el = topRef.current;
+    if (!el || !olderCursor) return;
+    const observer = new IntersectionObserver((entries) => {
+      if (entries.some((e) => e.isIntersecting)) loadOlderMessages();
+    });
+    observer.observe(el);
+    return () => observer.disconnect();
+  }, [olderCursor, activeId]);
 
   async function reloadMessages(id) {
     try {
-      const msgs = await SessionsAPI.messages(id);
-      setMessages(msgs);
+      const { items, nextCursor } = await SessionsAPI.messages(id);
+      setMessages(items);
+      setOlderCursor(nextCursor);
+      const last = items[items.length - 1];
+      if (last?.role === "assistant" && last.status === "streaming" && !followRef.current) followLiveGeneration(id, last.id);
+    } catch (e) {
+      console.error(e);
+    }
+  }
+
+  // Risposta ancora in generazione (da un'altra tab o da prima di un reload): ci si aggancia allo
+  // stream della sessione, che riparte dall'inizio o da uno snapshot del testo
+  async function followLiveGeneration(id, lastMessageId) {
+    const controller = new AbortController();
+    followRef.current = controller;
+    setAborter(controller);
+    setIsStreaming(true);
+    let messageId = lastMessageId;
+    let ended = false;
+    const patch = (fn) => setMessages((prev) => prev.map((m) => (m.id === messageId ? { ...m, content: fn(m.content || '') } : m)));
+    try {
+      for await (const evt of ChatAPI.follow(id, { signal: controller.signal })) {
+        if (evt.type === 'start') {
+          messageId = evt.messageId;
+          streamIdRef.current = evt.streamId;
+          setMessages((prev) => (prev.some((m) => m.id === messageId)
+            ? prev.map((m) => (m.id === messageId ? { ...m, content: '' } : m))
+            : [...prev, { id: messageId, sessionId: id, role: "assistant", content: "", createdAt: new Date().toISOString() }]));
+        } else if (evt.type === 'chunk') {
+          patch((c) => c + (evt.delta || ''));
+        } else if (evt.type === 'snapshot') {
+          patch(() => evt.content || '');
+        } else if (evt.type === 'end' || evt.type === 'error') {
+          ended = true;
+          break;
+        }
+      }
+    } catch (e) {
+      // 404: la generazione è finita fra il caricamento dei messaggi e la richiesta
+      if (!controller.signal.aborted) console.error(e);
+    } finally {
+      if (followRef.current === controller) {
+        followRef.current = null;
+        setIsStreaming(false);
+        setAborter(null);
+        streamIdRef.current = null;
+        // solo dopo end/error: con un 404 il messaggio può restare "streaming" e si ricomincerebbe
+        if (ended) await reloadMessages(id);
+      }
+    }
+  }
+
+  function stopFollowing() {
+    // cambio di sessione: si lascia lo stream dell'altra sessione senza fermarne la generazione
+    if (!followRef.current) return;
+    followRef.current.abort();
+    followRef.current = null;
+    setIsStreaming(false);
+    setAborter(null);
+    streamIdRef.current = null;
+  }
+
+  async function loadOlderMessages() {
+    if (!active || !olderCursor || loadingOlder) return;
+    setLoadingOlder(true);
+    try {
+      const { items, nextCursor } = await SessionsAPI.messages(active.id, { before: olderCursor });
+      setMessages((prev) => [...items, ...prev]);
+      setOlderCursor(nextCursor);
+    } catch (e) {
+      console.error(e);
+    } finally {
+      setLoadingOlder(false);
+    }
+  }
+
+  async function loadMoreSessions() {
+    if (!sessionsCursor) return;
+    try {
+      const { items, nextCursor } = await SessionsAPI.list({ before: sessionsCursor });
+      setSessions((prev) => [...prev, ...items.filter((s) => !prev.some((p) => p.id === s.id))]);
+      setSessionsCursor(nextCursor);
     } catch (e) {
       console.error(e);
     }
   }
 
   async function handleNewChat() {
+    stopFollowing();
     try {
       const created = await SessionsAPI.create({});
       setSessions((prev) => [created, ...prev]);
       setActiveId(created.id);
       setMessages([]);
+      setOlderCursor(null);
     } catch (e) {
       toast({ title: "Impossibile creare la chat" });
     }
   }
 
   async function handleSelectSession(id) {
+    stopFollowing();
     setActiveId(id);
     await reloadMessages(id);
   }
@@ -119,9 +221,10 @@ export default function Chat() {
       const next = sessions.filter((s) => s.id !== id);
       setSessions(next);
       if (id === activeId) {
+        stopFollowing();
         const newActive = next[0]?.id || null;
         setActiveId(newActive);
-        if (newActive) await reloadMessages(newActive); else setMessages([]);
+        if (newActive) await reloadMessages(newActive); else { setMessages([]); setOlderCursor(null); }
       }
     } catch (e) {
       toast({ title: "Impossibile eliminare" });
@@ -158,11 +261,29 @@ export default function Chat() {
     setAborter(controller);
     setIsStreaming(true);
 
+    // i chunk arrivati nello stesso frame di animazione diventano un solo render
+    let pending = '';
+    let raf = null;
+    const flushPending = () => {
+      if (raf !== null) cancelAnimationFrame(raf);
+      raf = null;
+      const delta = pending;
+      pending = '';
+      if (delta) setMessages((prev) => prev.map((m) => (m.id === assistMsg.id ? { ...m, content: (m.content || '') + delta } : m)));
+    };
+
     try {
-      for await (const evt of ChatAPI.stream({ sessionId: active.id, model: active.model, messages: [...messages, userMsg] }, { signal: controller.signal })) {
-        if (evt.type === 'chunk') {
-          setMessages((prev) => prev.map((m) => (m.id === assistMsg.id ? { ...m, content: (m.content || '') + (evt.delta || '') } : m)));
+      for await (const evt of ChatAPI.stream({ sessionId: active.id, model: active.model, content: trimmed }, { signal: controller.signal })) {
+        if (evt.type === 'start') {
+          streamIdRef.current = evt.streamId;
+        } else if (evt.type === 'chunk') {
+          pending += evt.delta || '';
+          if (raf === null) raf = requestAnimationFrame(flushPending);
+        } else if (evt.type === 'snapshot') {
+          pending = '';
+          setMessages((prev) => prev.map((m) => (m.id === assistMsg.id ? { ...m, content: evt.content || '' } : m)));
         } else if (evt.type === 'end') {
+          flushPending();
           await reloadMessages(active.id);
         }
       }
@@ -170,12 +291,16 @@ export default function Chat() {
       console.error(e);
       toast({ title: "Errore durante lo streaming" });
     } finally {
+      flushPending();
       setIsStreaming(false);
       setAborter(null);
+      streamIdRef.current = null;
     }
   }
 
   function stopGeneration() {
+    // la generazione gira lato server indipendentemente dalla connessione: va fermata esplicitamente
+    if (streamIdRef.current) ChatAPI.cancel(streamIdRef.current);
     aborter?.abort();
   }
 
@@ -238,6 +363,8 @@ export default function Chat() {
         onNewChat={handleNewChat}
         onSelectSession={handleSelectSession}
         onDeleteSession={handleDeleteSession}
+        hasMore={!!sessionsCursor}
+        onLoadMore={loadMoreSessions}
       />
       <main className="flex-1 flex flex-col">
         {/* Header */}
@@ -286,6 +413,10 @@ export default function Chat() {
         {/* Messages */}
         <ScrollArea ref={listRef} className="flex-1 px-4">
           <div className="max-w-3xl mx-auto py-6 space-y-6">
+            <div ref={topRef} />
+            {loadingOlder && (
+              <div className="text-center text-xs text-muted-foreground">Caricamento messaggi precedenti...</div>
+            )}
             {(!active || messages.length === 0) && (
               <div className="text-center text-muted-foreground py-16">
                 Inizia una conversazione con il tuo ChatGPT locale.
@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """TestClient su mongomock con un utente registrato e un LLM finto che registra i prompt."""
+    from fastapi.testclient import TestClient
+    from mongomock_motor import AsyncMongoMockClient
+    from passlib.hash import bcrypt
+
+    import context
+    import server
+    from hashing import hash_pool
+    from search import search_indexes
+    from usercache import user_cache
+
+    monkeypatch.setattr(server, "db", AsyncMongoMockClient()["test"])
+    monkeypatch.setattr(hash_pool, "hasher", bcrypt.using(rounds=4))
+    user_cache.clear()
+    context.context_cache.clear()
+    search_indexes.clear()
+    prompts = []
+
+    async def fake_llm(messages, model, temperature):
+        prompts.append(messages)
+        yield f"risposta {len(prompts)}"
+
+    monkeypatch.setattr(server, "openai_stream_generator", fake_llm)
+    with TestClient(server.app) as c:
+        resp = c.post("/api/auth/register", json={"email": "api@example.com", "password": "password1"})
+        c.headers["Authorization"] = resp.cookies["access_token"].strip('"')
+        c.uid = resp.json()["id"]
+        c.prompts = prompts
+        yield c
@@ -0,0 +1,64 @@
+import server
+from usercache import user_cache
+
+
+def bearer(resp):
+    return {"Authorization": resp.cookies["access_token"].strip('"')}
+
+
+def test_current_user_is_served_from_cache(api):
+    headers = bearer(api.post("/api/auth/register", json={"email": "a@example.com", "password": "password1"}))
+    hits = user_cache.hits
+    assert api.get("/api/auth/me", headers=headers).status_code == 200
+    assert api.get("/api/auth/me", headers=headers).json()["email"] == "a@example.com"
+    assert user_cache.hits == hits + 1
+
+
+def test_change_password_revokes_old_tokens(api):
+    old = bearer(api.post("/api/auth/register", json={"email": "b@example.com", "password": "password1"}))
+    assert api.get("/api/auth/me", headers=old).status_code == 200
+    resp = api.post("/api/auth/change-password", json={"currentPassword": "password1", "newPassword": "password2"}, headers=old)
+    assert resp.status_code == 200
+    assert api.get("/api/auth/me", headers=old).status_code == 401
+    assert api.get("/api/auth/me", headers=bearer(resp)).status_code == 200
+    assert api.post("/api/auth/login", json={"email": "b@example.com", "password": "password2"}).status_code == 200
+
+
+def test_delete_account_invalidates_cache(api):
+    headers = bearer(api.post("/api/auth/register", json={"email": "c@example.com", "password": "password1"}))
+    assert api.get("/api/auth/me", headers=headers).status_code == 200
+    assert api.post("/api/auth/delete-account", json={"currentPassword": "sbagliata"}, headers=headers).status_code == 401
+    assert api.get("/api/auth/me", headers=headers).status_code == 200
+    assert api.post("/api/auth/delete-account", json={"currentPassword": "password1"}, headers=headers).status_code == 204
+    assert api.get("/api/auth/me", headers=headers).status_code == 401
+
+
+def test_delete_account_stops_live_generations_before_deleting(api, monkeypatch):
+    import asyncio
+    import threading
+    import time
+
+    async def endless_llm(messages, model, temperature):
+        i = 0
+        while True:
+            await asyncio.sleep(0.005)
+            i += 1
+            yield f"tok{i} "
+
+    monkeypatch.setattr(server, "openai_stream_generator", endless_llm)
+    sid = api.post("/api/sessions").json()["id"]
+    # TestClient legge la risposta SSE per intero: lo stream gira in un altro thread
+    streaming = threading.Thread(target=api.post, args=("/api/chat/stream",), kwargs={"json": {"sessionId": sid, "model": "gpt-4o-mini", "content": "ciao"}})
+    streaming.start()
+    deadline = time.monotonic() + 5
+    while not server.stream_registry.live_for_owner(api.uid) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.6)  # almeno un salvataggio progressivo (PERSIST_FLUSH_INTERVAL)
+    assert api.post("/api/auth/delete-account", json={"currentPassword": "password1"}).status_code == 204
+    streaming.join(5)
+    assert not streaming.is_alive()
+
+    async def leftovers():
+        return await server.db.messages.count_documents({}) + await server.db.sessions.count_documents({})
+
+    assert asyncio.run(leftovers()) == 0
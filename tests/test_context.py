@@ -0,0 +1,65 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from mongomock_motor import AsyncMongoMockClient
+
+import context
+from context import ContextWindow, estimate_tokens
+
+
+def turns(n, size=40):
+    base = datetime(2024, 1, 1)
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"{i:02d}" + "x" * size, "createdAt": base + timedelta(seconds=i)} for i in range(n)]
+
+
+def test_build_keeps_most_recent_turns_within_budget():
+    window = ContextWindow(None, turns(10))
+    per_msg = estimate_tokens("00" + "x" * 40)
+    prompt, dropped = window.build(budget=per_msg * 3)
+    assert [m["content"][:2] for m in prompt] == ["07", "08", "09"]
+    assert [m["content"][:2] for m in dropped] == [f"{i:02d}" for i in range(7)]
+
+
+def test_build_always_includes_current_question_and_summary():
+    window = ContextWindow(None, turns(4, size=4000), summary="riassunto", summary_until=datetime(2024, 1, 1, 0, 0, 1))
+    prompt, dropped = window.build(budget=10)
+    assert prompt[0]["role"] == "system" and "riassunto" in prompt[0]["content"]
+    assert prompt[-1]["content"].startswith("03")
+    assert [m["content"][:2] for m in dropped] == ["02"]
+
+
+def test_refresh_summary_persists_rolling_summary(monkeypatch):
+    monkeypatch.setattr(context, "CONTEXT_SUMMARY", True)
+    monkeypatch.setattr(context, "CONTEXT_SUMMARY_MIN_TOKENS", 1)
+    db = AsyncMongoMockClient()["test"]
+    window = ContextWindow(None, turns(6))
+    _, dropped = window.build(budget=estimate_tokens("00" + "x" * 40) * 2)
+
+    async def summarize(previous, msgs):
+        return f"{len(msgs)} turni"
+
+    async def main():
+        await db.sessions.insert_one({"_id": "s1", "ownerId": "u"})
+        await context.refresh_summary(db, "s1", window, dropped, summarize)
+        return await db.sessions.find_one({"_id": "s1"})
+
+    doc = asyncio.run(main())
+    assert doc["contextSummary"] == "4 turni" and window.summary == "4 turni"
+    assert doc["contextSummaryUntil"] == dropped[-1]["createdAt"] == window.summary_until
+
+
+def test_chat_stream_rebuilds_context_server_side(api):
+    sid = api.post("/api/sessions").json()["id"]
+    for text in ("primo", "secondo"):
+        with api.stream("POST", "/api/chat/stream", json={"sessionId": sid, "model": "gpt-4o-mini", "content": text}) as resp:
+            body = "".join(resp.iter_text())
+            assert '"messageId"' in body
+    assert api.prompts[-1] == [
+        {"role": "user", "content": "primo"},
+        {"role": "assistant", "content": "risposta 1"},
+        {"role": "user", "content": "secondo"},
+    ]
+    assert context.context_cache.hits == 1
+    items = api.get(f"/api/sessions/{sid}/messages").json()["items"]
+    assert [(m["role"], m["status"]) for m in items] == [("user", "complete"), ("assistant", "complete")] * 2
+    assert api.post("/api/chat/stream", json={"sessionId": sid, "model": "gpt-4o-mini"}).status_code == 422
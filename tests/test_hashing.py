@@ -0,0 +1,27 @@
+import asyncio
+
+from hashing import HashPool, HashPoolSaturated
+
+
+def test_hash_and_verify_roundtrip():
+    pool = HashPool(workers=1, max_pending=4, rounds=4)
+
+    async def main():
+        hashed = await pool.hash("segreto")
+        return await pool.verify("segreto", hashed), await pool.verify("sbagliata", hashed), await pool.verify("segreto", "")
+
+    assert asyncio.run(main()) == (True, False, False)
+    assert pool.stats()["completed"] == 3
+    pool.shutdown()
+
+
+def test_rejects_when_saturated():
+    pool = HashPool(workers=1, max_pending=2, rounds=4)
+
+    async def main():
+        return await asyncio.gather(*(pool.hash("x") for _ in range(5)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert sum(isinstance(r, HashPoolSaturated) for r in results) == 3
+    assert pool.stats()["rejected"] == 3
+    pool.shutdown()
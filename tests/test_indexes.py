@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from pymongo.errors import DuplicateKeyError
+
+from indexes import DuplicateEmailsError, QueryPlanError, dedupe_emails, ensure_indexes, plan_stages, verify_query_plans
+
+
+def test_plan_stages_walks_nested_plans():
+    plan = {"stage": "FETCH", "inputStage": {"stage": "SORT_MERGE", "inputStages": [{"stage": "IXSCAN"}, {"stage": "COLLSCAN"}]}}
+    assert plan_stages(plan) == ["FETCH", "SORT_MERGE", "IXSCAN", "COLLSCAN"]
+
+
+def test_ensure_indexes_is_idempotent_and_enforces_unique_email():
+    async def main():
+        db = AsyncMongoMockClient()["test"]
+        await ensure_indexes(db)
+        await ensure_indexes(db)
+        await db.users.insert_one({"_id": "1", "email": "a@example.com"})
+        with pytest.raises(DuplicateKeyError):
+            await db.users.insert_one({"_id": "2", "email": "a@example.com"})
+        return await db.messages.index_information()
+
+    assert "owner_session_created_id" in asyncio.run(main())
+
+
+def test_duplicate_emails_fail_clearly_and_dedupe_merges_into_oldest():
+    async def main():
+        db = AsyncMongoMockClient()["test"]
+        await db.users.insert_many([
+            {"_id": "new", "email": "a@example.com", "createdAt": 2},
+            {"_id": "old", "email": "a@example.com", "createdAt": 1},
+            {"_id": "b", "email": "b@example.com", "createdAt": 1},
+        ])
+        await db.sessions.insert_one({"_id": "s", "ownerId": "new"})
+        await db.messages.insert_one({"_id": "m", "ownerId": "new", "sessionId": "s"})
+        with pytest.raises(DuplicateEmailsError, match="--dedupe-emails"):
+            await ensure_indexes(db)
+        assert await dedupe_emails(db) == 1
+        await ensure_indexes(db)
+        return await db.users.distinct("_id"), await db.sessions.find_one({"_id": "s"}), await db.messages.find_one({"_id": "m"})
+
+    users, sess, msg = asyncio.run(main())
+    assert sorted(users) == ["b", "old"]
+    assert sess["ownerId"] == msg["ownerId"] == "old"
+
+
+class ExplainDB:
+    def __init__(self, stage):
+        self.stage = stage
+
+    async def command(self, name, cmd, verbosity=None):
+        return {"queryPlanner": {"winningPlan": {"stage": "FETCH", "inputStage": {"stage": self.stage}}}}
+
+
+def test_verify_query_plans_fails_on_collscan():
+    asyncio.run(verify_query_plans(ExplainDB("IXSCAN")))
+    with pytest.raises(QueryPlanError):
+        asyncio.run(verify_query_plans(ExplainDB("COLLSCAN")))
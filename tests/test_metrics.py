@@ -0,0 +1,71 @@
+from types import SimpleNamespace
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import metrics
+from metrics import Counter, Histogram, MongoCommandMetrics, ServerTimingMiddleware, request_timing
+
+
+def test_histogram_renders_cumulative_buckets_and_routes_unknown_labels_to_other():
+    h = Histogram("t_seconds", "test", {"op": ("find",)}, (0.1, 1.0))
+    h.labels("find").observe(0.05)
+    h.labels("find").observe(0.5)
+    h.labels("mapReduce").observe(5)
+    text = "\n".join(h.render())
+    assert 't_seconds_bucket{op="find",le="0.1"} 1' in text
+    assert 't_seconds_bucket{op="find",le="1"} 2' in text
+    assert 't_seconds_bucket{op="find",le="+Inf"} 2' in text
+    assert 't_seconds_count{op="other"} 1' in text
+    c = Counter("t_total", "test")
+    c.inc()
+    assert c.render()[-1] == "t_total 1"
+
+
+def test_mongo_listener_records_by_collection_and_request_timing():
+    listener = MongoCommandMetrics()
+    series = metrics.MONGO_OP.labels("messages", "getMore")
+    before = series.count
+    timing = metrics.RequestTiming()
+    token = request_timing.set(timing)
+    try:
+        listener.started(SimpleNamespace(command_name="getMore", command={"getMore": 1, "collection": "messages"}, request_id=7))
+        listener.succeeded(SimpleNamespace(command_name="getMore", request_id=7, duration_micros=2500))
+    finally:
+        request_timing.reset(token)
+    assert series.count == before + 1
+    assert timing.db_ops == 1 and abs(timing.db - 0.0025) < 1e-9
+
+
+def test_server_timing_only_on_json_routes():
+    app = FastAPI()
+
+    @app.get("/json")
+    async def as_json():
+        return {"ok": True}
+
+    @app.get("/text")
+    async def as_text():
+        from fastapi.responses import PlainTextResponse
+        return PlainTextResponse("ok")
+
+    app.add_middleware(ServerTimingMiddleware)
+    with TestClient(app) as c:
+        assert "app;dur=" in c.get("/json").headers["server-timing"]
+        assert "server-timing" not in c.get("/text").headers
+
+
+def test_metrics_endpoint_counts_streams(api, monkeypatch):
+    import server
+    assert api.get("/api/metrics").status_code == 404
+    monkeypatch.setattr(server, "DIAGNOSTICS_TOKEN", "t")
+    assert api.get("/api/metrics").status_code == 401
+    before = metrics.STREAM_CHUNKS._default.count
+    sid = api.post("/api/sessions").json()["id"]
+    with api.stream("POST", "/api/chat/stream", json={"sessionId": sid, "model": "gpt-4o-mini", "content": "ciao"}) as resp:
+        "".join(resp.iter_text())
+    resp = api.get("/api/metrics", headers={"Authorization": "Bearer t"})
+    assert resp.headers["content-type"].startswith("text/plain")
+    assert "# TYPE chat_mongo_op_seconds histogram" in resp.text
+    assert metrics.STREAM_CHUNKS._default.count == before + 1
+    assert "chat_current_user_seconds_count" in resp.text
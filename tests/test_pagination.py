@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+from pagination import decode_cursor, encode_cursor
+
+
+def test_cursor_roundtrip_and_rejects_garbage():
+    ts = datetime(2024, 1, 2, 3, 4, 5, 678000)
+    assert decode_cursor(encode_cursor(ts, "abc")) == (ts, "abc")
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
+
+
+def test_messages_pages_backwards_without_gaps(api):
+    sid = api.post("/api/sessions").json()["id"]
+    base = datetime(2024, 1, 1)
+    # due messaggi per timestamp: il tie-break su _id deve evitare buchi e duplicati
+    docs = [{"_id": f"m{i:03d}", "ownerId": api.uid, "sessionId": sid, "role": "user", "content": str(i), "createdAt": base + timedelta(seconds=i // 2)} for i in range(25)]
+    api.portal.call(server.db.messages.insert_many, docs)
+
+    seen, cursor = [], None
+    while True:
+        page = api.get(f"/api/sessions/{sid}/messages", params={"limit": 10, **({"before": cursor} if cursor else {})}).json()
+        seen = [m["id"] for m in page["items"]] + seen
+        cursor = page["nextCursor"]
+        if not cursor:
+            break
+    assert seen == [d["_id"] for d in docs]
+
+    first = api.get(f"/api/sessions/{sid}/messages", params={"limit": 10, "before": encode_cursor(base + timedelta(seconds=5), "m010")}).json()
+    newer = api.get(f"/api/sessions/{sid}/messages", params={"limit": 10, "after": encode_cursor(base + timedelta(seconds=4), "m009")}).json()
+    assert [m["id"] for m in first["items"]] == [f"m{i:03d}" for i in range(10)]
+    assert [m["id"] for m in newer["items"]] == [f"m{i:03d}" for i in range(10, 20)]
+    assert api.get(f"/api/sessions/{sid}/messages", params={"before": "garbage"}).status_code == 400
+    both = {"before": encode_cursor(base + timedelta(seconds=5), "m010"), "after": encode_cursor(base + timedelta(seconds=4), "m009")}
+    assert api.get(f"/api/sessions/{sid}/messages", params=both).status_code == 400
+
+
+def test_sessions_list_pages(api):
+    ids = [api.post("/api/sessions").json()["id"] for _ in range(5)]
+    page = api.get("/api/sessions", params={"limit": 3}).json()
+    rest = api.get("/api/sessions", params={"limit": 3, "before": page["nextCursor"]}).json()
+    assert rest["nextCursor"] is None
+    assert sorted(s["id"] for s in page["items"] + rest["items"]) == sorted(ids)
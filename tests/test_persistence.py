@@ -0,0 +1,136 @@
+import asyncio
+from datetime import datetime
+
+from mongomock_motor import AsyncMongoMockClient
+
+from persistence import StreamWriter
+
+
+def doc():
+    return {"_id": "m1", "ownerId": "u", "sessionId": "s1", "role": "assistant", "content": "", "status": "streaming", "createdAt": datetime(2024, 1, 1)}
+
+
+def test_writer_flushes_in_batches_and_finalises():
+    db = AsyncMongoMockClient()["test"]
+
+    async def main():
+        await db.sessions.insert_one({"_id": "s1", "updatedAt": datetime(2024, 1, 1)})
+        writer = StreamWriter(db, doc(), flush_bytes=10, flush_interval=60)
+        for _ in range(4):
+            writer.add("abcd")
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        partial = await db.messages.find_one({"_id": "m1"})
+        for _ in range(4):
+            writer.add("efgh")
+        ok = await writer.close("complete", datetime(2024, 1, 2))
+        return ok, partial, writer, await db.messages.find_one({"_id": "m1"}), await db.sessions.find_one({"_id": "s1"})
+
+    ok, partial, writer, final, sess = asyncio.run(main())
+    assert ok
+    assert partial["status"] == "streaming" and partial["content"].startswith("abcd")
+    assert final["content"] == "abcd" * 4 + "efgh" * 4
+    assert final["status"] == "complete" and final["role"] == "assistant" and final["sessionId"] == "s1"
+    assert sess["updatedAt"] == datetime(2024, 1, 2)
+    # 16 chunk: una scrittura intermedia (le altre sono coalescenti) più quella finale
+    assert writer.flushes <= 3
+
+
+def test_writer_reports_failure_without_raising():
+    class BrokenCollection:
+        async def update_one(self, *a, **kw):
+            raise RuntimeError("mongo down")
+
+    class BrokenDB:
+        messages = BrokenCollection()
+        sessions = BrokenCollection()
+
+    async def main():
+        writer = StreamWriter(BrokenDB(), doc())
+        writer.add("ciao")
+        return await writer.close("aborted")
+
+    assert asyncio.run(main()) is False
+
+
+class SpyDB:
+    # registra gli update su messages e può rallentarli
+    def __init__(self, db, delay=0.0):
+        self.db = db
+        self.delay = delay
+        self.updates = []
+        self.messages = self
+        self.sessions = db.sessions
+
+    async def update_one(self, filter, update, **kw):
+        self.updates.append(update)
+        await asyncio.sleep(self.delay)
+        return await self.db.messages.update_one(filter, update, **kw)
+
+
+def test_flushes_append_only_new_text_and_recover_from_uncertain_writes():
+    db = AsyncMongoMockClient()["test"]
+    spy = SpyDB(db)
+
+    async def main():
+        writer = StreamWriter(spy, doc(), flush_bytes=4, flush_interval=60)
+        writer.add("$abc")
+        await writer._task
+        writer.add("defg")
+        await writer._task
+        # scrittura precedente dall'esito incerto: il documento non è dove il writer crede
+        await db.messages.update_one({"_id": "m1"}, {"$set": {"contentLen": 99}})
+        writer.add("hijk")
+        await writer._task
+        writer.add("lm")
+        await writer.close("complete")
+        return await db.messages.find_one({"_id": "m1"})
+
+    final = asyncio.run(main())
+    assert final["content"] == "$abcdefghijklm" and final["status"] == "complete"
+    append = spy.updates[1][0]["$set"]["content"]["$concat"]
+    assert append == ["$content", {"$literal": "defg"}]
+
+
+def test_final_write_survives_cancellation_during_close():
+    db = AsyncMongoMockClient()["test"]
+
+    async def main():
+        writer = StreamWriter(SpyDB(db, delay=0.05), doc(), flush_bytes=4, flush_interval=60)
+        writer.add("abcdef")
+        closing = asyncio.create_task(writer.close("aborted"))
+        await asyncio.sleep(0.01)
+        closing.cancel()
+        await asyncio.gather(closing, return_exceptions=True)
+        await asyncio.sleep(0.2)
+        return await db.messages.find_one({"_id": "m1"})
+
+    final = asyncio.run(main())
+    assert (final["content"], final["status"]) == ("abcdef", "aborted")
+
+
+def test_deleting_a_session_stops_its_generation_before_deleting_messages(api, monkeypatch):
+    import threading
+    import time
+
+    import server
+
+    async def endless_llm(messages, model, temperature):
+        while True:
+            await asyncio.sleep(0.005)
+            yield "parola "
+
+    monkeypatch.setattr(server, "openai_stream_generator", endless_llm)
+    sid = api.post("/api/sessions").json()["id"]
+    # TestClient legge la risposta SSE per intero: lo stream gira in un altro thread
+    streaming = threading.Thread(target=api.post, args=("/api/chat/stream",), kwargs={"json": {"sessionId": sid, "model": "gpt-4o-mini", "content": "ciao"}})
+    streaming.start()
+    deadline = time.monotonic() + 5
+    while not server.stream_registry.live_for_owner(api.uid) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.15)
+    assert api.delete(f"/api/sessions/{sid}").status_code == 204
+    streaming.join(5)
+    assert not streaming.is_alive()
+    assert asyncio.run(server.db.messages.count_documents({"sessionId": sid})) == 0
+    assert api.get("/api/search", params={"q": "parola"}).json()["items"] == []
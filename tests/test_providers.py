@@ -0,0 +1,97 @@
+import asyncio
+
+import httpx
+
+import upstream
+from bench.fake_llm import create_app
+from providers import CircuitBreaker, Provider, ProviderRouter, ProviderUnavailable
+
+
+def run_with_providers(coro_fn, **apps):
+    # un solo client httpx con un fake provider per host: http://<nome>/v1
+    async def main():
+        upstream._client = httpx.AsyncClient(mounts={f"http://{name}": httpx.ASGITransport(app=app) for name, app in apps.items()})
+        try:
+            return await coro_fn()
+        finally:
+            await upstream.close_client()
+    return asyncio.run(main())
+
+
+def provider(name, **kw):
+    return Provider(name, f"http://{name}/v1", "k", {"gpt-4o-mini": f"{name}-mini"}, **kw)
+
+
+async def collect(router, model="gpt-4o-mini"):
+    return [d async for d in router.stream(model, {"messages": []})]
+
+
+def test_failover_before_first_token_and_unknown_model_uses_default():
+    a, b = provider("a"), provider("b")
+    router = ProviderRouter([a, b], default_model="gpt-4o-mini")
+    out = run_with_providers(lambda: collect(router, "no-such-model"), a=create_app(tps=0, fail_rate=1.0), b=create_app(tps=0, tokens=3))
+    assert out == ["tok0 ", "tok1 ", "tok2 "]
+    assert (a.errors, b.wins, router.failovers) == (1, 1, 1)
+    assert a.active == b.active == 0
+
+
+def test_circuit_breaker_opens_on_errors_and_half_opens_after_cooldown():
+    breaker = CircuitBreaker(window=4, min_requests=2, error_rate=0.5, cooldown=0.05)
+    a = provider("a", breaker=breaker)
+    router = ProviderRouter([a])
+
+    async def main():
+        for _ in range(2):
+            try:
+                await collect(router)
+            except upstream.UpstreamError:
+                pass
+        assert breaker.state == "open"
+        try:
+            await collect(router)
+        except ProviderUnavailable:
+            pass
+        else:
+            raise AssertionError("open breaker should short-circuit")
+        await asyncio.sleep(0.06)
+        assert breaker.allow() and not breaker.allow()  # una sola richiesta di prova
+        breaker.record(True, 0.1)
+        return breaker.state
+
+    assert run_with_providers(main, a=create_app(tps=0, fail_rate=1.0)) == "closed"
+    assert a.requests == 2
+
+
+def test_slow_first_token_triggers_hedge_and_cancels_loser():
+    slow, fast = provider("slow"), provider("fast")
+    router = ProviderRouter([slow, fast], hedge_delay=0.05)
+    fast_app = create_app(tps=0, tokens=2)
+    out = run_with_providers(lambda: collect(router), slow=create_app(tps=0, tokens=2, first_token_delay=5), fast=fast_app)
+    assert out == ["tok0 ", "tok1 "]
+    assert (router.hedges, router.hedges_won, fast.wins) == (1, 1, 1)
+    assert slow.active == 0 and slow.errors == 0
+
+
+def test_first_token_timeout_fails_over():
+    slow, fast = provider("slow"), provider("fast")
+    router = ProviderRouter([slow, fast], first_token_timeout=0.05)
+    out = run_with_providers(lambda: collect(router), slow=create_app(tps=0, first_token_delay=5), fast=create_app(tps=0, tokens=1))
+    assert out == ["tok0 "]
+    assert slow.errors == 1 and router.failovers == 1
+
+
+def test_provider_failure_after_first_token_aborts_without_mock(api, monkeypatch):
+    import server
+
+    async def dies_midway(messages, model, temperature):
+        yield "Parte reale. "
+        raise upstream.UpstreamError("connection reset")
+
+    monkeypatch.setattr(server, "openai_stream_generator", dies_midway)
+    monkeypatch.setattr(server, "mock_delta", lambda prompt: (_ for _ in ()).throw(AssertionError("mock after first token")))
+    sid = api.post("/api/sessions").json()["id"]
+    with api.stream("POST", "/api/chat/stream", json={"sessionId": sid, "model": "gpt-4o-mini", "content": "ciao"}) as resp:
+        body = "".join(resp.iter_text())
+    assert "Parte reale. " in body and '"type":"error"' in body and '"type":"end"' not in body
+    last = api.get(f"/api/sessions/{sid}/messages").json()["items"][-1]
+    assert (last["content"], last["status"]) == ("Parte reale. ", "aborted")
@@ -0,0 +1,59 @@
+import asyncio
+
+from mongomock_motor import AsyncMongoMockClient
+
+import server
+from respcache import ResponseCache, cache_key, replay, response_cache
+
+
+def test_cache_key_normalizes_whitespace_and_separates_models():
+    msgs = [{"role": "user", "content": "ciao   mondo\n"}]
+    assert cache_key("gpt-4o-mini", 0, msgs) == cache_key("gpt-4o-mini", 0.0, [{"role": "user", "content": " ciao mondo"}])
+    assert cache_key("gpt-4o-mini", 0, msgs) != cache_key("gpt-4o", 0, msgs)
+    assert cache_key("gpt-4o-mini", 0, msgs) != cache_key("gpt-4o-mini", 0, [{"role": "system", "content": "ciao mondo"}])
+
+
+def test_memory_tier_is_bounded_by_bytes_and_mongo_tier_refills_it():
+    async def main():
+        db = AsyncMongoMockClient()["test"]
+        cache = ResponseCache(enabled=True, use_mongo=True, max_bytes=10)
+        await cache.put(db, "a", "12345", "m")
+        await cache.put(db, "b", "123456", "m")
+        assert cache.stats()["entries"] == 1  # "a" uscito dalla memoria per stare nei 10 byte
+        assert await cache.get(db, "a") == "12345"  # ...ma recuperato dal tier Mongo
+        assert await cache.get(db, "zzz") is None
+        pieces = [p async for p in replay("abcdefg", chunk=3, delay=0)]
+        return cache.stats(), pieces
+
+    stats, pieces = asyncio.run(main())
+    assert stats["mongoHits"] == 1 and stats["misses"] == 1 and stats["bytesSaved"] == 5
+    assert pieces == ["abc", "def", "g"]
+
+
+def test_chat_stream_replays_cached_answer_but_never_caches_mock(api, monkeypatch):
+    monkeypatch.setattr(response_cache, "enabled", True)
+    response_cache.clear()
+
+    def ask(sid):
+        with api.stream("POST", "/api/chat/stream", json={"sessionId": sid, "model": "gpt-4o-mini", "temperature": 0, "content": "stessa domanda"}) as resp:
+            return "".join(resp.iter_text())
+
+    first, second = api.post("/api/sessions").json()["id"], api.post("/api/sessions").json()["id"]
+    assert "risposta 1" in ask(first)
+    assert "risposta 1" in ask(second)
+    assert len(api.prompts) == 1
+    assert api.get(f"/api/sessions/{second}/messages").json()["items"][-1]["content"] == "risposta 1"
+
+    async def broken(messages, model, temperature):
+        raise RuntimeError("provider down")
+        yield ""
+
+    monkeypatch.setattr(server, "openai_stream_generator", broken)
+    monkeypatch.setattr(server, "mock_delta", lambda prompt: replay("mock", delay=0))
+    with api.stream("POST", "/api/chat/stream", json={"sessionId": first, "model": "gpt-4o-mini", "temperature": 0, "content": "altra"}) as resp:
+        assert "mock" in "".join(resp.iter_text())
+    monkeypatch.setattr(server, "DIAGNOSTICS_TOKEN", "t")
+    assert api.get("/api/stats").status_code == 401  # il token utente non basta
+    stats = api.get("/api/stats", headers={"Authorization": "Bearer t"}).json()["responseCache"]
+    assert stats["stores"] == 1 and stats["memoryHits"] == 1
+    response_cache.clear()
@@ -0,0 +1,148 @@
+import asyncio
+
+import pytest
+
+from scheduler import GenerationScheduler, SchedulerFull
+
+
+def test_round_robin_across_users_with_per_user_limit():
+    order = []
+
+    async def main():
+        sched = GenerationScheduler(workers=1, max_queue=10, per_user=1, per_user_queue=10)
+
+        def job(name):
+            async def run():
+                order.append(name)
+                await asyncio.sleep(0)
+            return run
+
+        for name in ("a1", "a2", "a3"):
+            sched.submit("a", job(name))
+        for name in ("b1", "b2"):
+            sched.submit("b", job(name))
+        while sched.stats()["completed"] < 5:
+            await asyncio.sleep(0.001)
+        await sched.stop()
+
+    asyncio.run(main())
+    assert order == ["a1", "b1", "a2", "b2", "a3"]
+
+
+def test_queue_limits_reject():
+    async def main():
+        sched = GenerationScheduler(workers=1, max_queue=3, per_user=1, per_user_queue=2)
+        block = asyncio.Event()
+
+        async def run():
+            await block.wait()
+
+        sched.submit("a", run)
+        await asyncio.sleep(0)
+        sched.submit("a", run)
+        sched.submit("a", run)
+        with pytest.raises(SchedulerFull):
+            sched.submit("a", run)
+        sched.submit("b", run)
+        with pytest.raises(SchedulerFull):
+            sched.submit("c", run)
+        stats = sched.stats()
+        block.set()
+        await sched.stop()
+        return stats
+
+    stats = asyncio.run(main())
+    assert (stats["queued"], stats["active"], stats["rejected"]) == (3, 1, 2)
+
+
+def test_cancel_queued_job_runs_on_drop_and_running_job_is_cancelled():
+    events = []
+
+    async def main():
+        sched = GenerationScheduler(workers=1, max_queue=10, per_user=1, per_user_queue=10)
+
+        async def long_run():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                events.append("running cancelled")
+                raise
+
+        async def never():
+            events.append("should not run")
+
+        async def dropped():
+            events.append("dropped")
+
+        running = sched.submit("a", long_run)
+        queued = sched.submit("a", never, dropped)
+        await asyncio.sleep(0.01)
+        queued.cancel()
+        running.cancel()
+        await asyncio.sleep(0.01)
+        stats = sched.stats()
+        await sched.stop()
+        return stats
+
+    stats = asyncio.run(main())
+    assert sorted(events) == ["dropped", "running cancelled"]
+    assert (stats["queued"], stats["active"], stats["cancelled"]) == (0, 0, 1)
+
+
+
+def test_queue_filling_during_setup_does_not_leave_phantom_turns(api, monkeypatch):
+    import server
+
+    sid = api.post("/api/sessions").json()["id"]
+    original = server.get_window
+
+    async def queue_fills_meanwhile(db, sess):
+        # altre richieste riempiono la coda mentre questa legge il contesto
+        monkeypatch.setattr(server.scheduler, "per_user_queue", 0)
+        return await original(db, sess)
+
+    monkeypatch.setattr(server, "get_window", queue_fills_meanwhile)
+    with api.stream("POST", "/api/chat/stream", json={"sessionId": sid, "model": "gpt-4o-mini", "content": "ciao"}) as resp:
+        assert resp.status_code == 200
+        "".join(resp.iter_text())
+    assert api.post("/api/chat/stream", json={"sessionId": sid, "model": "gpt-4o-mini", "content": "di nuovo"}).status_code == 429
+    items = api.get(f"/api/sessions/{sid}/messages").json()["items"]
+    assert [(m["role"], m["status"]) for m in items] == [("user", "complete"), ("assistant", "complete")]
+    assert [m["role"] for m in api.prompts[-1]] == ["user"]
+
+
+def test_repeated_cancel_during_final_write_still_finishes_stream(api, monkeypatch):
+    import threading
+    import time
+
+    import persistence
+    import server
+
+    async def endless_llm(messages, model, temperature):
+        while True:
+            await asyncio.sleep(0.005)
+            yield "tok "
+
+    finish = persistence.StreamWriter._finish
+
+    async def slow_finish(self, status, session_touch):
+        await asyncio.sleep(0.3)
+        await finish(self, status, session_touch)
+
+    monkeypatch.setattr(server, "openai_stream_generator", endless_llm)
+    monkeypatch.setattr(persistence.StreamWriter, "_finish", slow_finish)
+    sid = api.post("/api/sessions").json()["id"]
+    # TestClient legge la risposta SSE per intero: lo stream gira in un altro thread
+    streaming = threading.Thread(target=api.post, args=("/api/chat/stream",), kwargs={"json": {"sessionId": sid, "model": "gpt-4o-mini", "content": "ciao"}})
+    streaming.start()
+    deadline = time.monotonic() + 5
+    while not server.stream_registry.live_for_owner(api.uid) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    buf = server.stream_registry.live_for_owner(api.uid)[0]
+    assert api.post(f"/api/chat/stream/{buf.id}/cancel").status_code == 204
+    time.sleep(0.05)
+    assert api.post(f"/api/chat/stream/{buf.id}/cancel").status_code == 204
+    streaming.join(5)
+    assert not streaming.is_alive() and buf.done
+    items = api.get(f"/api/sessions/{sid}/messages").json()["items"]
+    assert items[-1]["status"] == "aborted"
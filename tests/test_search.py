@@ -0,0 +1,141 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import server
+from search import UserIndex, build_index, snippet, tokenize
+
+
+def test_tokenize_folds_case_and_accents():
+    assert tokenize("Perché NON funziona? è") == ["perche", "non", "funziona"]
+
+
+def test_index_ranks_bm25_with_title_boost_and_removes_sessions():
+    t = datetime(2024, 1, 1)
+    index = UserIndex()
+    index.add_session({"_id": "s1", "title": "Ricetta carbonara", "updatedAt": t})
+    index.add_message({"_id": "m1", "sessionId": "s1", "role": "user", "content": "come si fa la carbonara?", "createdAt": t})
+    index.add_message({"_id": "m2", "sessionId": "s2", "role": "assistant", "content": "La carbonara vuole guanciale, uova, pecorino e pepe. " * 3, "createdAt": t})
+    index.add_message({"_id": "m3", "sessionId": "s2", "role": "user", "content": "e l'amatriciana?", "createdAt": t})
+    page, more = index.search("carbonara", limit=2)
+    assert [doc[1] for _, doc in page] == ["s1", "m1"] and more
+    assert index.search("carbonara guanciale", 10)[0][0][1][1] == "m2"
+    assert index.search("lasagne", 10) == ([], False)
+    index.remove_session("s2")
+    assert [doc[1] for _, doc in index.search("carbonara", 10)[0]] == ["s1", "m1"]
+    assert "guanciale" not in index.postings
+    assert index.entries == sum(len(p) for p in index.postings.values())
+
+
+def test_build_stops_at_memory_budget_keeping_recent_sessions():
+    from mongomock_motor import AsyncMongoMockClient
+
+    async def main():
+        db = AsyncMongoMockClient()["t"]
+        t = datetime(2024, 1, 1)
+        for i in range(120):
+            await db.sessions.insert_one({"_id": f"s{i}", "ownerId": "u", "title": f"chat {i}", "updatedAt": t + timedelta(minutes=i)})
+            await db.messages.insert_one({"_id": f"m{i}", "ownerId": "u", "sessionId": f"s{i}", "role": "user", "content": f"parola{i} comune", "createdAt": t})
+        full = await build_index(db, "u", max_bytes=10**9)
+        part = await build_index(db, "u", max_bytes=full.approx_bytes() // 3)
+        return full, part
+
+    full, part = asyncio.run(main())
+    assert not full.partial and len(full.docs) == 240
+    assert part.partial and 0 < len(part.docs) < 240
+    assert "m119" in part.by_key and "m0" not in part.by_key
+
+
+def test_snippet_centers_on_first_match():
+    text = "x" * 300 + " la parola Chiave è qui " + "y" * 300
+    snip, marks = snippet(text, {"chiave"}, width=80)
+    assert snip.startswith("…") and snip.endswith("…")
+    s, e = marks[0]
+    assert snip[s:e] == "Chiave"
+
+
+def chat(api, sid, text):
+    with api.stream("POST", "/api/chat/stream", json={"sessionId": sid, "model": "gpt-4o-mini", "content": text}) as resp:
+        "".join(resp.iter_text())
+
+
+def test_search_endpoint_tracks_inserts_deletes_and_other_workers(api):
+    builds = server.search_indexes.builds
+    first = api.post("/api/sessions").json()["id"]
+    api.put(f"/api/sessions/{first}", json={"title": "Viaggio in Giappone"})
+    chat(api, first, "cosa vedere a Kyoto in primavera?")
+    assert [h["kind"] for h in api.get("/api/search", params={"q": "kyoto"}).json()["items"]] == ["message"]
+
+    # dopo il primo caricamento l'indice è aggiornato dalle route e dal refresh, senza ricostruirlo
+    second = api.post("/api/sessions").json()["id"]
+    chat(api, second, "itinerario Kyoto Osaka")
+    page = api.get("/api/search", params={"q": "kyoto", "limit": 1}).json()
+    assert len(page["items"]) == 1 and page["nextCursor"] == "1"
+    assert len(api.get("/api/search", params={"q": "kyoto", "cursor": page["nextCursor"]}).json()["items"]) == 1
+    hit = api.get("/api/search", params={"q": "giappone"}).json()["items"][0]
+    assert hit["kind"] == "session" and hit["sessionTitle"] == "Viaggio in Giappone"
+    assert server.search_indexes.stats()["builds"] == builds + 1
+
+    # scritture di un altro worker: sessione più recente e cancellazione diretta su Mongo
+    async def other_worker():
+        later = datetime.utcnow() + timedelta(seconds=5)
+        await server.db.sessions.insert_one({"_id": "w2", "ownerId": api.uid, "title": "Altro worker", "createdAt": later, "updatedAt": later})
+        await server.db.messages.insert_one({"_id": "w2m", "ownerId": api.uid, "sessionId": "w2", "role": "user", "content": "Kyoto di notte", "createdAt": later})
+        await server.db.sessions.delete_one({"_id": second})
+
+    asyncio.run(other_worker())
+    sids = [h["sessionId"] for h in api.get("/api/search", params={"q": "kyoto"}).json()["items"]]
+    assert sorted(sids) == sorted([first, "w2"])
+
+    api.delete(f"/api/sessions/{first}")
+    assert [h["sessionId"] for h in api.get("/api/search", params={"q": "kyoto"}).json()["items"]] == ["w2"]
+    assert api.get("/api/search", params={"q": "kyoto", "cursor": "x"}).status_code == 400
+
+
+def test_search_picks_up_other_worker_write_older_than_last_local_write(api):
+    import time
+
+    mine = api.post("/api/sessions").json()["id"]
+    chat(api, mine, "prima domanda")
+    assert api.get("/api/search", params={"q": "lisbona"}).json()["items"] == []
+
+    # un altro worker scrive dopo il caricamento dell'indice, poi questo worker scrive ancora:
+    # la scrittura altrui è più vecchia dell'ultima locale ma va comunque reindicizzata
+    async def other_worker():
+        at = datetime.utcnow()
+        await server.db.sessions.insert_one({"_id": "w2", "ownerId": api.uid, "title": "Altro worker", "createdAt": at, "updatedAt": at})
+        await server.db.messages.insert_one({"_id": "w2m", "ownerId": api.uid, "sessionId": "w2", "role": "user", "content": "weekend a Lisbona", "createdAt": at})
+
+    asyncio.run(other_worker())
+    time.sleep(0.01)
+    chat(api, mine, "seconda domanda")
+    assert [h["sessionId"] for h in api.get("/api/search", params={"q": "lisbona"}).json()["items"]] == ["w2"]
+    assert len(api.get("/api/search", params={"q": "domanda"}).json()["items"]) == 2
+
+
+def test_shared_build_survives_cancellation_of_the_request_that_started_it(monkeypatch):
+    from mongomock_motor import AsyncMongoMockClient
+
+    import search
+    from search import get_index, search_indexes
+
+    async def slow_build(db, owner_id):
+        await asyncio.sleep(0.05)
+        return await build_index(db, owner_id)
+
+    monkeypatch.setattr(search, "build_index", slow_build)
+
+    async def main():
+        db = AsyncMongoMockClient()["t"]
+        await db.sessions.insert_one({"_id": "s1", "ownerId": "shared", "title": "Cancellazione condivisa", "updatedAt": datetime(2024, 1, 1)})
+        first = asyncio.create_task(get_index(db, "shared"))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(get_index(db, "shared"))
+        await asyncio.sleep(0.01)
+        first.cancel()  # client disconnesso
+        index = await second
+        await asyncio.gather(first, return_exceptions=True)
+        return first.cancelled(), index, search_indexes.get("shared")
+
+    search_indexes.clear()
+    cancelled, index, cached = asyncio.run(main())
+    assert cancelled and cached is index and "s1" in index.by_key
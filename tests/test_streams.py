@@ -0,0 +1,131 @@
+import asyncio
+import json
+
+import streams
+from streams import Coalescer, StreamBuffer, StreamRegistry
+
+
+def frames_to_events(frames):
+    out = []
+    for f in frames:
+        f = f.decode() if isinstance(f, bytes) else f
+        head, data = f.strip().split("\n")
+        out.append((int(head[4:]), json.loads(data[6:])))
+    return out
+
+
+async def collect(buf, last_id=0):
+    return [f async for f in buf.subscribe(last_id)]
+
+
+def test_replay_from_last_event_id_then_tail_live():
+    async def main():
+        buf = StreamBuffer("u", "m")
+        for i in range(3):
+            buf.publish(json.dumps({"type": "chunk", "delta": str(i)}))
+        sub = asyncio.create_task(collect(buf, last_id=1))
+        await asyncio.sleep(0)
+        buf.publish(json.dumps({"type": "chunk", "delta": "3"}))
+        buf.publish(json.dumps({"type": "end"}))
+        buf.finish()
+        return await sub
+
+    events = frames_to_events(asyncio.run(main()))
+    assert [seq for seq, _ in events] == [2, 3, 4, 5]
+    assert [e.get("delta") for _, e in events] == ["1", "2", "3", None]
+
+
+def test_gap_beyond_ring_buffer_sends_snapshot():
+    async def main():
+        buf = StreamBuffer("u", "m", snapshot=lambda: "0123456789", maxlen=4)
+        for i in range(10):
+            buf.publish_chunk(str(i))
+        buf.publish(json.dumps({"type": "end", "messageId": "m"}))
+        buf.finish()
+        return await collect(buf, last_id=2)
+
+    events = frames_to_events(asyncio.run(main()))
+    # lo snapshot sostituisce solo i chunk: l'end che lo segue nel ring arriva comunque
+    assert events == [(10, {"type": "snapshot", "content": "0123456789"}), (11, {"type": "end", "messageId": "m"})]
+
+
+def test_snapshot_excludes_deltas_still_in_coalescer():
+    async def main():
+        text = []
+        buf = StreamBuffer("u", "m", snapshot=lambda: "".join(text), maxlen=2)
+        out = Coalescer(buf, max_bytes=1024, max_delay=10)
+        for i in range(10):
+            text.append(f"d{i} ")  # come StreamWriter.add, prima del Coalescer
+            out.add(f"d{i} ")
+            if i < 7:
+                out.flush()
+        sub = asyncio.create_task(collect(buf, last_id=1))
+        await asyncio.sleep(0)
+        out.flush()
+        buf.finish()
+        return await sub
+
+    events = frames_to_events(asyncio.run(main()))
+    rebuilt = "".join(e.get("content", e.get("delta", "")) for _, e in events)
+    assert rebuilt == "".join(f"d{i} " for i in range(10))
+
+
+def test_coalescer_merges_deltas_by_delay_and_size():
+    async def main():
+        buf = StreamBuffer("u", "m")
+        out = Coalescer(buf, max_bytes=8, max_delay=0.05)
+        for d in ("a", "b", 'c"', "è\n"):
+            out.add(d)
+        await asyncio.sleep(0.1)
+        out.add("12345678")
+        out.add("x")
+        out.flush()
+        buf.finish()
+        return await collect(buf)
+
+    events = frames_to_events(asyncio.run(main()))
+    # primo delta subito, poi uniti per tempo, poi per dimensione; l'escape resta JSON valido
+    assert [e["delta"] for _, e in events] == ["a", 'bc"è\n', "12345678", "x"]
+
+
+def test_orphaned_generation_is_cancelled_after_grace(monkeypatch):
+    monkeypatch.setattr(streams, "STREAM_ORPHAN_GRACE", 0.01)
+
+    async def main():
+        buf = StreamBuffer("u", "m")
+        task = asyncio.create_task(asyncio.sleep(10))
+        buf.canceller = task.cancel
+        sub = buf.subscribe(0)
+        buf.publish("{}")
+        await sub.__anext__()
+        await sub.aclose()
+        await asyncio.sleep(0.05)
+        return task.cancelled()
+
+    assert asyncio.run(main())
+
+
+def test_registry_checks_owner_and_evicts_finished():
+    async def main():
+        reg = StreamRegistry(ttl=0)
+        buf = reg.create("u", "m")
+        assert reg.get(buf.id, "other") is None
+        assert reg.get(buf.id, "u") is buf
+        buf.finish()
+        reg.evict()
+        return reg.get(buf.id, "u")
+
+    assert asyncio.run(main()) is None
+
+
+def test_resume_endpoint_replays_after_last_event_id(api):
+    sid = api.post("/api/sessions").json()["id"]
+    with api.stream("POST", "/api/chat/stream", json={"sessionId": sid, "model": "gpt-4o-mini", "content": "ciao"}) as resp:
+        events = frames_to_events([f + "\n\n" for f in resp.read().decode().split("\n\n") if f.strip()])
+    start = events[0][1]
+    assert start["type"] == "start" and events[-1][1] == {"type": "end", "messageId": start["messageId"]}
+
+    resumed = api.get(f"/api/chat/stream/{start['streamId']}", headers={"Last-Event-ID": "1"})
+    replay = frames_to_events([f + "\n\n" for f in resumed.text.split("\n\n") if f.strip()])
+    assert replay == events[1:]
+    assert api.get("/api/chat/stream/unknown").status_code == 404
@@ -0,0 +1,40 @@
+import asyncio
+
+import httpx
+
+import upstream
+from bench.fake_llm import create_app
+
+
+def run_with_fake(coro_fn, **fake_kwargs):
+    async def main():
+        upstream._client = httpx.AsyncClient(transport=httpx.ASGITransport(app=create_app(tps=0, **fake_kwargs)))
+        try:
+            return await coro_fn()
+        finally:
+            await upstream.close_client()
+    return asyncio.run(main())
+
+
+async def collect():
+    return [d async for d in upstream.stream_chat_completion({"model": "fake", "messages": []}, "k", base_url="http://fake/v1")]
+
+
+def test_parse_sse_line():
+    assert upstream.parse_sse_line('data: {"choices":[{"delta":{"content":"ciao"}}]}') == "ciao"
+    assert upstream.parse_sse_line("data: [DONE]") is None
+    assert upstream.parse_sse_line(": keep-alive") == ""
+    assert upstream.parse_sse_line("data: not-json") == ""
+
+
+def test_stream_chat_completion_against_fake_provider():
+    assert run_with_fake(collect, tokens=5) == [f"tok{i} " for i in range(5)]
+
+
+def test_stream_chat_completion_raises_on_http_error():
+    try:
+        run_with_fake(collect, fail_rate=1.0)
+    except upstream.UpstreamError as e:
+        assert "500" in str(e)
+    else:
+        raise AssertionError("expected UpstreamError")
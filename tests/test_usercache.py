@@ -0,0 +1,39 @@
+import time
+
+from usercache import UserCache
+
+
+def user(uid):
+    return {"id": uid, "email": f"{uid}@example.com"}
+
+
+def test_hit_miss_and_lru_eviction():
+    cache = UserCache(maxsize=2, ttl=60)
+    cache.set("t1", user("a"))
+    cache.set("t2", user("b"))
+    assert cache.get("t1")["id"] == "a"
+    cache.set("t3", user("c"))
+    assert cache.get("t2") is None
+    assert cache.get("t3")["id"] == "c"
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["size"]) == (2, 1, 1, 2)
+
+
+def test_ttl_and_max_age():
+    cache = UserCache(maxsize=10, ttl=60)
+    cache.set("t1", user("a"), max_age=0.01)
+    cache.set("t2", user("a"), max_age=-1)
+    time.sleep(0.02)
+    assert cache.get("t1") is None
+    assert cache.get("t2") is None
+
+
+def test_invalidate_user_drops_every_token():
+    cache = UserCache(maxsize=10, ttl=60)
+    cache.set("t1", user("a"))
+    cache.set("t2", user("a"))
+    cache.set("t3", user("b"))
+    cache.invalidate_user("a")
+    assert cache.get("t1") is None and cache.get("t2") is None
+    assert cache.get("t3")["id"] == "b"
+    assert cache.stats()["invalidations"] == 2